@@ -5,7 +5,16 @@ OCR2LATEX 主处理脚本
 """
 
 import sys
+import time
+
+# 启动计时起点
+_STARTUP_T0 = time.perf_counter()
+
+import os
+import atexit
+import signal
 import logging
+import threading
 from pathlib import Path
 import argparse
 from datetime import datetime
@@ -13,22 +22,49 @@ from datetime import datetime
 # 添加src目录到Python路径
 sys.path.insert(0, str(Path(__file__).parent / 'src'))
 
-from src.config import LOG_LEVEL, LOG_FORMAT
-from src.image_processor import image_processor
-from src.mathpix_client import mathpix_client
-from src.result_processor import result_processor
+# 注意: image_processor / mathpix_client / result_processor 会间接加载
+# cv2、numpy、PIL、requests，只在真正处理图像时才导入
+from src.config import LOG_JSON, TRACE_FILE, VARIANT_RETRY_ENABLED
+from src.log_context import setup_logging as setup_queued_logging
+
+# 启动阶段时间点
+_startup_marks = []
+
+# 启动耗时报告中关注的重量级依赖
+HEAVY_MODULES = ('cv2', 'numpy', 'PIL', 'requests')
+
+
+def mark_startup(label: str):
+    """
+    记录启动阶段时间点
+    
+    Args:
+        label: 阶段名称
+    """
+    _startup_marks.append((label, time.perf_counter()))
+
+
+def print_startup_report():
+    """输出启动耗时报告（写到stderr，不影响正常输出）"""
+    mark_startup('退出')
+    
+    lines = ["\n⏱️  启动耗时报告:"]
+    previous = _STARTUP_T0
+    for label, timestamp in _startup_marks:
+        lines.append(
+            f"   • {label}: +{(timestamp - previous) * 1000:.1f} ms "
+            f"(累计 {(timestamp - _STARTUP_T0) * 1000:.1f} ms)"
+        )
+        previous = timestamp
+    
+    loaded = [name for name in HEAVY_MODULES if name in sys.modules]
+    lines.append(f"   • 已加载的重量级依赖: {', '.join(loaded) if loaded else '无'}")
+    print('\n'.join(lines), file=sys.stderr)
 
 
 def setup_logging():
-    """设置日志配置"""
-    logging.basicConfig(
-        level=getattr(logging, LOG_LEVEL),
-        format=LOG_FORMAT,
-        handlers=[
-            logging.StreamHandler(sys.stdout),
-            logging.FileHandler('ocr2latex.log', encoding='utf-8')
-        ]
-    )
+    """设置日志配置（队列异步写入，--log-json 输出结构化日志）"""
+    setup_queued_logging(json_format=LOG_JSON or '--log-json' in sys.argv)
 
 
 def print_banner():
@@ -74,96 +110,56 @@ def validate_image_path(image_path: str) -> bool:
     return True
 
 
-def process_image(image_path: str) -> dict:
+def process_image(image_path: str, 
+                  quiet: bool = False,
+                  source_sha256: str = None,
+                  fingerprint: str = None,
+                  variant_retrier=None,
+                  job_id: str = None,
+                  frame: int = None,
+                  output_name: str = None) -> dict:
     """
-    处理单张图像
+    处理单张图像（使用默认流水线）
     
     Args:
         image_path: 图像文件路径
+        quiet: 是否关闭控制台输出（守护进程等并发场景）
+        source_sha256: 源文件哈希（已计算过时传入，避免重复读取）
+        fingerprint: 流水线配置指纹
+        variant_retrier: 低置信度多变体重试器，None表示不重试
+        job_id: 任务ID（写入该图像处理期间的每条日志），None时自动生成
+        frame: 多页TIFF的帧序号，None表示单帧图像
+        output_name: 输入相对于输入根目录的路径，用于命名结果文件，None时使用文件名
         
     Returns:
         处理结果
     """
-    logger = logging.getLogger(__name__)
+    from src.pipeline import get_pipeline
     
-    print(f"\n🔄 开始处理图像: {Path(image_path).name}")
-    print("=" * 60)
+    return get_pipeline().process(image_path,
+                                  source_sha256=source_sha256,
+                                  fingerprint=fingerprint,
+                                  variant_retrier=variant_retrier,
+                                  job_id=job_id,
+                                  verbose=not quiet,
+                                  frame=frame,
+                                  output_name=output_name)
+
+
+def process_document(image_path: str, quiet: bool = True) -> dict:
+    """
+    处理文件中的每一帧（守护进程模式使用，多页TIFF全部成功才算成功）
     
-    try:
-        # 步骤1: 获取图像信息
-        print("📋 步骤 1/5: 获取图像信息...")
-        image_info = image_processor.get_image_info(image_path)
-        if not image_info:
-            return {'success': False, 'error': '无法获取图像信息'}
-        
-        print(f"   ✅ 图像尺寸: {image_info['size'][0]} × {image_info['size'][1]}")
-        print(f"   ✅ 文件大小: {image_info['file_size'] / 1024:.1f} KB")
-        print(f"   ✅ 图像格式: {image_info['format']}")
-        
-        # 步骤2: 图像预处理
-        print("\n🔧 步骤 2/5: 图像预处理...")
-        preprocess_result = image_processor.preprocess_image(image_path)
-        if preprocess_result is None:
-            return {'success': False, 'error': '图像预处理失败'}
-        
-        processed_image, process_info = preprocess_result
-        print(f"   ✅ 预处理完成: {' → '.join(process_info['preprocessing_steps'])}")
-        
-        # 步骤3: 转换为base64
-        print("\n📦 步骤 3/5: 图像编码...")
-        image_base64 = image_processor.image_to_base64(processed_image)
-        if not image_base64:
-            return {'success': False, 'error': '图像编码失败'}
-        
-        print(f"   ✅ Base64编码完成: {len(image_base64)} 字符")
-        
-        # 步骤4: OCR识别
-        print("\n🤖 步骤 4/5: OCR识别...")
-        
-        # 检查API凭证
-        if not mathpix_client.check_credentials():
-            return {'success': False, 'error': 'Mathpix API凭证未配置或无效'}
-        
-        # 显示API使用信息
-        usage_info = mathpix_client.get_usage_info()
-        print(f"   📊 API使用情况: {usage_info['usage_count']}/1000 (剩余: {usage_info['remaining']})")
-        
-        # 执行OCR
-        ocr_result = mathpix_client.process_image(image_base64)
-        
-        if not ocr_result['success']:
-            error_msg = ocr_result.get('error', '未知错误')
-            print(f"   ❌ OCR识别失败: {error_msg}")
-            return {'success': False, 'error': f'OCR识别失败: {error_msg}'}
-        
-        print(f"   ✅ OCR识别成功!")
-        print(f"   📊 置信度: {ocr_result['confidence']:.2%}")
-        print(f"   ⏱️  处理时间: {ocr_result['processing_time']:.2f}秒")
-        print(f"   📝 识别字符: {len(ocr_result['raw_text'])} 个")
-        
-        # 步骤5: 保存结果
-        print("\n💾 步骤 5/5: 保存结果...")
-        
-        save_result = result_processor.process_and_save_results(
-            image_info, ocr_result, process_info
-        )
-        
-        if not save_result['success']:
-            return {'success': False, 'error': f"保存结果失败: {save_result.get('error', '未知错误')}"}
-        
-        print(f"   ✅ JSON结果: {save_result['json_path']}")
-        print(f"   ✅ HTML页面: {save_result['html_path']}")
-        
-        return {
-            'success': True,
-            'image_info': image_info,
-            'ocr_result': ocr_result,
-            'save_result': save_result
-        }
-        
-    except Exception as e:
-        logger.error(f"处理图像时发生异常: {e}", exc_info=True)
-        return {'success': False, 'error': f'处理异常: {str(e)}'}
+    Args:
+        image_path: 图像文件路径
+        quiet: 是否关闭控制台输出
+    
+    Returns:
+        处理结果
+    """
+    from src.pipeline import get_pipeline
+    
+    return get_pipeline().process_document(image_path, verbose=not quiet)
 
 
 def print_results_summary(result: dict):
@@ -219,8 +215,377 @@ def print_results_summary(result: dict):
     print(f"   • JSON文件包含完整的识别数据")
 
 
+def flush_results() -> int:
+    """
+    等待后台写入的结果文件全部落盘
+    
+    Returns:
+        写入失败的文件数
+    """
+    from src.result_writer import get_result_writer
+    
+    writer = get_result_writer()
+    writer.flush()
+    failed = writer.get_stats()['failed']
+    if failed:
+        print(f"   ⚠️  {failed} 个结果文件写入失败，详见日志")
+    return failed
+
+
+def record_when_written(manifest, path, written, sha256: str, fingerprint: str, json_path: str):
+    """
+    结果文件全部写入成功后记录到增量清单（在写入线程中执行，写入失败时不记录，下次运行重新处理）
+    
+    Args:
+        manifest: ResultManifest
+        path: 源文件路径
+        written: 结果文件写入完成的Future
+        sha256: 源文件哈希
+        fingerprint: 流水线指纹
+        json_path: 结果JSON路径
+    """
+    def on_written(future):
+        if future.result():
+            manifest.record(path, sha256, fingerprint, json_path)
+    
+    written.add_done_callback(on_written)
+
+
+def collect_image_paths(paths: list) -> list:
+    """
+    收集要处理的图像文件（目录会递归展开）
+    
+    每个文件同时给出相对于全部输入的公共上级目录的路径，用于命名结果文件，
+    不同子目录中的同名文件不会写到同一个结果文件
+    
+    Args:
+        paths: 命令行传入的文件或目录路径
+        
+    Returns:
+        (图像文件路径, 相对路径) 列表，存在无效路径时返回None
+    """
+    from src.config import SUPPORTED_FORMATS
+    
+    image_paths = []
+    roots = []
+    for raw_path in paths:
+        path = Path(raw_path)
+        if path.is_dir():
+            image_paths.extend(sorted(
+                p for p in path.rglob('*')
+                if p.is_file() and p.suffix.lower() in SUPPORTED_FORMATS
+            ))
+            roots.append(path.absolute())
+        elif validate_image_path(raw_path):
+            image_paths.append(path)
+            roots.append(path.absolute().parent)
+        else:
+            return None
+    
+    if not image_paths:
+        return []
+    root = Path(os.path.commonpath(roots))
+    return [(path, path.absolute().relative_to(root).as_posix()) for path in image_paths]
+
+
+def run_batch(image_paths: list, 
+              force: bool = False, 
+              since: float = None,
+              variant_retrier=None,
+              priority: str = 'normal',
+              workers: int = None) -> int:
+    """
+    批量处理图像，跳过内容和配置均未变化的输入
+    
+    Args:
+        image_paths: (图像文件路径, 相对路径) 列表（见 collect_image_paths）
+        force: 是否强制重新处理所有输入
+        since: 只处理修改时间晚于该时间戳的输入
+        variant_retrier: 低置信度多变体重试器
+        priority: 调度优先级类别
+        workers: 同时处理的输入数，None时使用该优先级类别的并发上限
+        
+    Returns:
+        退出码
+    """
+    from concurrent.futures import as_completed
+    from src.image_processor import image_processor
+    from src.incremental import ResultManifest, pipeline_fingerprint
+    from src.mathpix_client import mathpix_client
+    from src.progress import BatchProgress
+    from src.result_writer import all_written
+    from src.scheduler import JobScheduler
+    
+    manifest = ResultManifest()
+    fingerprint = pipeline_fingerprint()
+    total = len(image_paths)
+    
+    # 由调度器按优先级类别的并发上限和剩余额度执行
+    scheduler = JobScheduler(concurrency={priority: workers} if workers else None)
+    concurrency = scheduler.classes[priority]['concurrency']
+    print(f"\n📂 共 {total} 个输入，流水线指纹: {fingerprint}，优先级: {priority}（并发 {concurrency}）")
+    progress = BatchProgress(total, in_flight=mathpix_client.credentials.in_flight)
+    jobs = {}
+    # 账号全部失效（error_info['fatal']）后不再提交和派发剩余任务，这些输入按推迟统计
+    stop = threading.Event()
+    stopped_count = 0
+    
+    def stop_on_fatal(future):
+        # 在worker线程中立即取消排队中的任务，不等主线程处理到该结果
+        if not future.cancelled() and future.exception() is None:
+            if (future.result().get('error_info') or {}).get('fatal'):
+                stop.set()
+                scheduler.cancel_pending()
+    
+    # 多页文件的每一帧是单独的任务，全部成功后才记录到清单: 路径 -> [剩余帧数, 第一帧的结果路径, 各帧的写入Future]
+    pending_frames = {}
+    
+    with progress:
+        for index, (path, name) in enumerate(image_paths, 1):
+            if stop.is_set():
+                stopped_count = total - index + 1
+                progress.add('deferred', stopped_count)
+                break
+            
+            if since is not None and path.stat().st_mtime < since:
+                progress.add('skipped')
+                continue
+        
+            source_sha256 = None
+            if not force:
+                up_to_date, source_sha256 = manifest.check(path, fingerprint, name)
+                if up_to_date:
+                    progress.add('skipped')
+                    continue
+    
+            n_frames = image_processor.count_frames(str(path))
+            if n_frames > 1:
+                progress.total += n_frames - 1
+                pending_frames[path] = [n_frames, None, []]
+            
+            for frame in range(n_frames) if n_frames > 1 else [None]:
+                future = scheduler.submit(process_image, str(path), quiet=True,
+                                          source_sha256=source_sha256, fingerprint=fingerprint,
+                                          variant_retrier=variant_retrier, frame=frame,
+                                          output_name=name, priority=priority)
+                future.add_done_callback(stop_on_fatal)
+                suffix = f" 第 {frame + 1}/{n_frames} 帧" if frame is not None else ''
+                jobs[future] = (f"[{index}/{total}] {path}{suffix}", path, frame)
+        
+        if stop.is_set():
+            # 提交过程中停止时，最后提交的任务可能还在排队
+            scheduler.cancel_pending()
+        scheduler.close(wait=False)
+        
+        stopped = None
+        # 按完成顺序统计；逐张成功信息由进度显示汇总，只单独输出失败的输入
+        for future in as_completed(jobs):
+            prefix, path, frame = jobs[future]
+            fatal = False
+            if not future.cancelled():
+                result = future.result()
+                fatal = bool((result.get('error_info') or {}).get('fatal'))
+        
+            if future.cancelled() or (fatal and stopped is not None):
+                progress.add('deferred')
+                stopped_count += 1
+            elif result.get('deferred'):
+                progress.add('deferred')
+            elif result['success']:
+                progress.add('completed')
+                json_path = result['save_result']['json_path']
+                written = result['written']
+                if frame is not None:
+                    remaining = pending_frames[path]
+                    remaining[0] -= 1
+                    remaining[2].append(written)
+                    if frame == 0:
+                        remaining[1] = json_path
+                    if remaining[0] > 0 or remaining[1] is None:
+                        continue
+                    json_path = remaining[1]
+                    written = all_written(remaining[2])
+                record_when_written(manifest, path, written, result['metadata']['source_sha256'],
+                                    fingerprint, json_path)
+            else:
+                progress.add('failed')
+                progress.print(f"   ❌ {prefix}: {result['error']}")
+                if fatal:
+                    stopped = result['error']
+                    progress.print("   ⛔ 账号不可用，已停止提交剩余的输入")
+    
+    write_failed = flush_results()
+    counts = progress.counts
+    print(f"\n📊 处理 {counts['completed']}，跳过 {counts['skipped']}，失败 {counts['failed']}")
+    if stopped is not None:
+        print(f"   ⛔ {stopped_count} 个输入因账号不可用未处理（{stopped}），恢复后重新运行即可继续")
+    if counts['deferred'] > stopped_count:
+        print(f"   ⏸️  {counts['deferred'] - stopped_count} 个输入因API剩余额度低于 {priority} 类保留值被推迟，"
+              f"额度恢复后重新运行即可继续")
+    if variant_retrier is not None:
+        budget = variant_retrier.get_budget_info()
+        print(f"   🔁 多变体重试额外调用: {budget['spent']}/{budget['batch_budget']}")
+    return 0 if counts['failed'] == 0 and not write_failed else 1
+
+
+def run_stream(sources: list) -> int:
+    """
+    流式处理任意图像来源（目录、对象存储镜像、tar包、标准输入的路径列表）
+    
+    Args:
+        sources: 输入来源（"-" 表示从标准输入读取路径）
+    
+    Returns:
+        退出码
+    """
+    from src.progress import BatchProgress
+    from src.streaming import StreamingEngine, iter_sources
+    
+    engine = StreamingEngine()
+    progress = BatchProgress(in_flight=engine.pipeline.mathpix_client.credentials.in_flight)
+    
+    workers = ', '.join(f"{stage.name}×{stage.workers}" for stage in engine.stages)
+    print(f"\n🌊 流式处理: {', '.join(sources)}（{workers}，队列容量 {engine.queue_size}）")
+    
+    with progress:
+        for result in engine.run(iter_sources(sources)):
+            if result['success']:
+                progress.add('completed')
+            else:
+                progress.add('failed')
+                progress.print(f"   ❌ {result['image_path']} ({result['stage']}): {result['error']}")
+    
+    write_failed = flush_results()
+    counts = progress.counts
+    print(f"\n📊 处理 {counts['completed']}，失败 {counts['failed']}")
+    for name, stage in engine.stats().items():
+        print(f"   • {name}: 处理 {stage['processed']}，队列最大深度 "
+              f"{stage['max_queue_depth']}/{stage['queue_capacity']}，"
+              f"等待下游 {stage['blocked_seconds']:.2f}秒")
+    return 0 if counts['failed'] == 0 and not write_failed else 1
+
+
+def run_export(output_path: str, sources: list, order: str, title: str = None) -> int:
+    """
+    将识别结果导出为一个LaTeX题集文档
+    
+    Args:
+        output_path: 输出的.tex文件路径
+        sources: 结果目录或结果JSON文件（按给定顺序）
+        order: 目录内结果的排序方式
+        title: 文档标题
+        
+    Returns:
+        退出码
+    """
+    from src.latex_export import export_latex
+    
+    print(f"\n📄 导出LaTeX题集: {output_path}")
+    export_result = export_latex(output_path, sources=sources, order=order, title=title)
+    
+    if not export_result['success']:
+        print(f"   ❌ 导出失败: {export_result['error']}")
+        return 1
+    
+    print(f"   ✅ 题目数量: {export_result['problem_count']}，跳过失败结果: {export_result['skipped']}")
+    print(f"   💡 使用 xelatex 编译: xelatex {output_path}")
+    return 0
+
+
+def run_search(formula: str, limit: int, reindex: bool = False) -> int:
+    """
+    在公式索引中查找相同或相似的公式
+    
+    Args:
+        formula: 要查找的LaTeX公式（为空时只重建索引）
+        limit: 最多显示的条数
+        reindex: 是否先从结果目录重建索引
+        
+    Returns:
+        退出码
+    """
+    from src.formula_index import FormulaIndex
+    
+    index = FormulaIndex()
+    
+    if reindex:
+        stats = index.rebuild()
+        print(f"\n🗂️  索引重建完成: {stats['results']} 个结果，{stats['formulas']} 个公式")
+    
+    if not formula:
+        return 0
+    
+    start_time = datetime.now()
+    matches = index.search(formula, limit=limit)
+    elapsed = (datetime.now() - start_time).total_seconds() * 1000
+    
+    print(f"\n🔎 查找公式: {formula}  ({elapsed:.1f} ms)")
+    if not matches:
+        print("   未找到相同或相似的公式")
+        return 1
+    
+    for match in matches:
+        tag = '精确' if match['exact'] else f"{match['score']:.0%}"
+        print(f"   • [{tag}] {match['filename']} ({match['location']}): {match['latex']}")
+        print(f"     {match['result_path']}")
+    return 0
+
+
+def run_watch_mode(workers: int, priority: str = 'interactive') -> int:
+    """
+    守护进程模式：监视上传目录并增量处理新图像
+    
+    Args:
+        workers: 常驻worker数量
+        priority: 调度优先级类别
+        
+    Returns:
+        退出码
+    """
+    from src.config import UPLOAD_DIR, PROCESSED_DIR, FAILED_DIR
+    from src.image_processor import image_processor
+    from src.scheduler import JobScheduler
+    from src.watcher import FolderWatcher
+    
+    # 调度器中该类别的并发上限与worker数量一致，多页文件按帧数预估额度消耗
+    scheduler = JobScheduler(concurrency={priority: workers})
+    watcher = FolderWatcher(
+        handler=lambda path: scheduler.submit(process_document, path, priority=priority,
+                                              cost=image_processor.count_frames(str(path))).result(),
+        workers=workers
+    )
+    
+    def handle_signal(signum, frame):
+        print("\n⏹️  收到停止信号，等待进行中的任务完成...")
+        watcher.stop()
+        # 因额度不足等待中的任务立即返回推迟结果，输入文件留在监视目录
+        scheduler.close(wait=False)
+    
+    signal.signal(signal.SIGINT, handle_signal)
+    signal.signal(signal.SIGTERM, handle_signal)
+    
+    print(f"👀 监视目录: {UPLOAD_DIR}")
+    print(f"   • 成功的输入移动到: {PROCESSED_DIR}")
+    print(f"   • 失败的输入移动到: {FAILED_DIR}")
+    print(f"   • worker数量: {workers}，按 Ctrl+C 停止")
+    
+    watcher.run()
+    scheduler.close()
+    # 等待剩余结果写入（写入完成后才移动对应的输入文件）
+    write_failed = flush_results()
+    
+    stats = watcher.stats
+    print(f"\n📊 成功 {stats['processed']}，失败 {stats['failed']}，暂缓 {stats['parked']}")
+    return 0 if not write_failed else 1
+
+
 def main():
     """主函数"""
+    # 启动耗时报告（--help 会在解析参数时直接退出，因此提前检查）
+    if '--startup-timing' in sys.argv or os.getenv('OCR2LATEX_STARTUP_TIMING'):
+        atexit.register(print_startup_report)
+    mark_startup('模块导入')
+    
     # 设置日志
     setup_logging()
     logger = logging.getLogger(__name__)
@@ -237,6 +602,20 @@ def main():
   python main.py image.jpg              # 处理单张图片
   python main.py /path/to/math.png      # 使用绝对路径
   python main.py --help                 # 显示帮助信息
+  python main.py image.jpg --startup-timing  # 输出启动耗时报告
+  python main.py --watch --workers 8    # 守护进程模式，监视 uploads/ 目录
+  python main.py scans/ --replay cassettes/scans.jsonl  # 离线回放录制的Mathpix响应
+  python main.py scans/ --profile prof.folded  # 采样分析，输出火焰图用的折叠调用栈和热点函数
+  python main.py scans/ --trace trace.json  # 记录各阶段span，可在 chrome://tracing 或 Perfetto 中查看
+  python main.py scans/                 # 批量处理目录，跳过已处理且未变化的图像
+  python main.py scans/ --since 2d      # 只处理最近两天修改过的图像
+  python main.py scans/ --force         # 忽略已有结果，全部重新处理
+  python main.py --stream scans.tar.gz  # 流式处理tar包（各阶段之间有界队列）
+  find scans -name '*.png' | python main.py --stream -  # 从标准输入读取路径流式处理
+  python main.py --export-tex exam.tex  # 将 results/ 中的结果导出为LaTeX题集
+  python main.py --export-tex exam.tex a_result.json b_result.json  # 按给定顺序导出
+  python main.py --search "\\frac{1}{2}"  # 查找是否识别过相同或相似的公式
+  python main.py --reindex              # 从 results/ 重建公式索引
 
 支持的图像格式: JPG, PNG, BMP, TIFF, PDF
         """
@@ -244,7 +623,98 @@ def main():
     
     parser.add_argument(
         'image_path',
-        help='要处理的图像文件路径'
+        nargs='*',
+        help='要处理的图像文件或目录路径'
+    )
+    
+    parser.add_argument(
+        '--force',
+        action='store_true',
+        help='强制重新处理，即使源文件和配置都未变化'
+    )
+    
+    parser.add_argument(
+        '--since',
+        help='只处理在此之后修改过的输入（如 6h、7d 或 2024-11-06）'
+    )
+    
+    parser.add_argument(
+        '--stream',
+        action='store_true',
+        help='流式处理：位置参数可以是目录、"目录::键前缀"、tar包或 -（从标准输入读取路径），'
+             '解码/OCR/写入各阶段之间为有界队列'
+    )
+    
+    parser.add_argument(
+        '--retry-variants',
+        action='store_true',
+        default=VARIANT_RETRY_ENABLED,
+        help='置信度低于阈值时并发尝试其他预处理变体，保留置信度最高的结果（默认使用配置 VARIANT_RETRY_ENABLED）'
+    )
+    
+    parser.add_argument(
+        '--variant-budget',
+        type=int,
+        default=None,
+        help='本次运行多变体重试最多额外调用API的次数（默认使用配置 VARIANT_BATCH_BUDGET）'
+    )
+    
+    parser.add_argument(
+        '--export-tex',
+        metavar='OUTPUT',
+        help='导出LaTeX题集文档；位置参数为结果目录或结果JSON文件（默认 results/）'
+    )
+    
+    parser.add_argument(
+        '--order',
+        choices=['name', 'created', 'mtime'],
+        default='name',
+        help='导出时目录内结果的排序方式（默认按文件名）'
+    )
+    
+    parser.add_argument(
+        '--title',
+        help='导出文档的标题'
+    )
+    
+    parser.add_argument(
+        '--search',
+        metavar='LATEX',
+        help='在已识别的公式中查找相同或相似的公式'
+    )
+    
+    parser.add_argument(
+        '--reindex',
+        action='store_true',
+        help='从结果目录重建公式索引'
+    )
+    
+    parser.add_argument(
+        '--limit',
+        type=int,
+        default=10,
+        help='查找时最多显示的条数（默认10）'
+    )
+    
+    parser.add_argument(
+        '--watch',
+        action='store_true',
+        help='守护进程模式：监视上传目录，增量处理新图像'
+    )
+    
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=None,
+        help='同时处理的输入数（守护进程模式默认使用配置 WATCH_WORKERS，批量处理默认使用优先级类别的并发上限）'
+    )
+    
+    parser.add_argument(
+        '--priority',
+        choices=['interactive', 'normal', 'bulk'],
+        default=None,
+        help='调度优先级（默认: 单张图像和守护进程为 interactive，批量为 normal）；'
+             '剩余API额度低于该类别的保留值时任务被推迟'
     )
     
     parser.add_argument(
@@ -253,28 +723,216 @@ def main():
         help='显示详细日志信息'
     )
     
+    parser.add_argument(
+        '--transport',
+        choices=['multipart', 'json'],
+        default=None,
+        help='图像上传方式：multipart 直接发送图像字节（默认），json 为base64写入请求体的旧方式'
+    )
+    
+    parser.add_argument(
+        '--record',
+        metavar='CASSETTE',
+        help='录制每次OCR请求的指纹、原始响应和耗时到该文件（JSON Lines，追加写入）'
+    )
+    
+    parser.add_argument(
+        '--replay',
+        metavar='CASSETTE',
+        help='回放录制的响应，不访问网络、不消耗额度；未录制的请求返回 cassette_miss 错误'
+    )
+    
+    parser.add_argument(
+        '--replay-latency',
+        action='store_true',
+        help='回放时按录制的耗时等待（用于端到端吞吐量测试）'
+    )
+    
+    parser.add_argument(
+        '--compact-json',
+        action='store_true',
+        help='结果JSON不缩进，编码更快、文件更小（也可设置环境变量 OCR2LATEX_JSON_COMPACT=1）'
+    )
+    
+    parser.add_argument(
+        '--hedge',
+        action='store_true',
+        help='启用对冲请求：请求超过p95延迟仍未返回时发送重复请求，取先返回者'
+    )
+    
+    parser.add_argument(
+        '--trace',
+        metavar='TRACE_JSON',
+        help='记录每个任务的各阶段span，退出时写出Chrome trace-event JSON（也可设置环境变量 OCR2LATEX_TRACE）'
+    )
+    
+    parser.add_argument(
+        '--profile',
+        metavar='FOLDED',
+        help='采样分析各阶段的调用栈，退出时写出折叠调用栈（可用flamegraph.pl/speedscope生成火焰图），'
+             '热点函数摘要同时输出到终端和 FOLDED.txt'
+    )
+    
+    parser.add_argument(
+        '--profile-memory',
+        action='store_true',
+        help='与 --profile 一起使用：用tracemalloc统计各处理函数中占用最大的内存分配位置'
+    )
+    
+    parser.add_argument(
+        '--log-json',
+        action='store_true',
+        help='日志输出为JSON行格式，每条记录带任务ID（也可设置环境变量 OCR2LATEX_LOG_JSON=1）'
+    )
+    
+    parser.add_argument(
+        '--startup-timing',
+        action='store_true',
+        help='退出时输出启动耗时报告（也可设置环境变量 OCR2LATEX_STARTUP_TIMING=1）'
+    )
+    
     # 检查参数
     if len(sys.argv) == 1:
         parser.print_help()
         sys.exit(1)
     
     args = parser.parse_args()
+    mark_startup('参数解析')
     
     # 设置详细日志
     if args.verbose:
         logging.getLogger().setLevel(logging.DEBUG)
     
+    trace_file = args.trace or TRACE_FILE
+    if trace_file:
+        from src.tracing import tracer
+        tracer.enable()
+        atexit.register(tracer.export, trace_file)
+    
+    if args.profile:
+        from src.profiler import SamplingProfiler
+        profiler = SamplingProfiler(memory=args.profile_memory)
+        profiler.start()
+        atexit.register(lambda: print('\n' + profiler.export(args.profile)))
+    
+    if args.compact_json:
+        from src.result_processor import result_processor
+        result_processor.json_compact = True
+    
+    if args.hedge:
+        from src.mathpix_client import mathpix_client
+        mathpix_client.hedge = True
+    
+    if args.transport:
+        from src.mathpix_client import mathpix_client
+        mathpix_client.transport = args.transport
+    
+    if args.record or args.replay:
+        from src.cassette import Cassette
+        from src.mathpix_client import mathpix_client
+        mode = 'replay' if args.replay else 'record'
+        try:
+            mathpix_client.cassette = Cassette(args.replay or args.record, mode,
+                                               replay_latency=args.replay_latency)
+        except OSError as e:
+            print(f"❌ 错误: 无法读取录制文件 - {e}")
+            sys.exit(1)
+    
+    if args.export_tex:
+        sys.exit(run_export(args.export_tex, args.image_path, args.order, args.title))
+    
+    if args.search or args.reindex:
+        sys.exit(run_search(args.search, args.limit, reindex=args.reindex))
+    
+    if args.watch:
+        from src.config import WATCH_WORKERS
+        sys.exit(run_watch_mode(args.workers or WATCH_WORKERS, priority=args.priority or 'interactive'))
+    
+    if not args.image_path:
+        parser.print_help()
+        sys.exit(1)
+    
+    if args.stream:
+        try:
+            sys.exit(run_stream(args.image_path))
+        except KeyboardInterrupt:
+            print("\n\n⚠️  用户中断操作")
+            sys.exit(130)
+    
+    since = None
+    if args.since:
+        from src.incremental import parse_since
+        try:
+            since = parse_since(args.since)
+        except ValueError:
+            print(f"❌ 错误: 无法解析 --since 参数 - {args.since}")
+            sys.exit(1)
+    
     # 验证图像路径
-    if not validate_image_path(args.image_path):
+    image_paths = collect_image_paths(args.image_path)
+    if image_paths is None:
         sys.exit(1)
+    mark_startup('路径验证')
+    
+    variant_retrier = None
+    if args.retry_variants:
+        from src.config import VARIANT_BATCH_BUDGET
+        from src.variants import VariantRetrier
+        budget = args.variant_budget if args.variant_budget is not None else VARIANT_BATCH_BUDGET
+        variant_retrier = VariantRetrier(batch_budget=budget)
+    
+    # 目录、多个输入或多页文件（每页一个任务）：批量增量处理
+    from src.image_processor import image_processor
+    
+    if (len(image_paths) != 1 or Path(args.image_path[0]).is_dir()
+            or image_processor.count_frames(str(image_paths[0][0])) > 1):
+        try:
+            sys.exit(run_batch(image_paths, force=args.force, since=since,
+                               variant_retrier=variant_retrier,
+                               priority=args.priority or 'normal',
+                               workers=args.workers))
+        except KeyboardInterrupt:
+            print("\n\n⚠️  用户中断操作")
+            sys.exit(130)
+    
+    image_path = str(image_paths[0][0])
+    
+    # 单个输入：修改时间早于 --since 或结果已是最新时跳过
+    if since is not None and Path(image_path).stat().st_mtime < since:
+        print(f"⏭️  已跳过（修改时间早于 --since）: {image_path}")
+        sys.exit(0)
+    
+    if not args.force:
+        from src.incremental import ResultManifest, pipeline_fingerprint
+        
+        up_to_date, _ = ResultManifest().check(image_path, pipeline_fingerprint())
+        if up_to_date:
+            print(f"⏭️  已跳过（源文件和配置均未变化，使用 --force 重新处理）: {image_path}")
+            sys.exit(0)
     
     # 记录开始时间
     start_time = datetime.now()
-    logger.info(f"开始处理图像: {args.image_path}")
+    logger.info(f"开始处理图像: {image_path}")
     
     try:
-        # 处理图像
-        result = process_image(args.image_path)
+        # 处理图像（经调度器检查剩余额度）
+        from src.scheduler import JobScheduler
+        
+        scheduler = JobScheduler()
+        future = scheduler.submit(process_image, image_path, variant_retrier=variant_retrier,
+                                  priority=args.priority or 'interactive')
+        scheduler.close()
+        result = future.result()
+        
+        # 结果文件写入成功后才记录到清单并报告成功
+        if result['success']:
+            from src.incremental import ResultManifest
+            record_when_written(ResultManifest(), image_path, result['written'],
+                                result['metadata']['source_sha256'],
+                                result['metadata']['pipeline_fingerprint'],
+                                result['save_result']['json_path'])
+        if flush_results() or (result['success'] and not result['written'].result()):
+            result = {'success': False, 'error': '结果文件写入失败'}
         
         # 打印结果摘要
         print_results_summary(result)
@@ -0,0 +1,169 @@
+"""
+预处理结果缓存模块
+按 源文件哈希 + 预处理配置指纹 缓存编码后的上传字节，重试和变体实验时跳过CPU密集的预处理
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+from pathlib import Path
+from typing import Optional
+
+from .config import CACHE_DIR, ARTIFACT_CACHE_MAX_BYTES
+
+logger = logging.getLogger(__name__)
+
+# 缓存文件扩展名：一行JSON元数据 + 换行 + 编码后的图像字节
+ENTRY_SUFFIX = '.entry'
+
+
+def make_cache_key(source_sha256: str, stage_config: dict) -> str:
+    """
+    生成缓存键
+    
+    Args:
+        source_sha256: 源文件内容哈希
+        stage_config: 预处理阶段配置（步骤、参数、编码格式等）
+    
+    Returns:
+        缓存键（十六进制）
+    """
+    encoded = json.dumps(stage_config, sort_keys=True, ensure_ascii=False).encode('utf-8')
+    return hashlib.sha256(source_sha256.encode('ascii') + b'\0' + encoded).hexdigest()
+
+
+class ArtifactCache:
+    """
+    磁盘缓存（LRU淘汰，线程安全）
+    
+    命中时更新文件修改时间作为最近使用时间；总大小超过上限时删除最久未使用的条目。
+    """
+    
+    def __init__(self, cache_dir: Path = CACHE_DIR, max_bytes: int = ARTIFACT_CACHE_MAX_BYTES):
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._total_bytes: Optional[int] = None
+        self.hits = 0
+        self.misses = 0
+    
+    def _path(self, key: str) -> Path:
+        return self.cache_dir / key[:2] / f"{key}{ENTRY_SUFFIX}"
+    
+    def get(self, key: str) -> Optional[dict]:
+        """
+        读取缓存条目
+        
+        Args:
+            key: 缓存键
+        
+        Returns:
+            {'encoded': 图像字节, 'process_info': 处理信息}，未命中时返回None
+        """
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            header, _, encoded = data.partition(b'\n')
+            process_info = json.loads(header)
+            os.utime(path)  # 记录最近使用时间
+        except FileNotFoundError:
+            with self._lock:
+                self.misses += 1
+            return None
+        except (OSError, ValueError) as e:
+            logger.warning(f"缓存条目损坏，已忽略: {path}: {e}")
+            with self._lock:
+                self.misses += 1
+            return None
+        
+        with self._lock:
+            self.hits += 1
+        return {'encoded': encoded, 'process_info': process_info}
+    
+    def put(self, key: str, encoded: bytes, process_info: dict):
+        """
+        写入缓存条目（先写临时文件再原子替换）
+        
+        Args:
+            key: 缓存键
+            encoded: 编码后的图像字节
+            process_info: 处理信息
+        """
+        path = self._path(key)
+        header = json.dumps(process_info, ensure_ascii=False).encode('utf-8')
+        
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = path.with_name(f"{path.name}.{threading.get_ident()}.tmp")
+            with open(tmp_path, 'wb') as f:
+                f.write(header + b'\n' + encoded)
+            # 覆盖已有条目时只计入大小的变化
+            try:
+                replaced = path.stat().st_size
+            except FileNotFoundError:
+                replaced = 0
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"写入缓存失败: {e}")
+            return
+        
+        with self._lock:
+            if self._total_bytes is not None:
+                self._total_bytes += len(header) + 1 + len(encoded) - replaced
+        self._evict_if_needed()
+    
+    def _scan(self) -> list:
+        """列出所有缓存条目 [(最近使用时间, 大小, 路径)]"""
+        entries = []
+        if not self.cache_dir.exists():
+            return entries
+        for path in self.cache_dir.glob(f'*/*{ENTRY_SUFFIX}'):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime_ns, stat.st_size, path))
+        return entries
+    
+    def _evict_if_needed(self):
+        """总大小超过上限时按LRU淘汰到上限的90%"""
+        with self._lock:
+            if self._total_bytes is None:
+                self._total_bytes = sum(size for _, size, _ in self._scan())
+            if self._total_bytes <= self.max_bytes:
+                return
+            
+            entries = sorted(self._scan())
+            total = sum(size for _, size, _ in entries)
+            target = int(self.max_bytes * 0.9)
+            removed = 0
+            for _, size, path in entries:
+                if total <= target:
+                    break
+                try:
+                    path.unlink()
+                    total -= size
+                    removed += 1
+                except FileNotFoundError:
+                    continue
+            self._total_bytes = total
+        
+        logger.info(f"缓存淘汰 {removed} 个条目，当前大小: {total / 1024 / 1024:.1f} MB")
+    
+    def stats(self) -> dict:
+        """
+        获取缓存统计
+        
+        Returns:
+            命中/未命中次数和当前大小
+        """
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'total_bytes': self._total_bytes,
+                'max_bytes': self.max_bytes
+            }
@@ -0,0 +1,171 @@
+"""
+请求录制/回放模块
+录制模式下把每次OCR请求的指纹、完整的原始响应和耗时追加写入JSON Lines文件；
+回放模式下按指纹返回录制的响应（可选按录制的耗时等待），不访问网络、不消耗额度，
+用于离线、可复现地测试 parse_ocr_result 和结果处理阶段的吞吐量
+"""
+
+import base64
+import copy
+import hashlib
+import json
+import logging
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from .config import CASSETTE_PATH, CASSETTE_MODE, CASSETTE_REPLAY_LATENCY, ensure_dir
+
+logger = logging.getLogger(__name__)
+
+CASSETTE_MODES = ('record', 'replay')
+
+
+def request_fingerprint(image, options: dict) -> str:
+    """
+    计算请求指纹（与上传方式无关：base64字符串先解码为图像字节）
+    
+    Args:
+        image: 编码后的图像字节或base64字符串
+        options: OCR选项
+    
+    Returns:
+        十六进制指纹字符串
+    """
+    if isinstance(image, str):
+        image = base64.b64decode(image)
+    
+    digest = hashlib.sha256(image)
+    digest.update(json.dumps(options, sort_keys=True, ensure_ascii=False).encode('utf-8'))
+    return digest.hexdigest()
+
+
+class Cassette:
+    """录制/回放的响应集合（线程安全）"""
+    
+    def __init__(self,
+                 path: Path = CASSETTE_PATH,
+                 mode: str = CASSETTE_MODE,
+                 replay_latency: bool = CASSETTE_REPLAY_LATENCY):
+        if mode not in CASSETTE_MODES:
+            raise ValueError(f"未知的录制模式: {mode}")
+        
+        self.path = Path(path)
+        self.mode = mode
+        self.replay_latency = replay_latency
+        self._lock = threading.Lock()
+        
+        # 回放时：指纹 -> 按录制顺序排列的响应；同一指纹多次请求依次返回，用完后从头循环
+        self._entries: Dict[str, List[dict]] = {}
+        self._cursor: Dict[str, int] = {}
+        self.recorded = 0
+        self.replayed = 0
+        self.misses = 0
+        
+        if mode == 'replay':
+            self._load()
+    
+    @property
+    def replaying(self) -> bool:
+        return self.mode == 'replay'
+    
+    def _load(self):
+        """加载录制文件"""
+        count = 0
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                    self._entries.setdefault(entry['fingerprint'], []).append(entry)
+                    count += 1
+                except (ValueError, KeyError):
+                    # 忽略中断写入留下的残缺行
+                    continue
+        logger.info(f"已加载录制文件: {self.path} ({count} 条响应，{len(self._entries)} 个不同请求)")
+    
+    def record(self, fingerprint: str, response: dict, latency: float, request_bytes: int = 0):
+        """
+        追加一条录制的响应
+        
+        Args:
+            fingerprint: 请求指纹
+            response: 原始响应（Mathpix返回的JSON）
+            latency: 请求耗时（秒，含重试）
+            request_bytes: 图像字节数
+        """
+        entry = {
+            'fingerprint': fingerprint,
+            'response': response,
+            'latency': round(latency, 4),
+            'request_bytes': request_bytes,
+            'recorded_time': datetime.now().isoformat()
+        }
+        line = json.dumps(entry, ensure_ascii=False) + '\n'
+        
+        with self._lock:
+            ensure_dir(self.path.parent)
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(line)
+            self.recorded += 1
+    
+    def replay(self, fingerprint: str) -> dict:
+        """
+        返回录制的响应
+        
+        Args:
+            fingerprint: 请求指纹
+        
+        Returns:
+            原始响应的副本；没有录制过该请求时返回错误响应（error_info.id 为 cassette_miss）
+        """
+        with self._lock:
+            entries = self._entries.get(fingerprint)
+            if not entries:
+                self.misses += 1
+            else:
+                index = self._cursor.get(fingerprint, 0)
+                self._cursor[fingerprint] = (index + 1) % len(entries)
+                self.replayed += 1
+        
+        if not entries:
+            logger.warning(f"录制文件中没有该请求: {fingerprint[:16]}")
+            return {
+                'error': f"录制文件中没有该请求 ({fingerprint[:16]})",
+                'error_info': {'id': 'cassette_miss', 'fingerprint': fingerprint}
+            }
+        
+        entry = entries[index]
+        if self.replay_latency:
+            time.sleep(entry['latency'])
+        return copy.deepcopy(entry['response'])
+    
+    def get_stats(self) -> dict:
+        """
+        获取录制/回放统计
+        
+        Returns:
+            模式、文件路径和各项计数
+        """
+        with self._lock:
+            return {
+                'mode': self.mode,
+                'path': str(self.path),
+                'recorded': self.recorded,
+                'replayed': self.replayed,
+                'misses': self.misses,
+                'requests': len(self._entries)
+            }
+
+
+def cassette_from_config() -> Optional[Cassette]:
+    """
+    根据配置创建录制/回放（未设置 CASSETTE_MODE 时返回None）
+    
+    Returns:
+        Cassette实例或None
+    """
+    if not CASSETTE_MODE:
+        return None
+    return Cassette(CASSETTE_PATH, CASSETTE_MODE, CASSETTE_REPLAY_LATENCY)
@@ -0,0 +1,191 @@
+"""
+熔断器模块
+在Mathpix API持续失败时快速失败，避免每张图片都耗尽全部重试
+"""
+
+import logging
+import threading
+import time
+from collections import deque
+from typing import Optional
+
+from .config import (
+    CIRCUIT_ERROR_RATE,
+    CIRCUIT_MIN_REQUESTS,
+    CIRCUIT_WINDOW,
+    CIRCUIT_OPEN_SECONDS,
+    CIRCUIT_FATAL_OPEN_SECONDS,
+    CIRCUIT_FATAL_CODES
+)
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# 熔断器状态
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitBreaker:
+    """
+    熔断器（线程安全）
+    
+    closed: 正常放行，统计最近的请求结果；错误率超过阈值或遇到致命状态码时打开
+    open: 拒绝所有请求，冷却时间结束后进入half_open
+    half_open: 只放行一个探测请求，成功则关闭，失败则重新打开
+    """
+    
+    def __init__(self,
+                 name: str = 'mathpix',
+                 error_rate: float = CIRCUIT_ERROR_RATE,
+                 min_requests: int = CIRCUIT_MIN_REQUESTS,
+                 window: int = CIRCUIT_WINDOW,
+                 open_seconds: float = CIRCUIT_OPEN_SECONDS,
+                 fatal_open_seconds: float = CIRCUIT_FATAL_OPEN_SECONDS,
+                 fatal_codes=CIRCUIT_FATAL_CODES):
+        self.name = name
+        self.error_rate = error_rate
+        self.min_requests = min_requests
+        self.open_seconds = open_seconds
+        self.fatal_open_seconds = fatal_open_seconds
+        self.fatal_codes = set(fatal_codes)
+        
+        self._lock = threading.Lock()
+        self._outcomes = deque(maxlen=window)  # True表示成功
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._cooldown = open_seconds
+        self._probe_in_flight = False
+        self.fatal = False
+        self.last_error: Optional[str] = None
+    
+    @property
+    def state(self) -> str:
+        """当前状态（不会触发状态切换）"""
+        with self._lock:
+            return self._state
+    
+    def _transition(self, new_state: str, reason: str):
+        """切换状态并上报指标（调用方需持有锁）"""
+        old_state = self._state
+        if old_state == new_state:
+            return
+        self._state = new_state
+        
+        metrics.increment(f'circuit_breaker.{self.name}.{new_state}')
+        metrics.set_gauge(f'circuit_breaker.{self.name}.open', 0 if new_state == CLOSED else 1)
+        metrics.event('circuit_breaker',
+                      breaker=self.name,
+                      from_state=old_state,
+                      to_state=new_state,
+                      reason=reason)
+        
+        log = logger.info if new_state == CLOSED else logger.warning
+        log(f"熔断器[{self.name}] {old_state} -> {new_state}: {reason}")
+    
+    def _open(self, reason: str, fatal: bool = False):
+        """打开熔断器（调用方需持有锁）"""
+        self._opened_at = time.monotonic()
+        self._cooldown = self.fatal_open_seconds if fatal else self.open_seconds
+        self._probe_in_flight = False
+        self.fatal = fatal
+        self.last_error = reason
+        self._transition(OPEN, reason)
+    
+    def allow_request(self) -> bool:
+        """
+        判断是否放行一次请求
+        
+        Returns:
+            是否允许发送请求；half_open状态下放行的请求即为探测请求
+        """
+        with self._lock:
+            if self._state == CLOSED:
+                return True
+            
+            if self._state == OPEN:
+                if time.monotonic() - self._opened_at < self._cooldown:
+                    metrics.increment(f'circuit_breaker.{self.name}.rejected')
+                    return False
+                self._transition(HALF_OPEN, '冷却结束，开始探测')
+            
+            # half_open: 同一时间只允许一个探测请求
+            if self._probe_in_flight:
+                metrics.increment(f'circuit_breaker.{self.name}.rejected')
+                return False
+            self._probe_in_flight = True
+            return True
+    
+    def retry_in(self) -> float:
+        """
+        距离下次探测的剩余时间
+        
+        Returns:
+            秒数，未打开时为0
+        """
+        with self._lock:
+            if self._state != OPEN:
+                return 0.0
+            return max(0.0, self._cooldown - (time.monotonic() - self._opened_at))
+    
+    def record_success(self):
+        """记录一次成功的请求"""
+        with self._lock:
+            if self._state == HALF_OPEN:
+                self._probe_in_flight = False
+                self._outcomes.clear()
+                self.fatal = False
+                self.last_error = None
+                self._transition(CLOSED, '探测请求成功')
+            self._outcomes.append(True)
+    
+    def record_neutral(self):
+        """记录一次既非成功也非失败的结果（如429限流），释放探测名额"""
+        with self._lock:
+            self._probe_in_flight = False
+    
+    def record_failure(self, status_code: int = None, reason: str = ''):
+        """
+        记录一次失败的请求
+        
+        Args:
+            status_code: HTTP状态码（网络错误时为None）
+            reason: 失败原因
+        """
+        reason = reason or (f"状态码 {status_code}" if status_code else '请求异常')
+        
+        with self._lock:
+            if status_code in self.fatal_codes:
+                self._open(f"致命错误: {reason}", fatal=True)
+                return
+            
+            if self._state == HALF_OPEN:
+                self._open(f"探测请求失败: {reason}")
+                return
+            
+            self._outcomes.append(False)
+            if self._state == CLOSED and len(self._outcomes) >= self.min_requests:
+                failures = self._outcomes.count(False)
+                rate = failures / len(self._outcomes)
+                if rate >= self.error_rate:
+                    self._open(f"错误率 {rate:.0%} ({failures}/{len(self._outcomes)})，最近错误: {reason}")
+    
+    def snapshot(self) -> dict:
+        """
+        获取熔断器状态摘要
+        
+        Returns:
+            状态信息字典
+        """
+        retry_in = self.retry_in()
+        with self._lock:
+            failures = self._outcomes.count(False)
+            return {
+                'state': self._state,
+                'fatal': self.fatal,
+                'last_error': self.last_error,
+                'recent_requests': len(self._outcomes),
+                'recent_failures': failures,
+                'retry_in': retry_in
+            }
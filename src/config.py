@@ -3,9 +3,34 @@
 包含API密钥、系统设置等配置信息
 """
 
+import logging
 import os
 from pathlib import Path
 
+logger = logging.getLogger(__name__)
+
+
+def _env_int(name: str, default: int) -> int:
+    """
+    读取整数环境变量（未设置或无法解析时使用默认值，无法解析时给出警告）
+    
+    Args:
+        name: 环境变量名
+        default: 默认值
+        
+    Returns:
+        整数值
+    """
+    value = os.getenv(name, "").strip()
+    if not value:
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        logger.warning(f"环境变量 {name}={value!r} 不是整数，使用默认值 {default}")
+        return default
+
+
 # 项目根目录
 PROJECT_ROOT = Path(__file__).parent.parent
 
@@ -13,28 +38,155 @@ PROJECT_ROOT = Path(__file__).parent.parent
 # 注意：请在这里填入您的API密钥
 MATHPIX_APP_ID = os.getenv("MATHPIX_APP_ID", "ai_t_b2282a_f499d0")
 MATHPIX_APP_KEY = os.getenv("MATHPIX_APP_KEY", "55e4fb5039548002f5f1d8a5b81f7c3b86ad06b4c9e480f0e3d658adc52abc48")
-MATHPIX_API_URL = "https://api.mathpix.com/v3/text"
+MATHPIX_API_URL = os.getenv("MATHPIX_API_URL", "https://api.mathpix.com/v3/text")
+# 上传方式: 'multipart'（图像字节作为文件部分直接发送）或 'json'（base64写入JSON的data URI）
+MATHPIX_TRANSPORT = os.getenv("MATHPIX_TRANSPORT", "multipart")
+# 多账号凭证池，格式 "app_id:app_key,app_id:app_key"；为空时只使用上面的一组凭证
+MATHPIX_CREDENTIALS = os.getenv("MATHPIX_CREDENTIALS", "")
+MATHPIX_RATE_LIMIT_PER_MINUTE = 200  # 每个账号的请求速率上限
+CREDENTIAL_ACQUIRE_TIMEOUT = 60  # 所有账号都被限速时，等待可用额度的最长时间（秒）
 
 # 文件路径配置
 UPLOAD_DIR = PROJECT_ROOT / "uploads"
 RESULTS_DIR = PROJECT_ROOT / "results"
 TEMPLATES_DIR = PROJECT_ROOT / "templates"
 
+# 预处理结果缓存配置
+ARTIFACT_CACHE_ENABLED = True
+CACHE_DIR = PROJECT_ROOT / ".cache" / "preprocessed"
+ARTIFACT_CACHE_MAX_BYTES = 512 * 1024 * 1024  # 缓存总大小上限
+
+# 监视目录（守护进程）配置
+PROCESSED_DIR = UPLOAD_DIR / "processed"  # 处理成功的输入移动到这里
+FAILED_DIR = UPLOAD_DIR / "failed"  # 处理失败的输入移动到这里
+WATCH_WORKERS = 4  # 常驻worker数量
+WATCH_POLL_INTERVAL = 1.0  # 轮询/事件等待间隔（秒）
+WATCH_DEBOUNCE_SECONDS = 1.0  # 文件大小和修改时间保持不变多久才视为写入完成
+WATCH_RESCAN_INTERVAL = 30  # inotify模式下全量扫描的间隔（防止丢事件）
+
 # 图像处理配置
 MAX_IMAGE_SIZE = (2048, 2048)  # 最大图像尺寸
-SUPPORTED_FORMATS = {'.jpg', '.jpeg', '.png', '.bmp', '.tiff', '.pdf'}
+RESIZE_MODE = 'text_height'  # 尺寸调整方式: 'text_height'（按字符高度缩放）或 'box'（只缩小到最大尺寸以内）
+TARGET_TEXT_HEIGHT = 20  # 按字符高度缩放时，典型字符高度的目标像素数
+TEXT_HEIGHT_SCALE_RANGE = (0.25, 2.0)  # 按字符高度缩放时的缩放比例范围
+TEXT_HEIGHT_THUMBNAIL = 1200  # 估计字符高度时使用的缩略图长边像素数
+CROP_ANALYSIS_SIZE = 512  # 检测内容边界时使用的缩略图长边像素数
+CROP_PADDING = 0.02  # 裁剪时在内容边界外保留的边距（占图像长边的比例）
+CROP_MIN_SAVING = 0.05  # 裁剪掉的面积低于该比例时不裁剪
+SUPPORTED_FORMATS = {'.jpg', '.jpeg', '.png', '.bmp', '.tif', '.tiff', '.pdf'}
+MULTI_FRAME_FORMATS = {'.tif', '.tiff'}  # 可能包含多页的格式，每一页作为单独的任务处理
+ENHANCE_BACKEND = 'opencv'  # 图像增强实现: 'opencv'（原地处理，无PIL往返）或 'pil'（原实现）
 
 # OCR配置
 OCR_CONFIDENCE_THRESHOLD = 0.7  # 置信度阈值
 MAX_RETRIES = 3  # 最大重试次数
 TIMEOUT = 30  # 请求超时时间（秒）
 
+# 低置信度多变体重试配置（按顺序选取变体，受单图和整批的额外调用预算限制）
+VARIANT_RETRY_ENABLED = False
+VARIANT_NAMES = ['no_denoise', 'binarized', 'upscaled', 'deskew_min_area']
+VARIANT_MAX_PER_IMAGE = 2  # 每张图像最多额外调用API的次数
+VARIANT_BATCH_BUDGET = 50  # 每次运行最多额外调用API的次数
+
+# 自适应超时配置（根据滚动窗口内的p99延迟推算，不超过TIMEOUT）
+ADAPTIVE_TIMEOUT = True
+TIMEOUT_MIN = 5  # 自适应超时下限（秒）
+TIMEOUT_P99_MULTIPLIER = 3.0  # 超时 = p99 × 倍数
+LATENCY_WINDOW = 200  # 延迟统计窗口大小
+LATENCY_MIN_SAMPLES = 20  # 样本数达到该值后才启用自适应超时
+
+# 对冲请求配置（请求超过p95仍未返回时发送一个重复请求）
+HEDGE_REQUESTS = False
+HEDGE_MAX_RATIO = 0.05  # 对冲请求占总请求数的上限（额外配额消耗）
+
+# 熔断器配置
+CIRCUIT_ERROR_RATE = 0.5  # 最近请求错误率达到该值时打开
+CIRCUIT_MIN_REQUESTS = 10  # 统计错误率所需的最少请求数
+CIRCUIT_WINDOW = 20  # 统计最近多少次请求
+CIRCUIT_OPEN_SECONDS = 30  # 打开后多久进入半开状态进行探测
+CIRCUIT_FATAL_CODES = {401, 402}  # 认证失败/配额用完：立即打开对应账号的熔断器（从凭证池摘除），不计入服务熔断器
+CIRCUIT_FATAL_OPEN_SECONDS = 3600  # 致命错误后的冷却时间
+
+# 公式检索索引配置
+FORMULA_INDEX_ENABLED = True  # 保存结果时增量更新索引
+FORMULA_INDEX_PATH = RESULTS_DIR / "formula_index.sqlite"
+FORMULA_NGRAM_SIZE = 3  # token n-gram长度
+
+# HTTP连接池配置
+HTTP_POOL_CONNECTIONS = 4  # 缓存的连接池数量（按主机）
+HTTP_POOL_MAXSIZE = 16  # 每个连接池的最大连接数，应不小于并发线程数
+HTTP_KEEP_ALIVE = True  # 是否复用连接
+
+# 重试退避配置（decorrelated jitter）
+RETRY_BASE_DELAY = 1.0  # 最小等待时间（秒）
+RETRY_MAX_DELAY = 30.0  # 最大等待时间（秒）
+
+# 流水线配置
+PIPELINE_WORKERS = 4  # Pipeline.process_many / 异步接口的并发数
+
+# 批量进度显示配置
+PROGRESS_REFRESH_SECONDS = 0.5  # 终端中刷新进度的间隔
+PROGRESS_LOG_SECONDS = 10  # 输出不是终端时，打印一行进度摘要的间隔
+PROGRESS_STAGES = ('decode', 'preprocess', 'encode', 'ocr.request', 'write.json')  # 统计耗时分布的阶段（span名称）
+
+# 结果写入配置（后台线程写入，先写临时文件再原子重命名）
+RESULT_WRITER_ASYNC = True  # False时在处理线程中同步写入（仍为原子写入）
+RESULT_WRITER_QUEUE_SIZE = 64  # 待写入结果的队列容量，队列满时处理线程等待
+RESULT_JSON_COMPACT = os.getenv("OCR2LATEX_JSON_COMPACT", "") not in ("", "0")  # 紧凑JSON（无缩进），编码和文件体积更小
+RESULT_FSYNC_BATCH = _env_int("OCR2LATEX_FSYNC_BATCH", 0)  # 每批成组落盘的最大文件数，0表示不调用fsync（断电时可能丢失最近的结果）
+
+# 流式处理配置（各阶段之间为有界队列，下游变慢时上游自动暂停）
+STREAM_DECODE_WORKERS = 2  # 解码与预处理
+STREAM_OCR_WORKERS = 8  # OCR请求
+STREAM_WRITE_WORKERS = 2  # 结果写入
+STREAM_QUEUE_SIZE = 8  # 每个阶段之间的队列容量
+
+# API额度与调度配置
+MONTHLY_BUDGET = _env_int("OCR2LATEX_MONTHLY_BUDGET", 0) or None  # 每月调用上限，默认0表示不限制（Mathpix免费版可设为1000）
+DAILY_BUDGET = _env_int("OCR2LATEX_DAILY_BUDGET", 0) or None  # 每日调用上限，None表示不限制
+USAGE_LEDGER_PATH = RESULTS_DIR / ".usage.json"  # 跨进程持久化的调用计数
+# 优先级类别: rank越小越先调度；concurrency为同时运行的上限；
+# reserve为该类别需要保留的剩余额度，剩余额度低于它时该类任务被推迟
+SCHEDULER_CLASSES = {
+    'interactive': {'rank': 0, 'concurrency': 4, 'reserve': 0},
+    'normal': {'rank': 1, 'concurrency': 2, 'reserve': 50},
+    'bulk': {'rank': 2, 'concurrency': 2, 'reserve': 200},
+}
+SCHEDULER_RECHECK_SECONDS = 60  # 因额度推迟的任务重新检查间隔（跨天/跨月后额度恢复）
+
 # 日志配置
 LOG_LEVEL = "INFO"
-LOG_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+LOG_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - [%(job_id)s] %(message)s"
+LOG_FILE = "ocr2latex.log"
+LOG_JSON = os.getenv("OCR2LATEX_LOG_JSON", "") not in ("", "0")  # 结构化（JSON行）日志
+LOG_QUEUE_SIZE = 10000  # 日志队列容量，队列满时丢弃记录而不阻塞处理线程
+
+# 请求录制/回放配置（离线复现Mathpix响应，用于基准测试和回归测试）
+CASSETTE_MODE = os.getenv("OCR2LATEX_CASSETTE_MODE") or None  # 'record'、'replay'，None表示关闭
+CASSETTE_PATH = Path(os.getenv("OCR2LATEX_CASSETTE", PROJECT_ROOT / "cassettes" / "mathpix.jsonl"))
+CASSETTE_REPLAY_LATENCY = os.getenv("OCR2LATEX_CASSETTE_LATENCY", "") not in ("", "0")  # 回放时按录制的耗时等待
+
+# 性能分析配置（--profile）
+PROFILE_INTERVAL = 0.005  # 调用栈采样间隔（秒）
+PROFILE_TOP_N = 20  # 热点函数和内存分配位置的显示条数
+PROFILE_MEMORY_INTERVAL = 0.5  # tracemalloc快照间隔（秒）
+PROFILE_TRACEMALLOC_FRAMES = 16  # tracemalloc记录的调用栈深度
+
+# 链路追踪配置（Chrome trace-event 格式，可在 chrome://tracing 或 Perfetto 中打开）
+TRACE_FILE = os.getenv("OCR2LATEX_TRACE") or None  # 追踪文件路径，None表示不追踪
+TRACE_MAX_SPANS = 200000  # 内存中保留的最大span数量
+
 
-# 确保目录存在
-UPLOAD_DIR.mkdir(exist_ok=True)
-RESULTS_DIR.mkdir(exist_ok=True)
-TEMPLATES_DIR.mkdir(exist_ok=True)
+def ensure_dir(path: Path) -> Path:
+    """
+    确保目录存在（在首次写入前调用，导入配置时不再创建目录）
+    
+    Args:
+        path: 目录路径
+        
+    Returns:
+        目录路径
+    """
+    path.mkdir(parents=True, exist_ok=True)
+    return path
 
@@ -0,0 +1,258 @@
+"""
+凭证池模块
+管理多个Mathpix账号：每个账号有独立的限速器、使用计数和健康状态，
+请求分派给负载最低的健康账号，401/402的账号自动摘除
+"""
+
+import logging
+import threading
+import time
+from typing import List, Optional, Tuple
+
+from .config import (
+    MATHPIX_APP_ID,
+    MATHPIX_APP_KEY,
+    MATHPIX_CREDENTIALS,
+    MATHPIX_RATE_LIMIT_PER_MINUTE,
+    CREDENTIAL_ACQUIRE_TIMEOUT
+)
+from .circuit_breaker import CircuitBreaker, CLOSED
+
+logger = logging.getLogger(__name__)
+
+
+def parse_credentials(value: str) -> List[Tuple[str, str]]:
+    """
+    解析凭证列表
+    
+    Args:
+        value: "app_id:app_key,app_id:app_key" 格式的字符串
+    
+    Returns:
+        (app_id, app_key) 列表
+    """
+    pairs = []
+    for item in value.split(','):
+        item = item.strip()
+        if not item:
+            continue
+        app_id, sep, app_key = item.partition(':')
+        if not sep or not app_id or not app_key:
+            raise ValueError(f"无法解析的凭证: {item[:8]}...")
+        pairs.append((app_id.strip(), app_key.strip()))
+    return pairs
+
+
+class RateLimiter:
+    """令牌桶限速器（线程安全）"""
+    
+    def __init__(self, rate_per_minute: float = MATHPIX_RATE_LIMIT_PER_MINUTE):
+        self.rate = rate_per_minute / 60.0
+        # 桶容量为1秒的请求量，允许少量突发
+        self.capacity = max(1.0, self.rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+    
+    def _refill(self, now: float):
+        """按经过的时间补充令牌（调用方需持有锁）"""
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+    
+    def wait_time(self) -> float:
+        """
+        距离下一个令牌可用的时间
+        
+        Returns:
+            秒数，当前可用时为0
+        """
+        with self._lock:
+            self._refill(time.monotonic())
+            return 0.0 if self._tokens >= 1 else (1 - self._tokens) / self.rate
+    
+    def try_acquire(self) -> bool:
+        """
+        尝试取走一个令牌
+        
+        Returns:
+            是否成功
+        """
+        with self._lock:
+            self._refill(time.monotonic())
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+
+class Credential:
+    """一个Mathpix账号"""
+    
+    def __init__(self, app_id: str, app_key: str, rate_per_minute: float = MATHPIX_RATE_LIMIT_PER_MINUTE):
+        self.app_id = app_id
+        self.app_key = app_key
+        self.name = app_id
+        self.headers = {'app_id': app_id, 'app_key': app_key}
+        self.limiter = RateLimiter(rate_per_minute)
+        # 只记录账号本身的问题（401/402），服务端错误由客户端的全局熔断器统计
+        self.breaker = CircuitBreaker(name=f'mathpix.{app_id}')
+        self.in_flight = 0
+        self.usage_count = 0
+        self.cooldown_until = 0.0  # 429 Retry-After
+    
+    def is_healthy(self) -> bool:
+        """账号未被摘除（熔断器关闭）"""
+        return self.breaker.state == CLOSED
+    
+    def snapshot(self) -> dict:
+        """
+        获取账号状态
+        
+        Returns:
+            账号名、使用次数、进行中请求数和健康状态
+        """
+        breaker = self.breaker.snapshot()
+        return {
+            'app_id': self.app_id,
+            'usage_count': self.usage_count,
+            'in_flight': self.in_flight,
+            'state': breaker['state'],
+            'drained': breaker['fatal'],
+            'last_error': breaker['last_error'],
+            'retry_in': breaker['retry_in'],
+            'cooldown': max(0.0, self.cooldown_until - time.monotonic())
+        }
+
+
+class CredentialPool:
+    """凭证池（线程安全）"""
+    
+    def __init__(self, credentials: List[Credential], acquire_timeout: float = CREDENTIAL_ACQUIRE_TIMEOUT):
+        if not credentials:
+            raise ValueError("凭证池不能为空")
+        self.credentials = credentials
+        self.acquire_timeout = acquire_timeout
+        self._lock = threading.Lock()
+    
+    @classmethod
+    def from_config(cls) -> 'CredentialPool':
+        """
+        根据配置创建凭证池（MATHPIX_CREDENTIALS为空时使用单个账号）
+        
+        Returns:
+            CredentialPool实例
+        """
+        pairs = parse_credentials(MATHPIX_CREDENTIALS) or [(MATHPIX_APP_ID, MATHPIX_APP_KEY)]
+        return cls([Credential(app_id, app_key) for app_id, app_key in pairs])
+    
+    def _pick(self) -> Tuple[Optional[Credential], Optional[float]]:
+        """
+        选择负载最低且当前可用的账号
+        
+        Returns:
+            (账号, None)；暂时都不可用时为 (None, 需等待的秒数)；全部被摘除时为 (None, None)
+        """
+        now = time.monotonic()
+        wait = None
+        
+        with self._lock:
+            candidates = sorted(self.credentials, key=lambda c: (c.in_flight, c.usage_count))
+            for credential in candidates:
+                if credential.breaker.retry_in() > 0:
+                    continue
+                
+                delay = max(credential.cooldown_until - now, credential.limiter.wait_time())
+                if delay > 0:
+                    wait = delay if wait is None else min(wait, delay)
+                    continue
+                
+                # half_open 时只放行一个探测请求，其余请求交给其他账号
+                if not credential.breaker.allow_request():
+                    continue
+                if not credential.limiter.try_acquire():
+                    credential.breaker.record_neutral()
+                    continue
+                
+                credential.in_flight += 1
+                return credential, None
+        
+        if wait is None and not self.has_usable():
+            return None, None
+        return None, wait or 0.05
+    
+    def acquire(self) -> Optional[Credential]:
+        """
+        取得一个可用账号，所有账号都被限速时等待
+        
+        Returns:
+            账号，全部被摘除或等待超时时返回None
+        """
+        deadline = time.monotonic() + self.acquire_timeout
+        while True:
+            credential, wait = self._pick()
+            if credential is not None:
+                return credential
+            if wait is None or time.monotonic() + wait > deadline:
+                return None
+            time.sleep(wait)
+    
+    def release(self, credential: Credential, status_code: int = None, retry_after: float = None):
+        """
+        归还账号并记录本次请求的结果
+        
+        Args:
+            credential: 账号
+            status_code: HTTP状态码，网络错误时为None
+            retry_after: 429响应的Retry-After（秒）
+        """
+        with self._lock:
+            credential.in_flight -= 1
+            if status_code is not None:
+                credential.usage_count += 1
+            if status_code == 429:
+                credential.cooldown_until = time.monotonic() + (retry_after or 1.0)
+        
+        if status_code == 200:
+            credential.breaker.record_success()
+        elif status_code in credential.breaker.fatal_codes:
+            credential.breaker.record_failure(status_code, f"账号 {credential.name} 返回 {status_code}")
+            logger.error(f"账号 {credential.name} 返回 {status_code}，已从凭证池摘除")
+        else:
+            credential.breaker.record_neutral()
+    
+    def in_flight(self) -> int:
+        """
+        获取所有账号上进行中的请求总数
+        
+        Returns:
+            请求数
+        """
+        with self._lock:
+            return sum(credential.in_flight for credential in self.credentials)
+    
+    def has_usable(self) -> bool:
+        """
+        是否还有未被摘除的账号
+        
+        Returns:
+            至少一个账号的熔断器不在打开状态
+        """
+        return any(c.breaker.retry_in() == 0 for c in self.credentials)
+    
+    def retry_in(self) -> float:
+        """
+        最早恢复的账号的剩余冷却时间
+        
+        Returns:
+            秒数
+        """
+        return min(c.breaker.retry_in() for c in self.credentials)
+    
+    def snapshot(self) -> List[dict]:
+        """
+        获取各账号状态
+        
+        Returns:
+            账号状态列表
+        """
+        return [c.snapshot() for c in self.credentials]
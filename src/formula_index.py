@@ -0,0 +1,332 @@
+"""
+公式检索模块
+对识别出的LaTeX公式建立持久化倒排索引，支持精确和近似查找
+"""
+
+import logging
+import re
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Iterable, List, Optional
+
+from .config import RESULTS_DIR, FORMULA_INDEX_PATH, FORMULA_NGRAM_SIZE, ensure_dir
+
+logger = logging.getLogger(__name__)
+
+_TOKEN_RE = re.compile(r'\\[a-zA-Z]+|\\.|\d+(?:\.\d+)?|[a-zA-Z]|\S')
+
+# 不影响公式含义的排版命令
+_NOISE_TOKENS = {
+    '\\left', '\\right', '\\middle', '\\,', '\\;', '\\:', '\\!', '\\ ', '\\quad', '\\qquad',
+    '\\displaystyle', '\\textstyle', '\\scriptstyle', '\\limits', '\\nolimits',
+    '\\big', '\\Big', '\\bigg', '\\Bigg', '\\bigl', '\\bigr', '\\Bigl', '\\Bigr',
+}
+
+# 同义命令归一
+_ALIASES = {
+    '\\dfrac': '\\frac', '\\tfrac': '\\frac',
+    '\\le': '\\leq', '\\ge': '\\geq', '\\ne': '\\neq',
+    '\\leqslant': '\\leq', '\\geqslant': '\\geq',
+    '\\to': '\\rightarrow', '\\gets': '\\leftarrow',
+}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS formulas (
+    id INTEGER PRIMARY KEY,
+    result_path TEXT NOT NULL,
+    filename TEXT,
+    location TEXT,
+    latex TEXT NOT NULL,
+    normalized TEXT NOT NULL,
+    gram_count INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_formulas_normalized ON formulas(normalized);
+CREATE INDEX IF NOT EXISTS idx_formulas_result ON formulas(result_path);
+CREATE TABLE IF NOT EXISTS postings (
+    gram TEXT NOT NULL,
+    formula_id INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_postings_gram ON postings(gram);
+CREATE INDEX IF NOT EXISTS idx_postings_formula ON postings(formula_id);
+"""
+
+
+def _is_atom(token: str) -> bool:
+    """去掉花括号后含义不变的token：单个字符或命令（不含花括号本身）"""
+    if token in ('{', '}'):
+        return False
+    return len(token) == 1 or token.startswith('\\')
+
+
+def tokenize_latex(latex: str) -> List[str]:
+    """
+    将LaTeX拆分为命令和符号，并去除空白、排版命令和多余的花括号
+    
+    Args:
+        latex: LaTeX字符串
+    
+    Returns:
+        归一化后的token列表
+    """
+    tokens = []
+    for token in _TOKEN_RE.findall(latex):
+        if token in _NOISE_TOKENS:
+            continue
+        tokens.append(_ALIASES.get(token, token))
+    
+    # 去掉空花括号和只包住单个字符或单个命令的花括号: x^{2} -> x^2, {{a}} -> a, {\alpha} -> \alpha；
+    # 多位数字保留花括号，x^{23} 与 x^23（即 x^2 3）含义不同
+    changed = True
+    while changed:
+        changed = False
+        result = []
+        i = 0
+        while i < len(tokens):
+            if tokens[i] == '{' and i + 1 < len(tokens) and tokens[i + 1] == '}':
+                i += 2
+                changed = True
+            elif tokens[i] == '{' and i + 2 < len(tokens) and tokens[i + 2] == '}' and _is_atom(tokens[i + 1]):
+                result.append(tokens[i + 1])
+                i += 3
+                changed = True
+            else:
+                result.append(tokens[i])
+                i += 1
+        tokens = result
+    
+    return tokens
+
+
+def make_ngrams(tokens: List[str], n: int = FORMULA_NGRAM_SIZE) -> set:
+    """
+    生成token n-gram集合（token数少于n时整体作为一个gram）
+    
+    Args:
+        tokens: token列表
+        n: gram长度
+    
+    Returns:
+        n-gram集合
+    """
+    if not tokens:
+        return set()
+    if len(tokens) <= n:
+        return {' '.join(tokens)}
+    return {' '.join(tokens[i:i + n]) for i in range(len(tokens) - n + 1)}
+
+
+def extract_formulas(result_data: dict) -> List[tuple]:
+    """
+    从结果数据中提取所有公式
+    
+    Args:
+        result_data: 结果数据
+    
+    Returns:
+        [(位置, LaTeX)] 列表，位置如 'latex_content'、'raw_text'、'region:3'
+    """
+    from .latex_export import split_math
+    
+    formulas = []
+    ocr_result = result_data.get('ocr_result', {})
+    
+    if ocr_result.get('latex_content'):
+        formulas.append(('latex_content', ocr_result['latex_content']))
+    
+    for kind, content in split_math(ocr_result.get('raw_text') or ''):
+        if kind != 'text' and content:
+            formulas.append(('raw_text', content))
+    
+    for region in result_data.get('regions', []):
+        if region.get('latex'):
+            formulas.append((f"region:{region.get('id', '')}", region['latex']))
+    
+    return formulas
+
+
+class FormulaIndex:
+    """基于SQLite的公式倒排索引（线程安全）"""
+    
+    def __init__(self, db_path: Path = FORMULA_INDEX_PATH, ngram_size: int = FORMULA_NGRAM_SIZE):
+        self.db_path = Path(db_path)
+        self.ngram_size = ngram_size
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+    
+    @property
+    def conn(self) -> sqlite3.Connection:
+        """数据库连接（首次使用时创建）"""
+        if self._conn is None:
+            ensure_dir(self.db_path.parent)
+            conn = sqlite3.connect(str(self.db_path), check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.executescript(_SCHEMA)
+            self._conn = conn
+        return self._conn
+    
+    def close(self):
+        """关闭数据库连接"""
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+    
+    def add_result(self, result_data: dict, result_path: str) -> int:
+        """
+        索引一个结果文件中的所有公式（同一结果文件重复索引时替换旧记录）
+        
+        Args:
+            result_data: 结果数据
+            result_path: 结果JSON路径
+        
+        Returns:
+            索引的公式数量
+        """
+        filename = result_data.get('image_info', {}).get('filename', '')
+        formulas = extract_formulas(result_data)
+        
+        with self._lock:
+            conn = self.conn
+            with conn:
+                self._delete_result(conn, result_path)
+                for location, latex in formulas:
+                    tokens = tokenize_latex(latex)
+                    grams = make_ngrams(tokens, self.ngram_size)
+                    if not grams:
+                        continue
+                    cursor = conn.execute(
+                        'INSERT INTO formulas (result_path, filename, location, latex, normalized, gram_count) '
+                        'VALUES (?, ?, ?, ?, ?, ?)',
+                        (result_path, filename, location, latex, ' '.join(tokens), len(grams))
+                    )
+                    conn.executemany(
+                        'INSERT INTO postings (gram, formula_id) VALUES (?, ?)',
+                        [(gram, cursor.lastrowid) for gram in grams]
+                    )
+        
+        return len(formulas)
+    
+    @staticmethod
+    def _delete_result(conn: sqlite3.Connection, result_path: str):
+        """删除某个结果文件的索引记录"""
+        conn.execute(
+            'DELETE FROM postings WHERE formula_id IN (SELECT id FROM formulas WHERE result_path = ?)',
+            (result_path,)
+        )
+        conn.execute('DELETE FROM formulas WHERE result_path = ?', (result_path,))
+    
+    def rebuild(self, results_dir: Path = RESULTS_DIR) -> dict:
+        """
+        从结果目录重建索引
+        
+        Args:
+            results_dir: 结果目录
+        
+        Returns:
+            重建统计
+        """
+        from .latex_export import iter_result_files, iter_results
+        
+        with self._lock:
+            with self.conn:
+                self.conn.execute('DELETE FROM postings')
+                self.conn.execute('DELETE FROM formulas')
+        
+        results = 0
+        formulas = 0
+        for path in iter_result_files(results_dir):
+            for result_data in iter_results([path]):
+                formulas += self.add_result(result_data, str(path))
+                results += 1
+        
+        logger.info(f"公式索引重建完成: {results} 个结果，{formulas} 个公式")
+        return {'results': results, 'formulas': formulas}
+    
+    def search(self, latex: str, limit: int = 10, min_score: float = 0.5) -> List[dict]:
+        """
+        查找相同或相似的公式
+        
+        Args:
+            latex: 要查找的LaTeX公式
+            limit: 最多返回的条数
+            min_score: 近似匹配的最低相似度（Dice系数）
+        
+        Returns:
+            匹配列表（按相似度降序），精确匹配的score为1.0
+        """
+        tokens = tokenize_latex(latex)
+        normalized = ' '.join(tokens)
+        grams = sorted(make_ngrams(tokens, self.ngram_size))
+        if not grams:
+            return []
+        
+        start_time = time.perf_counter()
+        columns = 'id, result_path, filename, location, latex, gram_count'
+        
+        with self._lock:
+            conn = self.conn
+            exact = conn.execute(
+                f'SELECT {columns} FROM formulas WHERE normalized = ? LIMIT ?',
+                (normalized, limit)
+            ).fetchall()
+            
+            # 共享n-gram数量最多的候选
+            placeholders = ','.join('?' * len(grams))
+            candidates = conn.execute(
+                f'SELECT formula_id, COUNT(*) AS shared FROM postings '
+                f'WHERE gram IN ({placeholders}) GROUP BY formula_id '
+                f'ORDER BY shared DESC LIMIT ?',
+                (*grams, limit * 20)
+            ).fetchall()
+            
+            rows = {}
+            if candidates:
+                ids = [formula_id for formula_id, _ in candidates]
+                id_placeholders = ','.join('?' * len(ids))
+                for row in conn.execute(
+                        f'SELECT {columns} FROM formulas WHERE id IN ({id_placeholders})', ids):
+                    rows[row[0]] = row
+        
+        matches = {}
+        for row in exact:
+            matches[row[0]] = self._to_match(row, 1.0, True)
+        
+        for formula_id, shared in candidates:
+            if formula_id in matches or formula_id not in rows:
+                continue
+            row = rows[formula_id]
+            score = 2 * shared / (len(grams) + row[5])
+            if score >= min_score:
+                matches[formula_id] = self._to_match(row, score, False)
+        
+        results = sorted(matches.values(), key=lambda m: m['score'], reverse=True)[:limit]
+        logger.debug(f"公式检索耗时 {(time.perf_counter() - start_time) * 1000:.1f} ms，匹配 {len(results)} 条")
+        return results
+    
+    @staticmethod
+    def _to_match(row: tuple, score: float, exact: bool) -> dict:
+        """将数据库记录转换为检索结果"""
+        return {
+            'result_path': row[1],
+            'filename': row[2],
+            'location': row[3],
+            'latex': row[4],
+            'score': round(score, 4),
+            'exact': exact
+        }
+    
+    def stats(self) -> dict:
+        """
+        获取索引统计
+        
+        Returns:
+            公式数量和结果文件数量
+        """
+        with self._lock:
+            formulas, results = self.conn.execute(
+                'SELECT COUNT(*), COUNT(DISTINCT result_path) FROM formulas'
+            ).fetchone()
+        return {'formulas': formulas, 'results': results}
@@ -3,16 +3,37 @@
 负责图像的加载、预处理、优化等功能
 """
 
-import cv2
-import numpy as np
-from PIL import Image, ImageEnhance
+from __future__ import annotations
+
 import logging
+import threading
 from pathlib import Path
-from typing import Tuple, Optional
+from typing import Tuple, Optional, TYPE_CHECKING
 import base64
+import hashlib
 import io
 
-from .config import MAX_IMAGE_SIZE, SUPPORTED_FORMATS
+from .config import (
+    MAX_IMAGE_SIZE,
+    SUPPORTED_FORMATS,
+    MULTI_FRAME_FORMATS,
+    ARTIFACT_CACHE_ENABLED,
+    ENHANCE_BACKEND,
+    RESIZE_MODE,
+    TARGET_TEXT_HEIGHT,
+    TEXT_HEIGHT_SCALE_RANGE,
+    TEXT_HEIGHT_THUMBNAIL,
+    CROP_ANALYSIS_SIZE,
+    CROP_PADDING,
+    CROP_MIN_SAVING
+)
+from .tracing import tracer
+
+if TYPE_CHECKING:
+    import numpy as np
+
+# cv2 / numpy / PIL 的导入开销较大，统一在方法内部按需导入，
+# 使 `main.py --help` 等提前退出的路径不必加载它们
 
 logger = logging.getLogger(__name__)
 
@@ -20,22 +41,134 @@ logger = logging.getLogger(__name__)
 class ImageProcessor:
     """图像处理器"""
     
-    def __init__(self):
+    # 预处理步骤（按执行顺序）
+    PREPROCESSING_STEPS = ['crop', 'resize', 'enhance', 'skew_correction', 'denoise']
+    
+    # 低置信度时重试的预处理变体
+    PREPROCESSING_VARIANTS = {
+        'no_denoise': ['crop', 'resize', 'enhance', 'skew_correction'],
+        'binarized': ['crop', 'resize', 'skew_correction', 'binarize'],
+        'upscaled': ['crop', 'resize', 'upscale', 'enhance', 'skew_correction'],
+        'deskew_min_area': ['crop', 'resize', 'enhance', 'skew_correction_min_area', 'denoise'],
+    }
+    
+    def __init__(self, artifact_cache=None, use_cache: bool = ARTIFACT_CACHE_ENABLED):
         self.max_size = MAX_IMAGE_SIZE
+        self.resize_mode = RESIZE_MODE
+        self.target_text_height = TARGET_TEXT_HEIGHT
+        self.text_height_scale_range = TEXT_HEIGHT_SCALE_RANGE
+        self.crop_padding = CROP_PADDING
+        self.contrast_factor = 1.2
+        self.sharpness_factor = 1.1
+        self.denoise_params = (10, 10, 7, 21)  # h, hColor, templateWindowSize, searchWindowSize
+        self.enhance_backend = ENHANCE_BACKEND
+        self.use_cache = use_cache
+        self._artifact_cache = artifact_cache
+        
+        # 每个线程独立的临时缓冲区和当前图像的裁剪、缩放信息
+        self._local = threading.local()
+    
+    def _record_geometry(self, step: str, matrix):
+        """
+        记录预处理中的几何变换，用于将识别区域坐标映射回原图（见 map_bbox_to_original）
+        
+        Args:
+            step: 步骤名称
+            matrix: 2x3仿射矩阵，将变换前的坐标映射到变换后的坐标
+        """
+        geometry = getattr(self._local, 'geometry', None)
+        if geometry is not None:
+            geometry.append({'step': step, 'matrix': [[float(v) for v in row] for row in matrix]})
+    
+    def _scratch_buffer(self, image: np.ndarray) -> np.ndarray:
+        """
+        获取与图像形状相同的临时缓冲区（同一线程内复用）
+        
+        Args:
+            image: 参考图像
+        
+        Returns:
+            未初始化的缓冲区
+        """
+        import numpy as np
+        
+        buffer = getattr(self._local, 'scratch', None)
+        if buffer is None or buffer.shape != image.shape or buffer.dtype != image.dtype:
+            buffer = np.empty_like(image)
+            self._local.scratch = buffer
+        return buffer
+    
+    @property
+    def artifact_cache(self):
+        """预处理结果磁盘缓存（首次使用时创建）"""
+        if self._artifact_cache is None:
+            from .artifact_cache import ArtifactCache
+            self._artifact_cache = ArtifactCache()
+        return self._artifact_cache
+    
+    def get_config(self, variant: str = None) -> dict:
+        """
+        获取影响预处理输出的配置（用于计算流水线指纹和缓存键）
+        
+        Args:
+            variant: 预处理变体名称，None表示默认流程
+            
+        Returns:
+            配置字典
+        """
+        steps = self.PREPROCESSING_VARIANTS[variant] if variant else self.PREPROCESSING_STEPS
+        return {
+            'max_size': list(self.max_size),
+            'resize_mode': self.resize_mode,
+            'target_text_height': self.target_text_height,
+            'text_height_scale_range': list(self.text_height_scale_range),
+            'crop_padding': self.crop_padding,
+            'steps': list(steps),
+            'contrast_factor': self.contrast_factor,
+            'sharpness_factor': self.sharpness_factor,
+            'enhance_backend': self.enhance_backend,
+            'denoise_params': list(self.denoise_params)
+        }
+        
+    def count_frames(self, image_path: str, data: bytes = None) -> int:
+        """
+        获取图像的帧数（多页TIFF的页数；只读取文件目录，不解码像素）
+        
+        Args:
+            image_path: 图像文件路径（data不为空时仅作为名称）
+            data: 内存中的图像文件内容，None时从image_path读取
+        
+        Returns:
+            帧数，单帧格式或读取失败时返回1
+        """
+        if Path(image_path).suffix.lower() not in MULTI_FRAME_FORMATS:
+            return 1
+        
+        try:
+            from PIL import Image
+            
+            with Image.open(image_path if data is None else io.BytesIO(data)) as img:
+                return getattr(img, 'n_frames', 1)
         
-    def load_image(self, image_path: str) -> Optional[np.ndarray]:
+        except Exception as e:
+            logger.error(f"读取图像帧数失败: {e}")
+            return 1
+    
+    def load_image(self, image_path: str, data: bytes = None, frame: int = None) -> Optional[np.ndarray]:
         """
         加载图像文件
         
         Args:
-            image_path: 图像文件路径
+            image_path: 图像文件路径（data不为空时仅作为名称）
+            data: 内存中的图像文件内容（如压缩包成员），None时从image_path读取
+            frame: 多页TIFF的帧序号（从0开始），None表示第一帧；只解码该帧
             
         Returns:
             numpy数组格式的图像，如果加载失败返回None
         """
         try:
             path = Path(image_path)
-            if not path.exists():
+            if data is None and not path.exists():
                 logger.error(f"图像文件不存在: {image_path}")
                 return None
                 
@@ -43,8 +176,14 @@ class ImageProcessor:
                 logger.error(f"不支持的图像格式: {path.suffix}")
                 return None
                 
+            import numpy as np
+            from PIL import Image
+                
             # 使用PIL加载图像
-            with Image.open(image_path) as img:
+            with Image.open(image_path if data is None else io.BytesIO(data)) as img:
+                if frame:
+                    img.seek(frame)
+                
                 # 转换为RGB格式
                 if img.mode != 'RGB':
                     img = img.convert('RGB')
@@ -52,17 +191,154 @@ class ImageProcessor:
                 # 转换为numpy数组
                 image_array = np.array(img)
                 
-            logger.info(f"成功加载图像: {image_path}, 尺寸: {image_array.shape}")
+            logger.info(f"成功加载图像: {image_path}" + (f" 第 {frame + 1} 帧" if frame else '')
+                        + f", 尺寸: {image_array.shape}")
             return image_array
             
         except Exception as e:
             logger.error(f"加载图像失败: {e}")
             return None
     
+    def find_content_box(self, image: np.ndarray) -> Optional[Tuple[int, int, int, int]]:
+        """
+        在缩小的二值化副本上检测内容（墨迹）边界
+        
+        Args:
+            image: 输入图像
+        
+        Returns:
+            原图坐标中的 (x0, y0, x1, y1)（不含边距），空白页返回None
+        """
+        import cv2
+        import numpy as np
+        
+        gray = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY) if image.ndim == 3 else image
+        h, w = gray.shape[:2]
+        factor = min(1.0, CROP_ANALYSIS_SIZE / max(h, w))
+        thumb = gray if factor == 1.0 else cv2.resize(
+            gray, (max(1, int(w * factor)), max(1, int(h * factor))), interpolation=cv2.INTER_AREA
+        )
+        th, tw = thumb.shape[:2]
+        
+        # 比纸张背景（中位灰度）明显更深的像素视为墨迹，对偏灰的扫描底色也适用
+        background = float(np.median(thumb))
+        ink = (thumb < background - 40).astype(np.uint8)
+        count, _, stats, _ = cv2.connectedComponentsWithStats(ink, connectivity=8)
+        
+        boxes = []
+        for x, y, bw, bh, area in stats[1:]:
+            if area < 2:
+                continue
+            # 贴边的细长区域是扫描仪边缘阴影，不算内容
+            touches_border = x == 0 or y == 0 or x + bw == tw or y + bh == th
+            if touches_border and ((bh > th * 0.5 and bw < tw * 0.05) or (bw > tw * 0.5 and bh < th * 0.05)):
+                continue
+            boxes.append((x, y, x + bw, y + bh))
+        
+        if not boxes:
+            return None
+        
+        x0 = min(b[0] for b in boxes)
+        y0 = min(b[1] for b in boxes)
+        x1 = max(b[2] for b in boxes)
+        y1 = max(b[3] for b in boxes)
+        # 缩略图一个像素对应原图多个像素，向外取整
+        return (int(x0 / factor), int(y0 / factor),
+                min(w, int(np.ceil(x1 / factor))), min(h, int(np.ceil(y1 / factor))))
+    
+    def crop_to_content(self, image: np.ndarray) -> np.ndarray:
+        """
+        裁掉空白页边（在耗时的增强、去噪之前执行）
+        
+        Args:
+            image: 输入图像
+        
+        Returns:
+            裁剪后的图像；裁剪偏移记录在处理信息的 crop 字段，用于将识别区域坐标映射回原图
+        """
+        try:
+            h, w = image.shape[:2]
+            box = self.find_content_box(image)
+            if box is None:
+                return image
+            
+            pad = max(8, int(max(h, w) * self.crop_padding))
+            x0, y0 = max(0, box[0] - pad), max(0, box[1] - pad)
+            x1, y1 = min(w, box[2] + pad), min(h, box[3] + pad)
+            
+            if (x1 - x0) * (y1 - y0) > w * h * (1 - CROP_MIN_SAVING):
+                return image
+            
+            import numpy as np
+            
+            # 后续步骤会原地修改图像，复制为连续数组（只复制内容区域）
+            cropped = np.ascontiguousarray(image[y0:y1, x0:x1])
+            self._local.crop_info = {'offset': [x0, y0], 'size': [x1 - x0, y1 - y0]}
+            self._record_geometry('crop', [[1, 0, -x0], [0, 1, -y0]])
+            
+            logger.info(f"裁剪空白页边: {w}x{h} -> {x1 - x0}x{y1 - y0}，偏移 ({x0}, {y0})")
+            return cropped
+        
+        except Exception as e:
+            logger.error(f"裁剪空白页边失败: {e}")
+            return image
+    
+    def estimate_text_height(self, image: np.ndarray) -> Optional[float]:
+        """
+        估计典型字符高度（在缩略图上统计连通域高度的中位数）
+        
+        Args:
+            image: 输入图像
+        
+        Returns:
+            原图中的字符高度（像素），找不到足够的字符时返回None
+        """
+        try:
+            import cv2
+            import numpy as np
+            
+            gray = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY) if image.ndim == 3 else image
+            h, w = gray.shape[:2]
+            factor = min(1.0, TEXT_HEIGHT_THUMBNAIL / max(h, w))
+            
+            for attempt in range(2):
+                thumb = gray if factor == 1.0 else cv2.resize(
+                    gray, (max(1, int(w * factor)), max(1, int(h * factor))), interpolation=cv2.INTER_AREA
+                )
+                # 字符为深色，反色后Otsu二值化得到前景
+                _, binary = cv2.threshold(thumb, 0, 255, cv2.THRESH_BINARY_INV | cv2.THRESH_OTSU)
+                count, _, stats, _ = cv2.connectedComponentsWithStats(binary, connectivity=8)
+                
+                widths = stats[1:, cv2.CC_STAT_WIDTH]
+                heights = stats[1:, cv2.CC_STAT_HEIGHT]
+                areas = stats[1:, cv2.CC_STAT_AREA]
+                
+                # 排除噪点、横线（分数线、下划线）、表格线和大块区域
+                keep = ((heights >= 3) & (areas >= 6)
+                        & (heights <= thumb.shape[0] * 0.2)
+                        & (widths <= heights * 4)
+                        & (areas >= widths * heights * 0.1))
+                if np.count_nonzero(keep) < 10:
+                    return None
+                
+                median = float(np.median(heights[keep]))
+                # 缩略图上字符过小时统计不可靠，改用原图重新统计
+                if median >= 5 or factor == 1.0:
+                    return median / factor
+                factor = 1.0
+            return None
+        
+        except Exception as e:
+            logger.error(f"估计字符高度失败: {e}")
+            return None
+    
     def resize_image(self, image: np.ndarray, max_size: Tuple[int, int] = None) -> np.ndarray:
         """
         调整图像尺寸
         
+        text_height 模式下按估计的字符高度缩放到目标高度（大字号的高分辨率扫描缩小、
+        小截图放大），仍不超过最大尺寸；估计失败或 box 模式下只将超出最大尺寸的图像缩小
+        
         Args:
             image: 输入图像
             max_size: 最大尺寸 (width, height)
@@ -75,54 +351,149 @@ class ImageProcessor:
             
         h, w = image.shape[:2]
         max_w, max_h = max_size
+        box_scale = min(1.0, max_w / w, max_h / h)
+        
+        scale = box_scale
+        text_height = None
+        if self.resize_mode == 'text_height':
+            text_height = self.estimate_text_height(image)
+            if text_height:
+                low, high = self.text_height_scale_range
+                scale = min(max(self.target_text_height / text_height, low), high)
+                # 接近原尺寸时不重采样；只在字符明显过小时放大
+                if 0.9 < scale < 1.25:
+                    scale = 1.0
+                # 最大尺寸限制在取整之后应用，超出最大尺寸的图像仍会缩小
+                scale = min(scale, max_w / w, max_h / h)
+        
+        new_w, new_h = (w, h) if scale == 1.0 else (max(1, int(w * scale)), max(1, int(h * scale)))
         
-        # 如果图像已经小于最大尺寸，直接返回
-        if w <= max_w and h <= max_h:
+        # 记录缩放信息，写入处理信息（像素数与只按最大尺寸缩小时比较）
+        box_pixels = int(w * box_scale) * int(h * box_scale)
+        self._local.resize_info = {
+            'mode': self.resize_mode if text_height else 'box',
+            'text_height': round(text_height, 1) if text_height else None,
+            'scale': round(scale, 4),
+            'pixels_saved': box_pixels - new_w * new_h
+        }
+        
+        # 如果不需要缩放，直接返回
+        if scale == 1.0:
             return image
             
-        # 计算缩放比例
-        scale = min(max_w / w, max_h / h)
-        new_w = int(w * scale)
-        new_h = int(h * scale)
+        import cv2
         
-        # 使用高质量插值进行缩放
-        resized = cv2.resize(image, (new_w, new_h), interpolation=cv2.INTER_LANCZOS4)
+        # 缩小使用区域插值，放大使用高质量插值
+        interpolation = cv2.INTER_AREA if scale < 1.0 else cv2.INTER_LANCZOS4
+        resized = cv2.resize(image, (new_w, new_h), interpolation=interpolation)
+        self._record_geometry('resize', [[new_w / w, 0, 0], [0, new_h / h, 0]])
         
-        logger.info(f"图像尺寸调整: {w}x{h} -> {new_w}x{new_h}")
+        logger.info(f"图像尺寸调整: {w}x{h} -> {new_w}x{new_h}"
+                    + (f"（字符高度 {text_height:.0f}px）" if text_height else ''))
         return resized
     
-    def enhance_image(self, image: np.ndarray) -> np.ndarray:
+    def enhance_image(self, 
+                      image: np.ndarray, 
+                      out: np.ndarray = None, 
+                      inplace: bool = False) -> np.ndarray:
         """
-        图像增强处理
+        图像增强处理（对比度 ×1.2，锐度 ×1.1）
         
         Args:
             image: 输入图像
-            
+            out: 预分配的输出缓冲区（仅opencv实现）
+            inplace: 是否直接写回输入图像（仅opencv实现）
+        
         Returns:
             增强后的图像
         """
         try:
-            # 转换为PIL图像进行增强
-            pil_image = Image.fromarray(image)
+            if self.enhance_backend == 'pil' or image.ndim != 3 or image.shape[2] != 3:
+                return self._enhance_pil(image)
             
-            # 对比度增强
-            enhancer = ImageEnhance.Contrast(pil_image)
-            enhanced = enhancer.enhance(1.2)
-            
-            # 锐度增强
-            enhancer = ImageEnhance.Sharpness(enhanced)
-            enhanced = enhancer.enhance(1.1)
-            
-            # 转换回numpy数组
-            enhanced_array = np.array(enhanced)
+            if out is None and inplace:
+                out = image
+            enhanced = self._enhance_opencv(image, out)
             
             logger.info("图像增强处理完成")
-            return enhanced_array
-            
+            return enhanced
+        
         except Exception as e:
             logger.error(f"图像增强失败: {e}")
             return image
     
+    def _enhance_pil(self, image: np.ndarray) -> np.ndarray:
+        """
+        使用PIL ImageEnhance的增强实现（每一步都会分配新图像）
+        
+        Args:
+            image: 输入图像
+            
+        Returns:
+            增强后的图像
+        """
+        import numpy as np
+        from PIL import Image, ImageEnhance
+            
+        # 转换为PIL图像进行增强
+        pil_image = Image.fromarray(image)
+            
+        # 对比度增强（内部: 灰度图、均值图及其RGB转换、混合结果）
+        enhancer = ImageEnhance.Contrast(pil_image)
+        enhanced = enhancer.enhance(self.contrast_factor)
+            
+        # 锐度增强（内部: 平滑图、混合结果）
+        enhancer = ImageEnhance.Sharpness(enhanced)
+        enhanced = enhancer.enhance(self.sharpness_factor)
+            
+        # 转换回numpy数组
+        enhanced_array = np.array(enhanced)
+            
+        logger.info("图像增强处理完成")
+        return enhanced_array
+            
+    def _enhance_opencv(self, image: np.ndarray, out: np.ndarray = None) -> np.ndarray:
+        """
+        在NumPy/OpenCV缓冲区上完成增强，与PIL实现的结果误差不超过±1
+        
+        对比度: PIL以灰度均值为中心线性拉伸并截断取整，整帧只需一次查找表映射；
+        锐度: PIL为 f·x + (1-f)·smooth(x)，smooth为 [[1,1,1],[1,5,1],[1,1,1]]/13，
+        合并为一个3×3卷积核，边缘像素与PIL一样保持不变。
+        
+        Args:
+            image: 输入RGB图像
+            out: 输出缓冲区（可以就是image），None时分配新数组
+        
+        Returns:
+            增强后的图像
+        """
+        import cv2
+        import numpy as np
+        
+        # 对比度：灰度均值（与PIL的L模式系数一致）
+        r, g, b = cv2.mean(image)[:3]
+        mean = int(0.299 * r + 0.587 * g + 0.114 * b + 0.5)
+        levels = mean + self.contrast_factor * (np.arange(256, dtype=np.float32) - mean)
+        lut = np.clip(levels, 0, 255).astype(np.uint8)
+        
+        contrasted = self._scratch_buffer(image)
+        cv2.LUT(image, lut, dst=contrasted)
+        
+        # 锐度：合并后的卷积核
+        f = self.sharpness_factor
+        kernel = np.full((3, 3), -(f - 1) / 13, dtype=np.float32)
+        kernel[1, 1] = f - (f - 1) * 5 / 13
+        
+        if out is None:
+            out = np.empty_like(image)
+        cv2.filter2D(contrasted, -1, kernel, dst=out, borderType=cv2.BORDER_REPLICATE)
+        
+        out[0, :] = contrasted[0, :]
+        out[-1, :] = contrasted[-1, :]
+        out[:, 0] = contrasted[:, 0]
+        out[:, -1] = contrasted[:, -1]
+        return out
+    
     def correct_skew(self, image: np.ndarray) -> np.ndarray:
         """
         倾斜校正
@@ -134,6 +505,9 @@ class ImageProcessor:
             校正后的图像
         """
         try:
+            import cv2
+            import numpy as np
+            
             # 转换为灰度图
             gray = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
             
@@ -171,6 +545,7 @@ class ImageProcessor:
                 corrected = cv2.warpAffine(image, rotation_matrix, (w, h), 
                                          flags=cv2.INTER_CUBIC, 
                                          borderMode=cv2.BORDER_REPLICATE)
+                self._record_geometry('skew_correction', rotation_matrix)
                 
                 logger.info(f"倾斜校正完成，角度: {median_angle:.2f}度")
                 return corrected
@@ -181,6 +556,102 @@ class ImageProcessor:
             logger.error(f"倾斜校正失败: {e}")
             return image
     
+    def correct_skew_min_area(self, image: np.ndarray) -> np.ndarray:
+        """
+        倾斜校正（基于墨迹像素最小外接矩形，适用于直线较少的图像）
+        
+        Args:
+            image: 输入图像
+            
+        Returns:
+            校正后的图像
+        """
+        try:
+            import cv2
+            import numpy as np
+            
+            # 二值化后取墨迹像素坐标
+            gray = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
+            _, binary = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV | cv2.THRESH_OTSU)
+            coords = cv2.findNonZero(binary)
+            
+            if coords is None or len(coords) < 10:
+                return image
+            
+            # 最小外接矩形角度归一到 [-45, 45)
+            angle = cv2.minAreaRect(coords)[-1]
+            if angle >= 45:
+                angle -= 90
+            elif angle < -45:
+                angle += 90
+            
+            if abs(angle) > 0.5:
+                h, w = image.shape[:2]
+                rotation_matrix = cv2.getRotationMatrix2D((w // 2, h // 2), angle, 1.0)
+                corrected = cv2.warpAffine(image, rotation_matrix, (w, h),
+                                         flags=cv2.INTER_CUBIC,
+                                         borderMode=cv2.BORDER_REPLICATE)
+                self._record_geometry('skew_correction_min_area', rotation_matrix)
+                
+                logger.info(f"倾斜校正(最小外接矩形)完成，角度: {angle:.2f}度")
+                return corrected
+            
+            return image
+            
+        except Exception as e:
+            logger.error(f"倾斜校正失败: {e}")
+            return image
+    
+    def binarize_image(self, image: np.ndarray) -> np.ndarray:
+        """
+        图像二值化（Otsu阈值，输出仍为三通道）
+        
+        Args:
+            image: 输入图像
+            
+        Returns:
+            二值化后的图像
+        """
+        try:
+            import cv2
+            
+            gray = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
+            _, binary = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY | cv2.THRESH_OTSU)
+            
+            logger.info("图像二值化完成")
+            return cv2.cvtColor(binary, cv2.COLOR_GRAY2RGB)
+            
+        except Exception as e:
+            logger.error(f"图像二值化失败: {e}")
+            return image
+    
+    def upscale_image(self, image: np.ndarray, factor: float = 2.0) -> np.ndarray:
+        """
+        放大图像（不超过最大尺寸），适用于字符过小的截图
+        
+        Args:
+            image: 输入图像
+            factor: 放大倍数
+            
+        Returns:
+            放大后的图像
+        """
+        h, w = image.shape[:2]
+        max_w, max_h = self.max_size
+        scale = min(factor, max_w / w, max_h / h)
+        
+        if scale <= 1.0:
+            return image
+        
+        import cv2
+        
+        new_w, new_h = int(w * scale), int(h * scale)
+        upscaled = cv2.resize(image, (new_w, new_h), interpolation=cv2.INTER_CUBIC)
+        self._record_geometry('upscale', [[new_w / w, 0, 0], [0, new_h / h, 0]])
+        
+        logger.info(f"图像放大: {w}x{h} -> {new_w}x{new_h}")
+        return upscaled
+    
     def denoise_image(self, image: np.ndarray) -> np.ndarray:
         """
         图像去噪
@@ -192,8 +663,10 @@ class ImageProcessor:
             去噪后的图像
         """
         try:
+            import cv2
+            
             # 使用非局部均值去噪
-            denoised = cv2.fastNlMeansDenoisingColored(image, None, 10, 10, 7, 21)
+            denoised = cv2.fastNlMeansDenoisingColored(image, None, *self.denoise_params)
             
             logger.info("图像去噪处理完成")
             return denoised
@@ -202,95 +675,261 @@ class ImageProcessor:
             logger.error(f"图像去噪失败: {e}")
             return image
     
-    def preprocess_image(self, image_path: str) -> Optional[Tuple[np.ndarray, dict]]:
+    def _get_step(self, name: str):
+        """
+        获取预处理步骤对应的方法
+        
+        Args:
+            name: 步骤名称
+            
+        Returns:
+            接收并返回图像的方法
+        """
+        steps = {
+            'crop': self.crop_to_content,
+            'resize': self.resize_image,
+            # 预处理流程持有当前帧，增强可以直接写回
+            'enhance': lambda image: self.enhance_image(image, inplace=True),
+            'skew_correction': self.correct_skew,
+            'skew_correction_min_area': self.correct_skew_min_area,
+            'denoise': self.denoise_image,
+            'binarize': self.binarize_image,
+            'upscale': self.upscale_image,
+        }
+        return steps[name]
+    
+    def preprocess_image(self, 
+                         image_path: str, 
+                         variant: str = None, 
+                         data: bytes = None,
+                         frame: int = None) -> Optional[Tuple[np.ndarray, dict]]:
         """
         完整的图像预处理流程
         
         Args:
             image_path: 图像文件路径
+            variant: 预处理变体名称（见PREPROCESSING_VARIANTS），None表示默认流程
+            data: 内存中的图像文件内容，None时从image_path读取
+            frame: 多页TIFF的帧序号，None表示第一帧
             
         Returns:
             处理后的图像和处理信息
         """
+        steps = self.PREPROCESSING_VARIANTS[variant] if variant else self.PREPROCESSING_STEPS
+        self._local.resize_info = None
+        self._local.crop_info = None
+        geometry = self._local.geometry = []
+        
         # 加载图像
-        image = self.load_image(image_path)
+        with tracer.span('decode', path=str(image_path)):
+            image = self.load_image(image_path, data, frame)
         if image is None:
+            self._local.geometry = None
             return None
             
         original_shape = image.shape
         
-        # 调整尺寸
-        image = self.resize_image(image)
-        
-        # 图像增强
-        image = self.enhance_image(image)
+        # 依次执行: 调整尺寸 → 图像增强 → 倾斜校正 → 去噪处理（变体的步骤不同）
+        for step in steps:
+            with tracer.span(f'preprocess.{step}') as span:
+                image = self._get_step(step)(image)
+                span.set_attribute('size', image.shape[:2][::-1])
+        self._local.geometry = None
         
-        # 倾斜校正
-        image = self.correct_skew(image)
-        
-        # 去噪处理
-        image = self.denoise_image(image)
-        
-        # 处理信息
+        # 处理信息（geometry 按顺序记录裁剪、缩放、旋转等几何变换）
         process_info = {
             'original_size': original_shape[:2][::-1],  # (width, height)
             'processed_size': image.shape[:2][::-1],
-            'preprocessing_steps': ['resize', 'enhance', 'skew_correction', 'denoise']
+            'preprocessing_steps': list(steps),
+            'geometry': geometry
         }
+        if self._local.crop_info is not None:
+            process_info['crop'] = self._local.crop_info
+            self._local.crop_info = None
+        if self._local.resize_info is not None:
+            process_info['resize'] = self._local.resize_info
+            self._local.resize_info = None
+        if variant:
+            process_info['variant'] = variant
+        if frame is not None:
+            process_info['frame'] = frame
         
         logger.info("图像预处理完成")
         return image, process_info
     
-    def image_to_base64(self, image: np.ndarray, format: str = 'PNG') -> str:
+    def encode_image(self, image: np.ndarray, format: str = 'PNG') -> bytes:
         """
-        将图像转换为base64编码
+        将图像编码为文件字节
         
         Args:
             image: numpy数组格式的图像
             format: 图像格式
             
         Returns:
-            base64编码的图像字符串
+            编码后的字节，失败时返回空字节串
         """
         try:
-            # 转换为PIL图像
-            pil_image = Image.fromarray(image)
+            from PIL import Image
+            
+            # 连续的RGB数组直接共享内存，避免fromarray拷贝整帧
+            if image.ndim == 3 and image.shape[2] == 3 and image.flags['C_CONTIGUOUS']:
+                h, w = image.shape[:2]
+                pil_image = Image.frombuffer('RGB', (w, h), image, 'raw', 'RGB', 0, 1)
+            else:
+                pil_image = Image.fromarray(image)
             
             # 转换为字节流
             buffer = io.BytesIO()
             pil_image.save(buffer, format=format)
             
-            # 编码为base64
-            image_base64 = base64.b64encode(buffer.getvalue()).decode('utf-8')
+            return buffer.getvalue()
             
-            return image_base64
+        except Exception as e:
+            logger.error(f"图像编码失败: {e}")
+            return b""
+    
+    def decode_image(self, encoded: bytes) -> Optional[np.ndarray]:
+        """
+        将编码后的字节解码为RGB图像（用于从缓存还原预处理结果）
+        
+        Args:
+            encoded: 编码后的图像字节
+            
+        Returns:
+            numpy数组格式的图像，失败时返回None
+        """
+        try:
+            import cv2
+            import numpy as np
+            
+            image = cv2.imdecode(np.frombuffer(encoded, dtype=np.uint8), cv2.IMREAD_COLOR)
+            if image is None:
+                return None
+            return cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
             
         except Exception as e:
-            logger.error(f"图像base64编码失败: {e}")
+            logger.error(f"图像解码失败: {e}")
+            return None
+    
+    def image_to_base64(self, image: np.ndarray, format: str = 'PNG') -> str:
+        """
+        将图像转换为base64编码
+        
+        Args:
+            image: numpy数组格式的图像
+            format: 图像格式
+            
+        Returns:
+            base64编码的图像字符串
+        """
+        encoded = self.encode_image(image, format)
+        if not encoded:
+            logger.error("图像base64编码失败")
             return ""
+            
+        # 编码为base64
+        return base64.b64encode(encoded).decode('utf-8')
+            
+    def prepare_upload(self, 
+                       image_path: str, 
+                       variant: str = None,
+                       source_sha256: str = None,
+                       format: str = 'PNG',
+                       data: bytes = None,
+                       frame: int = None) -> Optional[Tuple[bytes, dict]]:
+        """
+        预处理并编码图像，得到上传用的字节（优先使用磁盘缓存）
+            
+        Args:
+            image_path: 图像文件路径
+            variant: 预处理变体名称
+            source_sha256: 源文件哈希（已计算过时传入）
+            format: 编码格式
+            data: 内存中的图像文件内容，None时从image_path读取
+            frame: 多页TIFF的帧序号，None表示第一帧
+            
+        Returns:
+            (编码后的字节, 处理信息)，失败时返回None
+        """
+        key = None
+        if self.use_cache:
+            from .artifact_cache import make_cache_key
+            from .incremental import file_sha256
+            
+            try:
+                if source_sha256 is None:
+                    source_sha256 = hashlib.sha256(data).hexdigest() if data is not None else file_sha256(image_path)
+                stage_config = {**self.get_config(variant), 'format': format}
+                if frame is not None:
+                    stage_config['frame'] = frame
+                key = make_cache_key(source_sha256, stage_config)
+            except OSError as e:
+                logger.error(f"读取图像失败: {e}")
+                return None
+            
+            with tracer.span('cache.lookup') as span:
+                cached = self.artifact_cache.get(key)
+                span.set_attribute('hit', cached is not None)
+            if cached is not None:
+                logger.info(f"预处理缓存命中: {Path(image_path).name}")
+                return cached['encoded'], {**cached['process_info'], 'cache_hit': True}
+        
+        with tracer.span('preprocess', variant=variant or 'default'):
+            preprocess_result = self.preprocess_image(image_path, variant=variant, data=data, frame=frame)
+        if preprocess_result is None:
+            return None
+        
+        image, process_info = preprocess_result
+        
+        with tracer.span('encode', format=format) as span:
+            encoded = self.encode_image(image, format)
+            span.set_attribute('bytes', len(encoded))
+        
+        if not encoded:
+            return None
+        
+        resize = process_info.get('resize')
+        if resize is not None:
+            # 节省的上传字节数按本次编码的每像素字节数估算（负数表示为识别小字而放大）
+            sent_w, sent_h = process_info['processed_size']
+            resize['bytes_saved'] = int(resize['pixels_saved'] * len(encoded) / max(1, sent_w * sent_h))
+        
+        if key is not None:
+            with tracer.span('cache.store', bytes=len(encoded)):
+                self.artifact_cache.put(key, encoded, process_info)
+        return encoded, process_info
     
-    def get_image_info(self, image_path: str) -> dict:
+    def get_image_info(self, image_path: str, data: bytes = None, frame: int = None) -> dict:
         """
         获取图像基本信息
         
         Args:
             image_path: 图像文件路径
+            data: 内存中的图像文件内容，None时从image_path读取
+            frame: 多页TIFF的帧序号，不为None时返回该帧的尺寸并记录帧序号和总帧数
             
         Returns:
             图像信息字典
         """
         try:
+            from PIL import Image
+            
             path = Path(image_path)
             
-            with Image.open(image_path) as img:
+            with Image.open(image_path if data is None else io.BytesIO(data)) as img:
+                if frame:
+                    img.seek(frame)
                 info = {
                     'filename': path.name,
                     'size': img.size,  # (width, height)
                     'mode': img.mode,
                     'format': img.format,
-                    'file_size': path.stat().st_size
+                    'file_size': path.stat().st_size if data is None else len(data)
                 }
-                
+                if frame is not None:
+                    info['frame'] = frame
+                    info['n_frames'] = getattr(img, 'n_frames', 1)
+            
             return info
             
         except Exception as e:
@@ -298,6 +937,67 @@ class ImageProcessor:
             return {}
 
 
-# 创建全局实例
-image_processor = ImageProcessor()
+def map_bbox_to_original(bbox: dict, process_info: dict) -> Optional[dict]:
+    """
+    将上传图像中的区域坐标映射回原图坐标
+    
+    按相反顺序撤销 process_info['geometry'] 中记录的全部几何变换（裁剪、缩放、放大、倾斜校正的旋转）；
+    经过旋转时区域在原图中是倾斜的矩形，返回其四个角的外接矩形
+    
+    Args:
+        bbox: 区域坐标（x/y/width/height 或 top_left_x/top_left_y/width/height）
+        process_info: 预处理信息
+    
+    Returns:
+        原图中的区域坐标，键与输入相同；没有记录几何变换（旧版本的结果或缓存）或坐标不完整时返回None
+    """
+    geometry = process_info.get('geometry')
+    x_key, y_key = ('x', 'y') if 'x' in bbox else ('top_left_x', 'top_left_y')
+    if geometry is None or not all(isinstance(bbox.get(key), (int, float))
+                                   for key in (x_key, y_key, 'width', 'height')):
+        return None
+    
+    x, y, width, height = bbox[x_key], bbox[y_key], bbox['width'], bbox['height']
+    corners = [(x, y), (x + width, y), (x, y + height), (x + width, y + height)]
+    for transform in reversed(geometry):
+        (a, b, c), (d, e, f) = transform['matrix']
+        det = a * e - b * d
+        corners = [((e * (px - c) - b * (py - f)) / det, (a * (py - f) - d * (px - c)) / det)
+                   for px, py in corners]
+    
+    xs = [px for px, _ in corners]
+    ys = [py for _, py in corners]
+    mapped = dict(bbox)
+    mapped[x_key] = round(min(xs), 1)
+    mapped[y_key] = round(min(ys), 1)
+    mapped['width'] = round(max(xs) - min(xs), 1)
+    mapped['height'] = round(max(ys) - min(ys), 1)
+    return mapped
+
+
+# 全局实例（首次访问时创建）
+_image_processor: Optional[ImageProcessor] = None
+_instance_lock = threading.Lock()
+
+
+def get_image_processor() -> ImageProcessor:
+    """
+    获取全局图像处理器实例
+    
+    Returns:
+        图像处理器实例
+    """
+    global _image_processor
+    if _image_processor is None:
+        with _instance_lock:
+            if _image_processor is None:
+                _image_processor = ImageProcessor()
+    return _image_processor
+
+
+def __getattr__(name: str):
+    # 兼容 `from src.image_processor import image_processor` 的写法
+    if name == 'image_processor':
+        return get_image_processor()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
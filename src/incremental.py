@@ -0,0 +1,231 @@
+"""
+增量处理模块
+记录源文件内容哈希和流水线配置指纹，重复运行时跳过未变化的输入
+"""
+
+import hashlib
+import json
+import logging
+import re
+import threading
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+from .config import RESULTS_DIR, MATHPIX_API_URL, ensure_dir
+from .result_processor import result_basename
+
+logger = logging.getLogger(__name__)
+
+# 结果清单文件（追加写入的JSON Lines，记录 源文件 -> 哈希/指纹/结果文件）
+MANIFEST_FILENAME = '.manifest.jsonl'
+
+
+def file_sha256(path, chunk_size: int = 1024 * 1024) -> str:
+    """
+    计算文件内容的SHA-256
+    
+    Args:
+        path: 文件路径
+        chunk_size: 每次读取的字节数
+    
+    Returns:
+        十六进制哈希字符串
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def pipeline_fingerprint(image_processor=None) -> str:
+    """
+    计算流水线配置指纹（预处理参数、OCR选项变化时指纹随之变化）
+    
+    Args:
+        image_processor: 图像处理器，None时使用全局实例
+    
+    Returns:
+        十六进制指纹字符串（前16位）
+    """
+    from .image_processor import get_image_processor
+    from .mathpix_client import DEFAULT_OCR_OPTIONS
+    
+    config = {
+        'preprocess': (image_processor or get_image_processor()).get_config(),
+        'ocr_options': DEFAULT_OCR_OPTIONS,
+        'api_url': MATHPIX_API_URL
+    }
+    encoded = json.dumps(config, sort_keys=True, ensure_ascii=False).encode('utf-8')
+    return hashlib.sha256(encoded).hexdigest()[:16]
+
+
+def parse_since(value: str) -> float:
+    """
+    解析 --since 参数
+    
+    支持相对时间（如 30m、6h、7d）和ISO格式日期（如 2024-11-06 或 2024-11-06T10:30）
+    
+    Args:
+        value: 参数值
+    
+    Returns:
+        时间戳（秒）
+    
+    Raises:
+        ValueError: 无法解析时
+    """
+    match = re.fullmatch(r'\s*(\d+(?:\.\d+)?)\s*([smhdw])\s*', value)
+    if match:
+        amount = float(match.group(1))
+        unit = {'s': 'seconds', 'm': 'minutes', 'h': 'hours', 'd': 'days', 'w': 'weeks'}[match.group(2)]
+        return (datetime.now() - timedelta(**{unit: amount})).timestamp()
+    
+    return datetime.fromisoformat(value.strip()).timestamp()
+
+
+class ResultManifest:
+    """
+    结果清单
+    
+    以 (文件大小, 修改时间) 缓存源文件哈希，未变化的文件无需重新读取计算；
+    以结果JSON中的 metadata 为准，清单缺失时回退到读取结果文件。
+    """
+    
+    def __init__(self, results_dir: Path = RESULTS_DIR):
+        self.results_dir = Path(results_dir)
+        self.path = self.results_dir / MANIFEST_FILENAME
+        self._lock = threading.Lock()
+        self._entries: Optional[Dict[str, dict]] = None
+    
+    def _load(self) -> Dict[str, dict]:
+        """加载清单（后写入的记录覆盖先前的记录）"""
+        if self._entries is not None:
+            return self._entries
+        
+        entries = {}
+        lines = 0
+        if self.path.exists():
+            with open(self.path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    lines += 1
+                    try:
+                        entry = json.loads(line)
+                        entries[entry['source']] = entry
+                    except (ValueError, KeyError):
+                        # 忽略中断写入留下的残缺行
+                        continue
+        self._entries = entries
+        
+        # 重复记录过多时压缩清单
+        if lines > 2 * len(entries) + 100:
+            self._compact()
+        
+        return entries
+    
+    def _compact(self):
+        """重写清单，只保留每个源文件的最新记录"""
+        tmp_path = self.path.with_suffix('.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for entry in self._entries.values():
+                f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+        tmp_path.replace(self.path)
+        logger.info(f"结果清单已压缩: {len(self._entries)} 条记录")
+    
+    @staticmethod
+    def _key(path) -> str:
+        return str(Path(path).resolve())
+    
+    @staticmethod
+    def _read_metadata(json_path: Path) -> dict:
+        """读取结果文件中的metadata（文件不存在或已损坏时返回空字典）"""
+        try:
+            with open(json_path, 'r', encoding='utf-8') as f:
+                return json.load(f).get('metadata', {})
+        except (OSError, ValueError, AttributeError):
+            return {}
+    
+    def check(self, path, fingerprint: str, name: str = None) -> Tuple[bool, str]:
+        """
+        检查输入是否已按相同配置处理过
+        
+        清单记录的结果文件在记录后被改写（大小或修改时间变化）时，读取其metadata确认
+        source_sha256 仍与源文件一致才跳过，被其他输入的结果覆盖时重新处理
+        
+        Args:
+            path: 源文件路径
+            fingerprint: 当前流水线指纹
+            name: 输入相对于输入根目录的路径（结果文件按此命名，见 result_basename），None时使用文件名
+        
+        Returns:
+            (是否可以跳过, 源文件哈希)
+        """
+        path = Path(path)
+        stat = path.stat()
+        
+        with self._lock:
+            entry = self._load().get(self._key(path))
+        
+        if entry and entry['size'] == stat.st_size and entry['mtime_ns'] == stat.st_mtime_ns:
+            sha256 = entry['sha256']
+        else:
+            sha256 = file_sha256(path)
+        
+        if entry and entry['sha256'] == sha256 and entry['fingerprint'] == fingerprint:
+            json_path = Path(entry['json_path'])
+            try:
+                result_stat = json_path.stat()
+            except OSError:
+                result_stat = None
+            if result_stat is not None:
+                if (entry.get('result_size') == result_stat.st_size
+                        and entry.get('result_mtime_ns') == result_stat.st_mtime_ns):
+                    return True, sha256
+                if self._read_metadata(json_path).get('source_sha256') == sha256:
+                    self.record(path, sha256, fingerprint, str(json_path))
+                    return True, sha256
+        
+        # 清单中没有记录时，读取已有结果文件的metadata（HTML缺失说明上次写入未完成）
+        json_path = self.results_dir / f"{result_basename(name or path.name)}_result.json"
+        if json_path.exists() and json_path.with_suffix('.html').exists():
+            metadata = self._read_metadata(json_path)
+            if (metadata.get('source_sha256') == sha256
+                    and metadata.get('pipeline_fingerprint') == fingerprint):
+                self.record(path, sha256, fingerprint, str(json_path))
+                return True, sha256
+        
+        return False, sha256
+    
+    def record(self, path, sha256: str, fingerprint: str, json_path: str):
+        """
+        记录一次成功的处理
+        
+        Args:
+            path: 源文件路径
+            sha256: 源文件哈希
+            fingerprint: 流水线指纹
+            json_path: 结果JSON路径（需已写入，记录其大小和修改时间用于检测之后的覆盖）
+        """
+        path = Path(path)
+        stat = path.stat()
+        entry = {
+            'source': self._key(path),
+            'size': stat.st_size,
+            'mtime_ns': stat.st_mtime_ns,
+            'sha256': sha256,
+            'fingerprint': fingerprint,
+            'json_path': json_path,
+            'processed_time': datetime.now().isoformat()
+        }
+        try:
+            result_stat = Path(json_path).stat()
+            entry.update(result_size=result_stat.st_size, result_mtime_ns=result_stat.st_mtime_ns)
+        except OSError:
+            pass
+        
+        with self._lock:
+            self._load()[entry['source']] = entry
+            ensure_dir(self.results_dir)
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + '\n')
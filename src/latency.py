@@ -0,0 +1,68 @@
+"""
+延迟统计模块
+维护滚动窗口内的耗时分布，用于自适应超时和进度统计
+"""
+
+import math
+import threading
+from collections import deque
+from typing import Optional
+
+from .config import LATENCY_WINDOW, LATENCY_MIN_SAMPLES
+
+
+class LatencyTracker:
+    """滚动窗口延迟统计（线程安全）"""
+    
+    def __init__(self, window: int = LATENCY_WINDOW, min_samples: int = LATENCY_MIN_SAMPLES):
+        self.min_samples = min_samples
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+    
+    def record(self, seconds: float):
+        """
+        记录一次耗时
+        
+        Args:
+            seconds: 耗时（秒）
+        """
+        with self._lock:
+            self._samples.append(seconds)
+    
+    @property
+    def count(self) -> int:
+        """窗口内的样本数量"""
+        with self._lock:
+            return len(self._samples)
+    
+    def percentile(self, p: float) -> Optional[float]:
+        """
+        计算百分位数（最近邻法）
+        
+        Args:
+            p: 百分位 (0-100)
+        
+        Returns:
+            对应的耗时，样本不足时返回None
+        """
+        with self._lock:
+            if len(self._samples) < max(1, self.min_samples):
+                return None
+            ordered = sorted(self._samples)
+        
+        rank = max(1, math.ceil(p / 100 * len(ordered)))
+        return ordered[min(rank, len(ordered)) - 1]
+    
+    def snapshot(self) -> dict:
+        """
+        获取当前延迟分布摘要
+        
+        Returns:
+            包含样本数和p50/p95/p99的字典
+        """
+        return {
+            'samples': self.count,
+            'p50': self.percentile(50),
+            'p95': self.percentile(95),
+            'p99': self.percentile(99)
+        }
@@ -0,0 +1,311 @@
+"""
+LaTeX导出模块
+将多个识别结果流式合并为一个可编译的LaTeX题集文档
+"""
+
+import json
+import logging
+import os
+import re
+from pathlib import Path
+from typing import Iterable, Iterator, List, Optional, TextIO
+
+from .config import RESULTS_DIR
+
+logger = logging.getLogger(__name__)
+
+# 文档导言区（ctexart支持中文，xelatex编译）
+DEFAULT_PREAMBLE = r"""\documentclass[11pt]{ctexart}
+\usepackage{amsmath}
+\usepackage{amssymb}
+\usepackage[margin=2.5cm]{geometry}
+\setlength{\parindent}{0pt}
+\setlength{\parskip}{0.4em}
+"""
+
+# 支持的排序方式
+EXPORT_ORDERS = ('name', 'created', 'mtime')
+
+# 数学公式定界符: (开始, 结束, 是否为行间公式)
+_MATH_DELIMITERS = [
+    ('\\[', '\\]', True),
+    ('\\(', '\\)', False),
+    ('$$', '$$', True),
+    ('$', '$', False),
+]
+
+_TEXT_SPECIAL_CHARS = {
+    '\\': r'\textbackslash{}',
+    '{': r'\{',
+    '}': r'\}',
+    '#': r'\#',
+    '$': r'\$',
+    '%': r'\%',
+    '&': r'\&',
+    '_': r'\_',
+    '^': r'\^{}',
+    '~': r'\~{}',
+}
+_TEXT_SPECIAL_RE = re.compile(r'[\\{}#$%&_^~]')
+
+
+def escape_text(text: str) -> str:
+    """
+    转义普通文本中的LaTeX特殊字符
+    
+    Args:
+        text: 普通文本
+    
+    Returns:
+        转义后的文本
+    """
+    return _TEXT_SPECIAL_RE.sub(lambda m: _TEXT_SPECIAL_CHARS[m.group()], text)
+
+
+def split_math(text: str) -> List[tuple]:
+    """
+    将Mathpix文本拆分为普通文本和数学公式片段
+    
+    Args:
+        text: 包含 \\( \\)、\\[ \\]、$ $、$$ $$ 定界符的文本
+    
+    Returns:
+        片段列表 [(类型, 内容)]，类型为 'text'、'inline' 或 'display'
+    """
+    segments = []
+    buffer = []
+    i = 0
+    length = len(text)
+    
+    while i < length:
+        # 转义的美元符号属于普通文本
+        if text.startswith('\\$', i):
+            buffer.append('$')
+            i += 2
+            continue
+        
+        for start, end, display in _MATH_DELIMITERS:
+            if text.startswith(start, i):
+                close = text.find(end, i + len(start))
+                if buffer:
+                    segments.append(('text', ''.join(buffer)))
+                    buffer = []
+                # 缺少结束定界符时，把剩余内容都当作公式并补全
+                content = text[i + len(start): close if close != -1 else length]
+                segments.append(('display' if display else 'inline', content.strip()))
+                i = close + len(end) if close != -1 else length
+                break
+        else:
+            buffer.append(text[i])
+            i += 1
+    
+    if buffer:
+        segments.append(('text', ''.join(buffer)))
+    return segments
+
+
+def render_body(text: str) -> str:
+    """
+    将Mathpix文本转换为LaTeX正文（文本转义，公式统一使用 \\( \\) 和 \\[ \\]）
+    
+    Args:
+        text: Mathpix识别文本
+    
+    Returns:
+        LaTeX正文
+    """
+    parts = []
+    for kind, content in split_math(text):
+        if kind == 'text':
+            escaped = escape_text(content)
+            # 空行分段，单个换行作为独立段落，避免 \\\\ 出现在段首报错
+            escaped = re.sub(r'\n\s*\n+', '\n\n', escaped)
+            escaped = re.sub(r'(?<!\n)\n(?!\n)', '\\\\par\n', escaped)
+            parts.append(escaped)
+        elif not content:
+            continue
+        elif kind == 'inline':
+            parts.append(f'\\({content}\\)')
+        else:
+            parts.append(f'\n\\[\n{content}\n\\]\n')
+    return ''.join(parts).strip()
+
+
+def iter_result_files(source, order: str = 'name') -> Iterator[Path]:
+    """
+    按指定顺序列出结果文件（只保存路径和排序键，不加载结果内容）
+    
+    Args:
+        source: 结果目录或单个结果JSON文件
+        order: 排序方式 name / created / mtime
+    
+    Returns:
+        结果文件路径迭代器
+    """
+    source = Path(source)
+    if source.is_file():
+        yield source
+        return
+    
+    paths = (p for p in source.glob('*_result.json') if p.is_file())
+    
+    if order == 'name':
+        keyed = ((p.name, p) for p in paths)
+    elif order == 'mtime':
+        keyed = ((p.stat().st_mtime_ns, p) for p in paths)
+    elif order == 'created':
+        keyed = ((_read_created_time(p), p) for p in paths)
+    else:
+        raise ValueError(f"不支持的排序方式: {order}")
+    
+    for _, path in sorted(keyed, key=lambda item: item[0]):
+        yield path
+
+
+def _read_created_time(path: Path) -> str:
+    """读取结果文件的创建时间（读取失败时排在最后）"""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f).get('metadata', {}).get('created_time', '')
+    except (OSError, ValueError):
+        return '\uffff'
+
+
+def iter_results(paths: Iterable[Path]) -> Iterator[dict]:
+    """
+    逐个加载结果文件，同一时刻只持有一个结果
+    
+    Args:
+        paths: 结果文件路径
+    
+    Returns:
+        结果数据迭代器
+    """
+    for path in paths:
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                yield json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"跳过无法读取的结果文件: {path}: {e}")
+
+
+class LatexDocumentWriter:
+    """增量写入LaTeX文档（写入临时文件，完成后原子替换）"""
+    
+    def __init__(self, output_path, title: str = None, preamble: str = DEFAULT_PREAMBLE):
+        self.output_path = Path(output_path)
+        self.title = title
+        self.preamble = preamble
+        self.count = 0
+        self._tmp_path = self.output_path.with_name(f".{self.output_path.name}.tmp")
+        self._file: Optional[TextIO] = None
+    
+    def __enter__(self):
+        self.open()
+        return self
+    
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+    
+    def open(self):
+        """写入导言区并开始正文"""
+        self.output_path.parent.mkdir(parents=True, exist_ok=True)
+        self._file = open(self._tmp_path, 'w', encoding='utf-8')
+        self._file.write(self.preamble)
+        if self.title:
+            self._file.write(f"\\title{{{escape_text(self.title)}}}\n\\date{{}}\n")
+        self._file.write("\n\\begin{document}\n")
+        if self.title:
+            self._file.write("\\maketitle\n")
+    
+    def write_result(self, result_data: dict, include_failed: bool = False) -> bool:
+        """
+        写入一道题目（一个源图像对应一节）
+        
+        Args:
+            result_data: 结果数据
+            include_failed: 是否包含识别失败的结果
+        
+        Returns:
+            是否写入
+        """
+        ocr_result = result_data.get('ocr_result', {})
+        if not ocr_result.get('success') and not include_failed:
+            return False
+        
+        raw_text = ocr_result.get('raw_text') or ''
+        latex_content = ocr_result.get('latex_content') or ''
+        
+        if raw_text:
+            body = render_body(raw_text)
+        elif latex_content:
+            body = f"\\[\n{latex_content.strip()}\n\\]"
+        else:
+            body = '（无识别内容）'
+        
+        filename = result_data.get('image_info', {}).get('filename', '') or f'题目 {self.count + 1}'
+        
+        self._file.write(f"\n\\section{{{escape_text(filename)}}}\n{body}\n")
+        self.count += 1
+        return True
+    
+    def close(self):
+        """结束文档并替换目标文件"""
+        self._file.write("\n\\end{document}\n")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        os.replace(self._tmp_path, self.output_path)
+    
+    def abort(self):
+        """放弃写入，删除临时文件"""
+        if self._file is not None:
+            self._file.close()
+        try:
+            self._tmp_path.unlink()
+        except FileNotFoundError:
+            pass
+
+
+def export_latex(output_path,
+                 sources: List = None,
+                 order: str = 'name',
+                 title: str = None,
+                 include_failed: bool = False) -> dict:
+    """
+    将结果流式导出为一个LaTeX文档
+    
+    Args:
+        output_path: 输出的.tex文件路径
+        sources: 结果目录或结果JSON文件列表（按给定顺序），默认为结果目录
+        order: 目录内结果的排序方式
+        title: 文档标题
+        include_failed: 是否包含识别失败的结果
+    
+    Returns:
+        导出结果信息
+    """
+    try:
+        sources = sources or [RESULTS_DIR]
+        paths = (path for source in sources for path in iter_result_files(source, order))
+        
+        skipped = 0
+        with LatexDocumentWriter(output_path, title=title) as writer:
+            for result_data in iter_results(paths):
+                if not writer.write_result(result_data, include_failed=include_failed):
+                    skipped += 1
+        
+        logger.info(f"LaTeX文档已导出: {output_path}，题目数量: {writer.count}")
+        return {
+            'success': True,
+            'output_path': str(output_path),
+            'problem_count': writer.count,
+            'skipped': skipped
+        }
+    
+    except Exception as e:
+        logger.error(f"导出LaTeX文档失败: {e}")
+        return {'success': False, 'error': str(e), 'output_path': str(output_path)}
@@ -0,0 +1,182 @@
+"""
+日志模块
+通过队列将日志写入移出处理线程，并为每条记录附加任务ID，
+使并发处理时交错的日志可以按图像归类
+"""
+
+import atexit
+import contextvars
+import copy
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Optional
+
+from .config import LOG_LEVEL, LOG_FORMAT, LOG_FILE, LOG_JSON, LOG_QUEUE_SIZE
+
+# 当前任务ID（跨模块传递，无需修改各处理函数的参数）
+_job_id = contextvars.ContextVar('job_id', default='-')
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def new_job_id() -> str:
+    """
+    生成新的任务ID
+    
+    Returns:
+        12位十六进制字符串
+    """
+    return uuid.uuid4().hex[:12]
+
+
+def current_job_id() -> str:
+    """
+    获取当前任务ID
+    
+    Returns:
+        任务ID，不在任务中时为 '-'
+    """
+    return _job_id.get()
+
+
+@contextmanager
+def job_context(job_id: str = None):
+    """
+    在上下文内为日志记录设置任务ID
+    
+    Args:
+        job_id: 任务ID，None时自动生成
+    
+    Yields:
+        当前任务ID
+    """
+    token = _job_id.set(job_id or new_job_id())
+    try:
+        yield _job_id.get()
+    finally:
+        _job_id.reset(token)
+
+
+def submit_with_context(executor, fn, *args, **kwargs):
+    """
+    向线程池提交任务并保留当前上下文（任务ID随之进入worker线程）
+    
+    Args:
+        executor: concurrent.futures 执行器
+        fn: 要执行的函数
+    
+    Returns:
+        Future对象
+    """
+    context = contextvars.copy_context()
+    return executor.submit(context.run, fn, *args, **kwargs)
+
+
+class JobIdFilter(logging.Filter):
+    """为日志记录附加 job_id 字段（在产生日志的线程中执行）"""
+    
+    def filter(self, record: logging.LogRecord) -> bool:
+        if not hasattr(record, 'job_id'):
+            record.job_id = _job_id.get()
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """结构化日志格式，每条记录输出一行JSON"""
+    
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'time': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'job_id': getattr(record, 'job_id', '-'),
+            'thread': record.threadName,
+            'message': record.getMessage()
+        }
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class _DroppingQueueHandler(logging.handlers.QueueHandler):
+    """队列满时丢弃记录，保证日志永远不会阻塞处理线程"""
+    
+    dropped = 0
+    
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # 消息和异常堆栈在当前线程展开（参数可能在之后被修改），格式化留给监听线程
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+    
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def setup_logging(level: str = LOG_LEVEL, 
+                  json_format: bool = LOG_JSON, 
+                  log_file: str = LOG_FILE) -> logging.handlers.QueueListener:
+    """
+    配置队列日志：处理线程只负责入队，格式化和写文件在监听线程中完成
+    
+    Args:
+        level: 日志级别
+        json_format: 是否输出JSON行格式
+        log_file: 日志文件路径
+    
+    Returns:
+        已启动的QueueListener
+    """
+    global _listener
+    if _listener is not None:
+        stop_logging()
+    
+    formatter = JsonFormatter() if json_format else logging.Formatter(LOG_FORMAT)
+    
+    stream_handler = logging.StreamHandler(sys.stdout)
+    # delay=True: 首次写日志时才打开文件
+    file_handler = logging.FileHandler(log_file, encoding='utf-8', delay=True)
+    for handler in (stream_handler, file_handler):
+        handler.setFormatter(formatter)
+    
+    queue_handler = _DroppingQueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+    queue_handler.addFilter(JobIdFilter())
+    
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(getattr(logging, level))
+    
+    _listener = logging.handlers.QueueListener(
+        queue_handler.queue, stream_handler, file_handler, respect_handler_level=True
+    )
+    _listener.start()
+    atexit.register(stop_logging)
+    return _listener
+
+
+def stop_logging():
+    """停止监听线程并写出队列中剩余的日志"""
+    global _listener
+    listener, _listener = _listener, None
+    if listener is None:
+        return
+    listener.stop()
+    for handler in listener.handlers:
+        handler.close()
@@ -3,13 +3,18 @@ Mathpix API客户端
 负责与Mathpix OCR服务进行通信
 """
 
-import requests
+import copy
 import json
 import time
+import random
 import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError, as_completed
 from typing import Dict, Optional, Tuple
-from datetime import datetime
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
 import base64
+import uuid
 
 from .config import (
     MATHPIX_APP_ID, 
@@ -17,121 +22,631 @@ from .config import (
     MATHPIX_API_URL,
     MAX_RETRIES,
     TIMEOUT,
-    OCR_CONFIDENCE_THRESHOLD
+    OCR_CONFIDENCE_THRESHOLD,
+    HTTP_POOL_CONNECTIONS,
+    HTTP_POOL_MAXSIZE,
+    HTTP_KEEP_ALIVE,
+    RETRY_BASE_DELAY,
+    RETRY_MAX_DELAY,
+    ADAPTIVE_TIMEOUT,
+    TIMEOUT_MIN,
+    TIMEOUT_P99_MULTIPLIER,
+    HEDGE_REQUESTS,
+    HEDGE_MAX_RATIO,
+    MATHPIX_TRANSPORT,
+    CIRCUIT_FATAL_CODES
 )
+from .latency import LatencyTracker
+from .cassette import Cassette, cassette_from_config, request_fingerprint
+from .circuit_breaker import CircuitBreaker
+from .credentials import Credential, CredentialPool
+from .log_context import submit_with_context
+from .tracing import tracer
+from .usage_ledger import UsageLedger, get_usage_ledger
 
 logger = logging.getLogger(__name__)
 
+# 默认OCR选项
+DEFAULT_OCR_OPTIONS = {
+    'formats': ['text', 'latex_styled'],
+    'data_options': {
+        'include_asciimath': True,
+        'include_latex': True
+    }
+}
+
+
+def guess_image_mime(data: bytes) -> str:
+    """
+    根据文件头判断图像的MIME类型
+    
+    Args:
+        data: 编码后的图像字节
+    
+    Returns:
+        MIME类型，无法识别时为 application/octet-stream
+    """
+    if data[:8] == b'\x89PNG\r\n\x1a\n':
+        return 'image/png'
+    if data[:3] == b'\xff\xd8\xff':
+        return 'image/jpeg'
+    if data[:4] in (b'II*\x00', b'MM\x00*'):
+        return 'image/tiff'
+    if data[:2] == b'BM':
+        return 'image/bmp'
+    return 'application/octet-stream'
+
+
+class _BodyReader:
+    """
+    依次读取多个缓冲区的只读流
+    
+    requests 根据 __len__ 设置 Content-Length，http.client 按块调用 read() 发送，
+    图像部分通过memoryview切片，发送过程中不会再复制整个请求体
+    """
+    
+    def __init__(self, parts: tuple):
+        self._parts = [memoryview(part) for part in parts]
+        self._index = 0
+        self._offset = 0
+        self._length = sum(part.nbytes for part in self._parts)
+    
+    def __len__(self) -> int:
+        return self._length
+    
+    def __iter__(self):
+        while True:
+            chunk = self.read(65536)
+            if not chunk:
+                return
+            yield chunk
+    
+    def read(self, size: int = -1) -> bytes:
+        if size is None or size < 0:
+            size = self._length
+        
+        chunks = []
+        while size > 0 and self._index < len(self._parts):
+            part = self._parts[self._index]
+            chunk = part[self._offset:self._offset + size]
+            chunks.append(chunk)
+            size -= chunk.nbytes
+            self._offset += chunk.nbytes
+            if self._offset >= part.nbytes:
+                self._index += 1
+                self._offset = 0
+        return b''.join(chunks)
+
+
+class RequestPayload:
+    """
+    OCR请求体（可在重试和对冲请求间复用，每次发送时生成新的读取流）
+    
+    multipart: options_json 字段 + file 文件部分，图像字节原样发送；
+    json: 图像以base64写入 src 字段的data URI（旧方式，体积约大33%）
+    """
+    
+    def __init__(self, image, options: dict, transport: str = MATHPIX_TRANSPORT):
+        if isinstance(image, str):
+            # 已是base64字符串，只能以JSON方式发送
+            transport = 'json'
+            mime = 'image/jpeg'
+        else:
+            mime = guess_image_mime(image)
+        self.transport = transport
+        
+        if transport == 'multipart':
+            boundary = uuid.uuid4().hex
+            extension = mime.rsplit('/', 1)[-1]
+            head = (
+                f'--{boundary}\r\n'
+                f'Content-Disposition: form-data; name="options_json"\r\n'
+                f'Content-Type: application/json\r\n\r\n'
+                f'{json.dumps(options)}\r\n'
+                f'--{boundary}\r\n'
+                f'Content-Disposition: form-data; name="file"; filename="image.{extension}"\r\n'
+                f'Content-Type: {mime}\r\n\r\n'
+            ).encode('utf-8')
+            tail = f'\r\n--{boundary}--\r\n'.encode('utf-8')
+            self.content_type = f'multipart/form-data; boundary={boundary}'
+            self._parts = (head, image, tail)
+        elif transport == 'json':
+            if not isinstance(image, str):
+                image = base64.b64encode(image).decode('ascii')
+            body = json.dumps({'src': f"data:{mime};base64,{image}", **options}).encode('utf-8')
+            self.content_type = 'application/json'
+            self._parts = (body,)
+        else:
+            raise ValueError(f"未知的上传方式: {transport}")
+        
+        self.size = sum(len(part) for part in self._parts)
+    
+    def body(self) -> _BodyReader:
+        """
+        生成一次发送用的请求体流
+        
+        Returns:
+            _BodyReader实例
+        """
+        return _BodyReader(self._parts)
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """
+    解析Retry-After响应头
+    
+    Args:
+        value: 响应头的值（秒数或HTTP日期）
+        
+    Returns:
+        需要等待的秒数，无法解析时返回None
+    """
+    if not value:
+        return None
+    
+    value = value.strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+
+class RetryPolicy:
+    """
+    重试退避策略
+    
+    使用 decorrelated jitter: 每次等待时间在 [base, 上次等待 × 3] 之间随机，
+    避免多个并发worker同步重试；服务端返回Retry-After时至少等待该时长。
+    """
+    
+    def __init__(self, 
+                 base_delay: float = RETRY_BASE_DELAY, 
+                 max_delay: float = RETRY_MAX_DELAY,
+                 rng: random.Random = None):
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._rng = rng or random.Random()
+    
+    def next_delay(self, previous_delay: float, retry_after: float = None) -> float:
+        """
+        计算下一次重试前的等待时间
+        
+        Args:
+            previous_delay: 上一次的等待时间
+            retry_after: 服务端要求的等待时间（秒）
+            
+        Returns:
+            等待时间（秒）
+        """
+        upper = max(self.base_delay, previous_delay * 3)
+        delay = min(self.max_delay, self._rng.uniform(self.base_delay, upper))
+        
+        if retry_after is not None:
+            # 服务端的要求优先于max_delay，额外的抖动避免所有worker同时醒来
+            delay = max(delay, retry_after + self._rng.uniform(0, self.base_delay))
+        
+        return delay
+
 
 class MathpixClient:
-    """Mathpix API客户端"""
+    """Mathpix API客户端（可在多线程间共享）"""
     
-    def __init__(self, app_id: str = None, app_key: str = None):
-        self.app_id = app_id or MATHPIX_APP_ID
-        self.app_key = app_key or MATHPIX_APP_KEY
+    def __init__(self, 
+                 app_id: str = None, 
+                 app_key: str = None,
+                 pool_connections: int = HTTP_POOL_CONNECTIONS,
+                 pool_maxsize: int = HTTP_POOL_MAXSIZE,
+                 keep_alive: bool = HTTP_KEEP_ALIVE,
+                 retry_policy: RetryPolicy = None,
+                 adaptive_timeout: bool = ADAPTIVE_TIMEOUT,
+                 hedge: bool = HEDGE_REQUESTS,
+                 hedge_max_ratio: float = HEDGE_MAX_RATIO,
+                 breaker: CircuitBreaker = None,
+                 ledger: UsageLedger = None,
+                 credentials: CredentialPool = None,
+                 transport: str = MATHPIX_TRANSPORT,
+                 cassette: Cassette = None):
+        # 显式传入一组凭证时只使用该账号，否则按配置创建凭证池
+        if app_id or app_key:
+            credentials = CredentialPool([Credential(app_id or MATHPIX_APP_ID, app_key or MATHPIX_APP_KEY)])
+        self.credentials = credentials or CredentialPool.from_config()
+        self.app_id = self.credentials.credentials[0].app_id
+        self.app_key = self.credentials.credentials[0].app_key
         self.api_url = MATHPIX_API_URL
-        self.session = requests.Session()
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.keep_alive = keep_alive
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.adaptive_timeout = adaptive_timeout
+        self.hedge = hedge
+        self.hedge_max_ratio = hedge_max_ratio
+        self.transport = transport
+        # 录制/回放（回放时不访问网络）
+        self.cassette = cassette if cassette is not None else cassette_from_config()
+        self._session = None
+        self._hedge_executor = None
         
-        # 设置请求头
-        self.session.headers.update({
-            'app_id': self.app_id,
-            'app_key': self.app_key,
-            'Content-type': 'application/json'
-        })
+        # 成功请求的延迟分布，用于推算超时和对冲时机
+        self.latency = LatencyTracker()
+        
+        # 熔断器，可在多个客户端间共享（统计服务端错误；账号问题由凭证池中各账号的熔断器处理）
+        self.breaker = breaker or CircuitBreaker(fatal_codes=())
+        
+        # 持久化的日/月用量账本（与调度器的额度检查共用）
+        self._ledger = ledger
+        
+        # 保护使用统计和会话创建
+        self._lock = threading.Lock()
         
         # API使用统计
         self.usage_count = 0
         self.last_request_time = None
+        self.hedge_count = 0
+        self.bytes_sent = 0
+    
+    @property
+    def session(self):
+        """HTTP会话（首次发送请求时才导入requests并创建）"""
+        if self._session is None:
+            with self._lock:
+                if self._session is None:
+                    self._session = self._create_session()
+        return self._session
+            
+    @property
+    def ledger(self) -> UsageLedger:
+        """用量账本（默认使用全局账本）"""
+        if self._ledger is None:
+            self._ledger = get_usage_ledger()
+        return self._ledger
+    
+    def _create_session(self):
+        """
+        创建配置了连接池的HTTP会话
+            
+        Returns:
+            requests.Session实例
+        """
+        import requests
+        from requests.adapters import HTTPAdapter
+        
+        session = requests.Session()
+        
+        # 连接池大小应覆盖并发线程数，否则多余的连接用完即关闭，无法复用
+        adapter = HTTPAdapter(
+            pool_connections=self.pool_connections,
+            pool_maxsize=self.pool_maxsize,
+            max_retries=0
+        )
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        
+        # 设置请求头（app_id/app_key 随每个请求按所选账号设置）
+        session.headers.update({
+            'Content-type': 'application/json',
+            'Connection': 'keep-alive' if self.keep_alive else 'close'
+        })
+        return session
+    
+    def _record_request(self, body_size: int = 0) -> int:
+        """
+        记录一次API调用
+        
+        Args:
+            body_size: 请求体字节数
+        
+        Returns:
+            更新后的使用次数
+        """
+        with self._lock:
+            self.usage_count += 1
+            self.bytes_sent += body_size
+            self.last_request_time = datetime.now()
+            usage_count = self.usage_count
+        
+        try:
+            self.ledger.charge()
+        except OSError as e:
+            logger.warning(f"更新用量账本失败: {e}")
+        return usage_count
+        
+    def current_timeout(self, attempt: int = 0) -> float:
+        """
+        计算本次请求的超时时间
+        
+        样本充足时取 p99 × 倍数（不低于TIMEOUT_MIN），每次重试加倍，
+        上限为TIMEOUT；避免一个卡住的连接占用worker整整TIMEOUT秒。
+        
+        Args:
+            attempt: 当前重试序号（从0开始）
+            
+        Returns:
+            超时时间（秒）
+        """
+        if not self.adaptive_timeout:
+            return TIMEOUT
+        
+        p99 = self.latency.percentile(99)
+        if p99 is None:
+            return TIMEOUT
+        
+        timeout = max(TIMEOUT_MIN, p99 * TIMEOUT_P99_MULTIPLIER) * (2 ** attempt)
+        return min(TIMEOUT, timeout)
+    
+    def _post(self, payload: RequestPayload, timeout: float):
+        """
+        使用负载最低的健康账号发送单次HTTP请求，并记录使用次数和延迟
+        
+        Args:
+            payload: 请求体
+            timeout: 超时时间（秒）
+            
+        Returns:
+            requests.Response，没有可用账号时返回None
+        """
+        credential = self.credentials.acquire()
+        if credential is None:
+            return None
+        
+        start_time = time.perf_counter()
+        status_code = None
+        try:
+            with tracer.span('http.post', timeout=round(timeout, 2), app_id=credential.name) as span:
+                response = self.session.post(
+                    self.api_url,
+                    data=payload.body(),
+                    headers={**credential.headers, 'Content-Type': payload.content_type},
+                    timeout=timeout
+                )
+                status_code = response.status_code
+                span.set_attribute('status_code', status_code)
+        finally:
+            retry_after = None
+            if status_code == 429:
+                retry_after = parse_retry_after(response.headers.get('Retry-After'))
+            self.credentials.release(credential, status_code, retry_after)
+        
+        # 每个返回的响应都会计入配额（包括对冲请求中被丢弃的一方）
+        self._record_request(payload.size)
+        
+        if response.status_code == 200:
+            self.latency.record(time.perf_counter() - start_time)
+        
+        return response
+    
+    def _try_acquire_hedge(self) -> bool:
+        """
+        检查对冲配额并占用一次
+        
+        Returns:
+            是否允许发送对冲请求
+        """
+        with self._lock:
+            allowed = self.hedge_max_ratio * max(self.usage_count, 1)
+            if self.hedge_count + 1 > allowed:
+                return False
+            self.hedge_count += 1
+            return True
+    
+    def _post_hedged(self, payload: RequestPayload, timeout: float):
+        """
+        发送请求，超过观测到的p95仍未返回时再发送一个重复请求，取先返回者
+        
+        Args:
+            payload: 请求体
+            timeout: 超时时间（秒）
+            
+        Returns:
+            requests.Response
+        """
+        hedge_delay = self.latency.percentile(95)
+        if hedge_delay is None:
+            return self._post(payload, timeout)
+        
+        with self._lock:
+            if self._hedge_executor is None:
+                self._hedge_executor = ThreadPoolExecutor(
+                    max_workers=self.pool_maxsize * 2,
+                    thread_name_prefix='mathpix-hedge'
+                )
+            executor = self._hedge_executor
+        
+        primary = submit_with_context(executor, self._post, payload, timeout)
+        try:
+            return primary.result(timeout=hedge_delay)
+        except FutureTimeoutError:
+            pass
+        
+        if not self._try_acquire_hedge():
+            return primary.result()
+        
+        logger.info(f"请求超过p95 ({hedge_delay:.2f}秒)，发送对冲请求")
+        backup = submit_with_context(executor, self._post, payload, timeout)
+        
+        # 取第一个成功返回的响应；两者都失败时抛出最后一个异常
+        error = None
+        for future in as_completed([primary, backup]):
+            try:
+                response = future.result()
+            except Exception as e:
+                error = e
+                continue
+            if response is None:
+                continue
+            if future is backup:
+                logger.info("对冲请求先返回")
+            return response
+        if error is not None:
+            raise error
+        return None
         
     def check_credentials(self) -> bool:
         """
         检查API凭证是否有效
         
         Returns:
-            凭证是否有效
+            凭证是否有效（凭证池中每个账号都需要设置；回放录制的响应时不需要凭证）
         """
-        if not self.app_id or self.app_id == "your_app_id_here":
-            logger.error("Mathpix APP ID未设置")
-            return False
-            
-        if not self.app_key or self.app_key == "your_app_key_here":
-            logger.error("Mathpix APP KEY未设置")
-            return False
+        if self.cassette is not None and self.cassette.replaying:
+            return True
+        
+        for credential in self.credentials.credentials:
+            if not credential.app_id or credential.app_id == "your_app_id_here":
+                logger.error("Mathpix APP ID未设置")
+                return False
+        
+            if not credential.app_key or credential.app_key == "your_app_key_here":
+                logger.error("Mathpix APP KEY未设置")
+                return False
             
         return True
     
-    def _make_request(self, data: dict, retries: int = MAX_RETRIES) -> Optional[dict]:
+    def _make_request(self, payload: RequestPayload, retries: int = MAX_RETRIES) -> Optional[dict]:
         """
         发送API请求
         
         Args:
-            data: 请求数据
+            payload: 请求体
             retries: 重试次数
             
         Returns:
             API响应数据
         """
+        import requests
+        
+        delay = self.retry_policy.base_delay
+        
         for attempt in range(retries):
-            try:
-                # 记录请求时间
-                self.last_request_time = datetime.now()
-                
-                # 发送请求
-                response = self.session.post(
-                    self.api_url,
-                    json=data,
-                    timeout=TIMEOUT
-                )
-                
-                # 更新使用计数
-                self.usage_count += 1
+            retry_after = None
+            
+            with tracer.span('http.attempt', attempt=attempt + 1) as span:
+                # 熔断器打开时快速失败，不再重试
+                if not self.breaker.allow_request():
+                    span.set_attribute('error', 'circuit_open')
+                    return self._circuit_open_error()
                 
-                # 检查响应状态
-                if response.status_code == 200:
-                    result = response.json()
-                    logger.info(f"API请求成功，使用次数: {self.usage_count}")
-                    return result
+                try:
+                    # 发送请求
+                    timeout = self.current_timeout(attempt)
+                    if self.hedge:
+                        response = self._post_hedged(payload, timeout)
+                    else:
+                        response = self._post(payload, timeout)
                     
-                elif response.status_code == 429:
-                    # 速率限制，等待后重试
-                    wait_time = 2 ** attempt
-                    logger.warning(f"API速率限制，等待 {wait_time} 秒后重试")
-                    time.sleep(wait_time)
-                    continue
+                    if response is None:
+                        # 所有账号都已摘除或被限速
+                        self.breaker.record_neutral()
+                        span.set_attribute('error', 'no_credentials')
+                        return self._credentials_unavailable_error()
+                    span.set_attribute('status_code', response.status_code)
                     
-                elif response.status_code == 401:
-                    logger.error("API认证失败，请检查APP ID和APP KEY")
-                    return None
+                    # 检查响应状态
+                    if response.status_code == 200:
+                        result = response.json()
+                        self.breaker.record_success()
+                        logger.info(f"API请求成功，使用次数: {self.usage_count}")
+                        return result
                     
-                elif response.status_code == 402:
-                    logger.error("API配额已用完")
-                    return None
+                    elif response.status_code == 429:
+                        # 速率限制（不计入熔断错误率）：该账号进入冷却，有其他账号时立即换号重试
+                        self.breaker.record_neutral()
+                        retry_after = parse_retry_after(response.headers.get('Retry-After'))
+                        logger.warning(f"API速率限制，Retry-After: {retry_after}")
+                        if len(self.credentials.credentials) > 1:
+                            continue
                     
-                else:
-                    logger.error(f"API请求失败，状态码: {response.status_code}")
-                    logger.error(f"响应内容: {response.text}")
+                    elif response.status_code in CIRCUIT_FATAL_CODES:
+                        # 账号问题：凭证池已摘除该账号，换其他账号重试
+                        self.breaker.record_neutral()
+                        if response.status_code == 401:
+                            logger.error("API认证失败，请检查APP ID和APP KEY")
+                        else:
+                            logger.error("API配额已用完")
+                        if not self.credentials.has_usable():
+                            return self._credentials_unavailable_error()
+                        continue
                     
-            except requests.exceptions.Timeout:
-                logger.warning(f"请求超时，重试 {attempt + 1}/{retries}")
+                    else:
+                        self.breaker.record_failure(response.status_code)
+                        logger.error(f"API请求失败，状态码: {response.status_code}")
+                        logger.error(f"响应内容: {response.text}")
+                        if response.status_code == 503:
+                            retry_after = parse_retry_after(response.headers.get('Retry-After'))
                 
-            except requests.exceptions.RequestException as e:
-                logger.error(f"请求异常: {e}")
+                except requests.exceptions.Timeout:
+                    span.set_attribute('error', 'timeout')
+                    self.breaker.record_failure(reason='请求超时')
+                    logger.warning(f"请求超时 ({timeout:.1f}秒)，重试 {attempt + 1}/{retries}")
+                
+                except requests.exceptions.RequestException as e:
+                    span.set_attribute('error', str(e))
+                    self.breaker.record_failure(reason=str(e))
+                    logger.error(f"请求异常: {e}")
                 
             # 等待后重试
             if attempt < retries - 1:
-                wait_time = 2 ** attempt
-                time.sleep(wait_time)
+                delay = self.retry_policy.next_delay(delay, retry_after)
+                logger.info(f"等待 {delay:.2f} 秒后重试 ({attempt + 2}/{retries})")
+                with tracer.span('backoff.sleep', delay=round(delay, 3)):
+                    time.sleep(delay)
         
         logger.error("API请求失败，已达到最大重试次数")
         return None
     
-    def ocr_image(self, image_base64: str, options: dict = None) -> Optional[dict]:
+    def _credentials_unavailable_error(self) -> dict:
+        """
+        构造没有可用账号时的错误响应（格式与熔断器打开时一致，调用方可据此暂缓任务）
+        
+        Returns:
+            包含error和error_info的字典
+        """
+        drained = not self.credentials.has_usable()
+        reason = '所有账号均已摘除（401/402）' if drained else '所有账号均被限速'
+        logger.warning(f"没有可用的Mathpix账号: {reason}")
+        return {
+            'error': f"没有可用的Mathpix账号: {reason}",
+            'error_info': {
+                'id': 'circuit_open',
+                'fatal': drained,
+                'retry_in': self.credentials.retry_in() if drained else 1.0
+            }
+        }
+    
+    def _circuit_open_error(self) -> dict:
+        """
+        构造熔断器打开时的错误响应（格式与Mathpix错误响应一致）
+        
+        Returns:
+            包含error和error_info的字典
+        """
+        snapshot = self.breaker.snapshot()
+        logger.warning(f"熔断器已打开，快速失败: {snapshot['last_error']}")
+        return {
+            'error': f"Mathpix熔断器已打开: {snapshot['last_error']}",
+            'error_info': {
+                'id': 'circuit_open',
+                'fatal': snapshot['fatal'],
+                'retry_in': snapshot['retry_in']
+            }
+        }
+    
+    def ocr_image(self, image, options: dict = None, retries: int = MAX_RETRIES) -> Optional[dict]:
         """
         对图像进行OCR识别
         
         Args:
-            image_base64: base64编码的图像
+            image: 编码后的图像字节（按 transport 方式上传），或base64字符串（以JSON方式上传）
             options: OCR选项
+            retries: 最多尝试次数（1表示只请求一次，不重试）
             
         Returns:
             OCR结果
@@ -140,28 +655,32 @@ class MathpixClient:
             return None
             
         # 默认选项
-        default_options = {
-            'formats': ['text', 'latex_styled'],
-            'data_options': {
-                'include_asciimath': True,
-                'include_latex': True
-            }
-        }
+        default_options = copy.deepcopy(DEFAULT_OCR_OPTIONS)
         
         if options:
             default_options.update(options)
         
-        # 构建请求数据
-        request_data = {
-            'src': f"data:image/jpeg;base64,{image_base64}",
-            **default_options
-        }
+        fingerprint = None
+        if self.cassette is not None:
+            fingerprint = request_fingerprint(image, default_options)
         
         logger.info("开始OCR识别...")
         start_time = time.time()
         
-        # 发送请求
-        result = self._make_request(request_data)
+        if self.cassette is not None and self.cassette.replaying:
+            # 回放录制的响应，不发送请求
+            result = self.cassette.replay(fingerprint)
+        else:
+            # 构建请求体（重试时复用）
+            request_data = RequestPayload(image, default_options, self.transport)
+            
+            # 发送请求
+            result = self._make_request(request_data, retries)
+            
+            # 录制Mathpix返回的响应（熔断、无可用账号等本地生成的错误不录制）
+            if (result and self.cassette is not None
+                    and (result.get('error_info') or {}).get('id') != 'circuit_open'):
+                self.cassette.record(fingerprint, result, time.time() - start_time, request_data.size)
         
         if result:
             processing_time = time.time() - start_time
@@ -198,6 +717,8 @@ class MathpixClient:
             # 检查是否有错误
             if 'error' in ocr_result:
                 parsed_result['error'] = ocr_result['error']
+                if 'error_info' in ocr_result:
+                    parsed_result['error_info'] = ocr_result['error_info']
                 return parsed_result
             
             # 提取文本内容
@@ -247,19 +768,21 @@ class MathpixClient:
                 'usage_count': self.usage_count
             }
     
-    def process_image(self, image_base64: str, options: dict = None) -> dict:
+    def process_image(self, image, options: dict = None, retries: int = MAX_RETRIES) -> dict:
         """
         完整的图像处理流程
         
         Args:
-            image_base64: base64编码的图像
+            image: 编码后的图像字节或base64字符串
             options: 处理选项
+            retries: 最多尝试次数（1表示只请求一次，不重试）
             
         Returns:
             处理结果
         """
         # 执行OCR
-        ocr_result = self.ocr_image(image_base64, options)
+        with tracer.span('ocr.request'):
+            ocr_result = self.ocr_image(image, options, retries)
         
         if ocr_result is None:
             return {
@@ -274,7 +797,8 @@ class MathpixClient:
             }
         
         # 解析结果
-        parsed_result = self.parse_ocr_result(ocr_result)
+        with tracer.span('ocr.parse'):
+            parsed_result = self.parse_ocr_result(ocr_result)
         
         return parsed_result
     
@@ -285,14 +809,56 @@ class MathpixClient:
         Returns:
             使用信息
         """
+        with self._lock:
+            usage_count = self.usage_count
+            last_request_time = self.last_request_time
+            hedge_count = self.hedge_count
+            bytes_sent = self.bytes_sent
+        
+        ledger = self.ledger.snapshot()
+        
         return {
-            'usage_count': self.usage_count,
-            'last_request_time': self.last_request_time.isoformat() if self.last_request_time else None,
-            'monthly_limit': 1000,  # Mathpix免费版限制
-            'remaining': max(0, 1000 - self.usage_count)
+            'usage_count': usage_count,
+            'last_request_time': last_request_time.isoformat() if last_request_time else None,
+            'monthly_limit': ledger['monthly_budget'],
+            'month_count': ledger['month_count'],
+            'daily_limit': ledger['daily_budget'],
+            'day_count': ledger['day_count'],
+            'remaining': ledger['remaining'],
+            'hedge_count': hedge_count,
+            'transport': self.transport,
+            'bytes_sent': bytes_sent,
+            'latency': self.latency.snapshot(),
+            'circuit_breaker': self.breaker.snapshot(),
+            'credentials': self.credentials.snapshot(),
+            'cassette': self.cassette.get_stats() if self.cassette is not None else None,
+            'current_timeout': self.current_timeout()
         }
 
 
-# 创建全局实例
-mathpix_client = MathpixClient()
+# 全局实例（首次访问时创建）
+_mathpix_client: Optional[MathpixClient] = None
+_instance_lock = threading.Lock()
+
+
+def get_mathpix_client() -> MathpixClient:
+    """
+    获取全局Mathpix客户端实例
+    
+    Returns:
+        Mathpix客户端实例
+    """
+    global _mathpix_client
+    if _mathpix_client is None:
+        with _instance_lock:
+            if _mathpix_client is None:
+                _mathpix_client = MathpixClient()
+    return _mathpix_client
+
+
+def __getattr__(name: str):
+    # 兼容 `from src.mathpix_client import mathpix_client` 的写法
+    if name == 'mathpix_client':
+        return get_mathpix_client()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
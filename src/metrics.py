@@ -0,0 +1,83 @@
+"""
+运行指标模块
+提供进程内的计数器和事件记录，供熔断器、调度器等组件上报状态
+"""
+
+import threading
+import time
+from collections import deque
+from typing import Dict, List
+
+
+class MetricsRegistry:
+    """进程内指标注册表（线程安全）"""
+    
+    def __init__(self, max_events: int = 1000):
+        self._lock = threading.Lock()
+        self._counters: Dict[str, float] = {}
+        self._gauges: Dict[str, float] = {}
+        self._events = deque(maxlen=max_events)
+    
+    def increment(self, name: str, value: float = 1):
+        """
+        累加计数器
+        
+        Args:
+            name: 指标名称
+            value: 增量
+        """
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+    
+    def set_gauge(self, name: str, value: float):
+        """
+        设置瞬时值指标
+        
+        Args:
+            name: 指标名称
+            value: 当前值
+        """
+        with self._lock:
+            self._gauges[name] = value
+    
+    def event(self, name: str, **fields):
+        """
+        记录一条事件（如状态切换）
+        
+        Args:
+            name: 事件名称
+            **fields: 事件字段
+        """
+        with self._lock:
+            self._events.append({'name': name, 'time': time.time(), **fields})
+    
+    def events(self, name: str = None) -> List[dict]:
+        """
+        获取已记录的事件
+        
+        Args:
+            name: 只返回该名称的事件，None表示全部
+        
+        Returns:
+            事件列表（按时间顺序）
+        """
+        with self._lock:
+            return [dict(e) for e in self._events if name is None or e['name'] == name]
+    
+    def snapshot(self) -> dict:
+        """
+        获取所有指标的快照
+        
+        Returns:
+            包含计数器、瞬时值和最近事件的字典
+        """
+        with self._lock:
+            return {
+                'counters': dict(self._counters),
+                'gauges': dict(self._gauges),
+                'events': [dict(e) for e in self._events]
+            }
+
+
+# 全局实例
+metrics = MetricsRegistry()
@@ -0,0 +1,376 @@
+"""
+处理流水线模块
+封装 图像信息 → 预处理 → OCR识别 → 保存结果 的完整流程，
+供命令行和嵌入方（如评分服务）在进程内复用
+"""
+
+import asyncio
+import contextvars
+import functools
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+from typing import AsyncIterator, Callable, Iterable, Iterator, Optional
+
+from .config import PIPELINE_WORKERS
+from .log_context import job_context, current_job_id, submit_with_context
+from .result_processor import result_basename
+from .result_writer import all_written
+from .tracing import tracer
+
+logger = logging.getLogger(__name__)
+
+
+def _silent(*args, **kwargs):
+    """静默输出"""
+
+
+class Pipeline:
+    """
+    图像识别流水线（线程安全，可在多个线程和协程间共享）
+    
+    各组件在构造时确定并在多次调用间复用；未传入的组件使用各自的默认配置新建。
+    控制台输出默认关闭，verbose=True 时通过 output 输出各步骤进度
+    """
+    
+    def __init__(self,
+                 image_processor=None,
+                 mathpix_client=None,
+                 result_processor=None,
+                 variant_retrier=None,
+                 results_dir: str = None,
+                 max_workers: int = PIPELINE_WORKERS,
+                 verbose: bool = False,
+                 output: Callable = None):
+        if image_processor is None:
+            from .image_processor import ImageProcessor
+            image_processor = ImageProcessor()
+        if mathpix_client is None:
+            from .mathpix_client import MathpixClient
+            mathpix_client = MathpixClient()
+        if result_processor is None:
+            from .result_processor import ResultProcessor
+            result_processor = ResultProcessor()
+        if results_dir is not None:
+            result_processor.results_dir = Path(results_dir)
+        
+        self.image_processor = image_processor
+        self.mathpix_client = mathpix_client
+        self.result_processor = result_processor
+        self.variant_retrier = variant_retrier
+        self.max_workers = max_workers
+        self.verbose = verbose
+        self.output = output or print
+        
+        self._fingerprint = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+    
+    @property
+    def fingerprint(self) -> str:
+        """本流水线的配置指纹（用于增量处理）"""
+        if self._fingerprint is None:
+            from .incremental import pipeline_fingerprint
+            self._fingerprint = pipeline_fingerprint(self.image_processor)
+        return self._fingerprint
+    
+    def _get_executor(self) -> ThreadPoolExecutor:
+        """线程池（首次批量或异步调用时创建）"""
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_workers,
+                    thread_name_prefix='pipeline'
+                )
+            return self._executor
+    
+    def process(self,
+                image_path: str,
+                source_sha256: str = None,
+                fingerprint: str = None,
+                variant_retrier=None,
+                job_id: str = None,
+                verbose: bool = None,
+                frame: int = None,
+                output_name: str = None) -> dict:
+        """
+        处理单张图像
+        
+        Args:
+            image_path: 图像文件路径
+            source_sha256: 源文件哈希（已计算过时传入，避免重复读取）
+            fingerprint: 流水线配置指纹，None时使用本流水线的指纹
+            variant_retrier: 本次使用的多变体重试器，None时使用构造时传入的
+            job_id: 任务ID（写入该图像处理期间的每条日志），None时自动生成
+            verbose: 是否输出进度，None时使用构造时的设置
+            frame: 多页TIFF的帧序号（从0开始），None表示单帧图像
+            output_name: 输入相对于输入根目录的路径，用于命名结果文件（见 result_basename），None时使用文件名
+        
+        Returns:
+            处理结果（包含 image_path 和 job_id；处理单帧时包含 frame）
+        """
+        verbose = self.verbose if verbose is None else verbose
+        say = self.output if verbose else _silent
+        
+        with job_context(job_id) as job_id, tracer.span('job', image=str(image_path), frame=frame) as span:
+            logger.info(f"开始处理任务: {image_path}" + (f" 第 {frame + 1} 帧" if frame is not None else ''))
+            try:
+                result = self._run(image_path, say, source_sha256,
+                                   fingerprint or self.fingerprint,
+                                   variant_retrier or self.variant_retrier, frame, output_name)
+            except Exception as e:
+                logger.error(f"处理图像时发生异常: {e}", exc_info=True)
+                result = {'success': False, 'error': f'处理异常: {str(e)}'}
+            span.set_attribute('success', result['success'])
+        
+        result['image_path'] = str(image_path)
+        result['job_id'] = job_id
+        if frame is not None:
+            result['frame'] = frame
+        return result
+    
+    def process_document(self, image_path: str, **kwargs) -> dict:
+        """
+        依次处理文件中的每一帧（多页TIFF每页一个任务），单帧文件等同于 process
+        
+        Args:
+            image_path: 图像文件路径
+            **kwargs: 传给 process 的参数
+        
+        Returns:
+            全部帧成功时 success 为True；各帧结果在 frames 中。遇到熔断或额度不足时停止，
+            返回该帧的结果（保留 error_info，调用方可稍后重试整个文件）
+        """
+        n_frames = self.image_processor.count_frames(image_path)
+        if n_frames == 1:
+            return self.process(image_path, **kwargs)
+        
+        frames = []
+        for frame in range(n_frames):
+            result = self.process(image_path, frame=frame, **kwargs)
+            frames.append(result)
+            error_info = result.get('error_info') or {}
+            if not result['success'] and error_info.get('id') in ('circuit_open', 'budget_deferred'):
+                return {**result, 'frames': frames}
+        
+        failed = [r for r in frames if not r['success']]
+        return {
+            'success': not failed,
+            'error': f"{len(failed)}/{n_frames} 帧处理失败: {failed[0]['error']}" if failed else None,
+            'image_path': str(image_path),
+            'frames': frames,
+            'written': None if failed else all_written(r['written'] for r in frames)
+        }
+    
+    def _run(self, image_path: str, say: Callable, source_sha256: str,
+             fingerprint: str, variant_retrier, frame: int = None, output_name: str = None) -> dict:
+        """
+        执行各处理步骤（在任务上下文中调用）
+        
+        Returns:
+            处理结果
+        """
+        from .incremental import file_sha256
+        
+        say(f"\n🔄 开始处理图像: {Path(image_path).name}" + (f" 第 {frame + 1} 帧" if frame is not None else ''))
+        say("=" * 60)
+        
+        # 步骤1: 获取图像信息
+        say("📋 步骤 1/5: 获取图像信息...")
+        image_info = self.image_processor.get_image_info(image_path, frame=frame)
+        if not image_info:
+            return {'success': False, 'error': '无法获取图像信息'}
+        
+        say(f"   ✅ 图像尺寸: {image_info['size'][0]} × {image_info['size'][1]}")
+        say(f"   ✅ 文件大小: {image_info['file_size'] / 1024:.1f} KB")
+        say(f"   ✅ 图像格式: {image_info['format']}")
+        
+        # 步骤2: 图像预处理
+        say("\n🔧 步骤 2/5: 图像预处理...")
+        if source_sha256 is None:
+            with tracer.span('hash'):
+                source_sha256 = file_sha256(image_path)
+        upload = self.image_processor.prepare_upload(image_path, source_sha256=source_sha256, frame=frame)
+        if upload is None:
+            return {'success': False, 'error': '图像预处理失败'}
+        
+        encoded_image, process_info = upload
+        if process_info.pop('cache_hit', False):
+            say(f"   ✅ 命中预处理缓存: {' → '.join(process_info['preprocessing_steps'])}")
+        else:
+            say(f"   ✅ 预处理完成: {' → '.join(process_info['preprocessing_steps'])}")
+        
+        # 步骤3: 上传数据（multipart方式直接发送编码后的字节，不再转换为base64）
+        say("\n📦 步骤 3/5: 图像编码...")
+        say(f"   ✅ 编码完成: {len(encoded_image) / 1024:.1f} KB，上传方式: {self.mathpix_client.transport}")
+        
+        # 步骤4: OCR识别
+        say("\n🤖 步骤 4/5: OCR识别...")
+        
+        # 检查API凭证
+        if not self.mathpix_client.check_credentials():
+            return {'success': False, 'error': 'Mathpix API凭证未配置或无效'}
+        
+        # 显示API使用信息
+        usage_info = self.mathpix_client.get_usage_info()
+        say(f"   📊 API使用情况: 本月 {usage_info['month_count']}/{usage_info['monthly_limit'] or '不限'} "
+            f"(剩余: {usage_info['remaining'] if usage_info['remaining'] is not None else '不限'})")
+        
+        # 执行OCR
+        ocr_result = self.mathpix_client.process_image(encoded_image)
+        
+        if not ocr_result['success']:
+            error_msg = ocr_result.get('error', '未知错误')
+            say(f"   ❌ OCR识别失败: {error_msg}")
+            return {
+                'success': False,
+                'error': f'OCR识别失败: {error_msg}',
+                'error_info': ocr_result.get('error_info')
+            }
+        
+        say(f"   ✅ OCR识别成功!")
+        say(f"   📊 置信度: {ocr_result['confidence']:.2%}")
+        say(f"   ⏱️  处理时间: {ocr_result['processing_time']:.2f}秒")
+        say(f"   📝 识别字符: {len(ocr_result['raw_text'])} 个")
+        
+        # 置信度较低时尝试其他预处理变体
+        if variant_retrier is not None:
+            ocr_result, process_info = variant_retrier.improve(image_path, ocr_result, process_info, frame,
+                                                              image_processor=self.image_processor,
+                                                              mathpix_client=self.mathpix_client)
+            if 'variant_retry' in process_info:
+                say(f"   🔁 多变体重试: 选用 {process_info['variant']}，置信度: {ocr_result['confidence']:.2%}")
+        
+        # 步骤5: 保存结果
+        say("\n💾 步骤 5/5: 保存结果...")
+        
+        # 记录源文件哈希和流水线指纹，用于增量处理时判断是否可以跳过
+        metadata = {
+            'source_sha256': source_sha256,
+            'pipeline_fingerprint': fingerprint,
+            'job_id': current_job_id()
+        }
+        
+        # 多页文件的每一帧单独保存结果
+        base_filename = result_basename(output_name) if output_name else None
+        if frame is not None:
+            metadata['frame'] = frame
+            metadata['n_frames'] = image_info.get('n_frames')
+            base_filename = f"{base_filename or Path(image_path).stem}_frame{frame + 1:03d}"
+        
+        save_result = self.result_processor.process_and_save_results(
+            image_info, ocr_result, process_info, base_filename=base_filename, metadata=metadata
+        )
+        
+        if not save_result['success']:
+            return {'success': False, 'error': f"保存结果失败: {save_result.get('error', '未知错误')}"}
+        
+        say(f"   📝 JSON结果（后台写入）: {save_result['json_path']}")
+        say(f"   📝 HTML页面（后台写入）: {save_result['html_path']}")
+        
+        # written: 结果文件写入完成的Future，记录清单、移动输入等操作应在其完成回调中进行
+        return {
+            'success': True,
+            'image_info': image_info,
+            'ocr_result': ocr_result,
+            'save_result': save_result,
+            'metadata': metadata,
+            'written': save_result['written']
+        }
+    
+    def process_many(self, image_paths: Iterable[str], **kwargs) -> Iterator[dict]:
+        """
+        并发处理多张图像，按完成顺序返回结果
+        
+        Args:
+            image_paths: 图像文件路径
+            **kwargs: 传给 process 的参数（fingerprint、variant_retrier、verbose）
+        
+        Yields:
+            处理结果（通过 image_path 字段对应输入）；提前停止迭代时取消尚未开始的任务
+        """
+        executor = self._get_executor()
+        futures = [submit_with_context(executor, self.process, path, **kwargs) for path in image_paths]
+        try:
+            for future in as_completed(futures):
+                yield future.result()
+        finally:
+            for future in futures:
+                future.cancel()
+    
+    async def aprocess(self, image_path: str, **kwargs) -> dict:
+        """
+        process 的异步版本（在流水线线程池中执行，不阻塞事件循环）
+        
+        Args:
+            image_path: 图像文件路径
+            **kwargs: 传给 process 的参数
+        
+        Returns:
+            处理结果
+        """
+        loop = asyncio.get_running_loop()
+        context = contextvars.copy_context()
+        call = functools.partial(context.run, self.process, image_path, **kwargs)
+        return await loop.run_in_executor(self._get_executor(), call)
+    
+    async def aprocess_many(self, image_paths: Iterable[str], **kwargs) -> AsyncIterator[dict]:
+        """
+        process_many 的异步版本，按完成顺序产出结果
+        
+        Args:
+            image_paths: 图像文件路径
+            **kwargs: 传给 process 的参数
+        
+        Yields:
+            处理结果
+        """
+        tasks = [asyncio.ensure_future(self.aprocess(path, **kwargs)) for path in image_paths]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield await next_done
+        finally:
+            for task in tasks:
+                task.cancel()
+    
+    def close(self):
+        """关闭流水线线程池（等待进行中的任务完成）"""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+# 基于全局组件实例的默认流水线（命令行使用）
+_pipeline: Optional[Pipeline] = None
+_instance_lock = threading.Lock()
+
+
+def get_pipeline() -> Pipeline:
+    """
+    获取默认流水线（复用 image_processor / mathpix_client / result_processor 全局实例）
+    
+    Returns:
+        Pipeline实例
+    """
+    global _pipeline
+    if _pipeline is None:
+        with _instance_lock:
+            if _pipeline is None:
+                from .image_processor import get_image_processor
+                from .mathpix_client import get_mathpix_client
+                from .result_processor import get_result_processor
+                
+                _pipeline = Pipeline(
+                    image_processor=get_image_processor(),
+                    mathpix_client=get_mathpix_client(),
+                    result_processor=get_result_processor()
+                )
+    return _pipeline
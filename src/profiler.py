@@ -0,0 +1,301 @@
+"""
+性能分析模块
+按固定间隔采样各工作线程的调用栈，以当前打开的span作为阶段归属，
+输出可用于火焰图工具（flamegraph.pl、speedscope、inferno）的折叠调用栈和热点函数摘要；
+可选用tracemalloc定期快照，统计各处理函数中内存占用最大的分配位置
+"""
+
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+from .config import (
+    PROFILE_INTERVAL,
+    PROFILE_TOP_N,
+    PROFILE_MEMORY_INTERVAL,
+    PROFILE_TRACEMALLOC_FRAMES
+)
+from .tracing import tracer
+
+logger = logging.getLogger(__name__)
+
+# 项目源码目录（内存分配按第一个落在项目代码中的调用位置归类）
+_SOURCE_DIR = str(Path(__file__).resolve().parent)
+
+
+def _frame_label(code) -> str:
+    """调用栈中一帧的名称（不含行号，同一函数的样本合并）"""
+    name = getattr(code, 'co_qualname', code.co_name)
+    label = f"{name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+    # 折叠格式以分号分隔各帧
+    return label.replace(';', ':')
+
+
+def count_frame_buffers(fn: Callable, frame_bytes: int) -> Tuple[object, int]:
+    """
+    用tracemalloc测量一次调用期间同时占用的整帧缓冲区数（新增内存的峰值 / 帧大小）
+    
+    NumPy和OpenCV的数组经过Python的内存分配器，可以被统计；Pillow的图像内存不经过它，
+    对PIL实现只能统计到转回NumPy时的拷贝，结果是实际值的下限。
+    测量期间其他线程的分配也会计入，应在单线程中使用
+    
+    Args:
+        fn: 要测量的无参函数
+        frame_bytes: 一帧图像的字节数
+    
+    Returns:
+        (fn的返回值, 整帧缓冲区数)
+    """
+    import tracemalloc
+    
+    started = not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start()
+    else:
+        tracemalloc.reset_peak()
+    baseline = tracemalloc.get_traced_memory()[0]
+    try:
+        result = fn()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        if started:
+            tracemalloc.stop()
+    return result, int((peak - baseline) / frame_bytes)
+
+
+class SamplingProfiler:
+    """采样分析器（只采样处于span中的线程，空闲的线程池worker不计入）"""
+    
+    def __init__(self,
+                 interval: float = PROFILE_INTERVAL,
+                 memory: bool = False,
+                 memory_interval: float = PROFILE_MEMORY_INTERVAL):
+        self.interval = interval
+        self.memory = memory
+        self.memory_interval = memory_interval
+        
+        self.stacks: Counter = Counter()  # 折叠调用栈 -> 样本数
+        self.stage_samples: Counter = Counter()  # 最内层span -> 样本数
+        self.samples = 0
+        # 内存分配位置 -> 快照中的最大占用（字节）和对应的分配次数
+        self.allocations: Dict[Tuple[str, str], Tuple[int, int]] = {}
+        self.memory_snapshots = 0
+        
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._started = None
+        self.duration = 0.0
+    
+    def start(self):
+        """开始采样"""
+        tracer.track_threads(True)
+        if self.memory:
+            import tracemalloc
+            # 先导入处理阶段延迟导入的依赖：导入期间的大量分配会一直存活，
+            # 使每次快照的耗时成倍增加，且与各阶段的内存开销无关
+            import cv2
+            import numpy
+            from PIL import Image, ImageEnhance
+            tracemalloc.start(PROFILE_TRACEMALLOC_FRAMES)
+        self._started = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, name='profiler', daemon=True)
+        self._thread.start()
+    
+    def stop(self):
+        """停止采样"""
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        self.duration = time.perf_counter() - self._started
+        tracer.track_threads(False)
+        if self.memory:
+            import tracemalloc
+            self._snapshot_memory()
+            tracemalloc.stop()
+    
+    def _run(self):
+        next_memory = time.perf_counter() + self.memory_interval
+        while not self._stop.wait(self.interval):
+            self._sample()
+            if self.memory and time.perf_counter() >= next_memory:
+                self._snapshot_memory()
+                next_memory = time.perf_counter() + self.memory_interval
+    
+    def _sample(self):
+        """采样一次所有处于span中的线程"""
+        spans = tracer.thread_spans()
+        if not spans:
+            return
+        
+        frames = sys._current_frames()
+        for ident, names in spans.items():
+            frame = frames.get(ident)
+            if frame is None:
+                continue
+            
+            stack = []
+            while frame is not None:
+                stack.append(_frame_label(frame.f_code))
+                frame = frame.f_back
+            stack.reverse()
+            
+            # 以阶段（span）作为火焰图的根，同一阶段的样本归在一起
+            key = ';'.join([f"[{name}]" for name in names] + stack)
+            self.stacks[key] += 1
+            self.stage_samples[names[-1]] += 1
+            self.samples += 1
+    
+    def _snapshot_memory(self):
+        """
+        记录当前存活的内存分配，按分配位置和所在的项目函数归类，保留各位置的最大占用
+        
+        （整帧拷贝等临时分配只在阶段执行期间存活，定期快照中占用最大的位置即该阶段的主要开销）
+        """
+        import tracemalloc
+        
+        if not tracemalloc.is_tracing():
+            return
+        
+        snapshot = tracemalloc.take_snapshot()
+        current: Dict[Tuple[str, str], List[int]] = {}
+        for trace in snapshot.traces:
+            # 调用栈由外到内排列，最后一帧是实际分配的位置
+            frames = trace.traceback
+            # 模块导入（字节码、常量）和分析器自身的分配不计入
+            if any(f.filename.startswith('<frozen') or f.filename == __file__ for f in frames):
+                continue
+            site = f"{os.path.basename(frames[-1].filename)}:{frames[-1].lineno}"
+            # 离分配位置最近的项目代码（调用PIL/NumPy的那一行）
+            owner = next((f"{os.path.basename(f.filename)}:{f.lineno}" for f in reversed(frames)
+                          if f.filename.startswith(_SOURCE_DIR)), None)
+            if owner is None:
+                continue
+            totals = current.setdefault((owner, site), [0, 0])
+            totals[0] += trace.size
+            totals[1] += 1
+        
+        for key, (size, count) in current.items():
+            if size > self.allocations.get(key, (0, 0))[0]:
+                self.allocations[key] = (size, count)
+        self.memory_snapshots += 1
+    
+    def write_collapsed(self, path) -> int:
+        """
+        写出折叠调用栈（每行 "帧1;帧2;...;帧N 样本数"）
+        
+        Args:
+            path: 输出路径
+        
+        Returns:
+            写出的不同调用栈数量
+        """
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        return len(self.stacks)
+    
+    def hot_functions(self, top_n: int = PROFILE_TOP_N) -> List[dict]:
+        """
+        统计热点函数
+        
+        Args:
+            top_n: 返回条数
+        
+        Returns:
+            按自身样本数排序的函数列表（自身样本数、包含子调用的样本数及占比）
+        """
+        own: Counter = Counter()
+        total: Counter = Counter()
+        for stack, count in self.stacks.items():
+            frames = [f for f in stack.split(';') if not f.startswith('[')]
+            if not frames:
+                continue
+            own[frames[-1]] += count
+            for label in set(frames):
+                total[label] += count
+        
+        samples = max(1, self.samples)
+        return [
+            {
+                'function': label,
+                'self': count,
+                'self_pct': count / samples * 100,
+                'total': total[label],
+                'total_pct': total[label] / samples * 100
+            }
+            for label, count in own.most_common(top_n)
+        ]
+    
+    def top_allocations(self, top_n: int = PROFILE_TOP_N) -> List[dict]:
+        """
+        统计内存占用最大的分配位置
+        
+        Args:
+            top_n: 返回条数
+        
+        Returns:
+            按最大占用排序的 (项目代码位置, 实际分配位置, 字节数, 分配次数) 列表
+        """
+        ordered = sorted(self.allocations.items(), key=lambda item: item[1][0], reverse=True)
+        return [
+            {'owner': owner, 'site': site, 'size': size, 'count': count}
+            for (owner, site), (size, count) in ordered[:top_n]
+        ]
+    
+    def format_report(self, top_n: int = PROFILE_TOP_N) -> str:
+        """
+        生成文本摘要
+        
+        Args:
+            top_n: 每部分显示的条数
+        
+        Returns:
+            各阶段样本占比、热点函数和（开启时）内存分配位置
+        """
+        samples = max(1, self.samples)
+        lines = [f"📈 性能分析: 采样 {self.samples} 次，耗时 {self.duration:.1f}秒，间隔 {self.interval * 1000:.0f}ms"]
+        
+        lines.append("\n   各阶段样本（最内层span）:")
+        for stage, count in self.stage_samples.most_common(top_n):
+            lines.append(f"   {count / samples * 100:6.1f}%  {count:7d}  {stage}")
+        
+        lines.append(f"\n   热点函数（前{top_n}，按自身样本）:")
+        lines.append(f"   {'自身%':>6}  {'累计%':>6}  函数")
+        for entry in self.hot_functions(top_n):
+            lines.append(f"   {entry['self_pct']:6.1f}  {entry['total_pct']:6.1f}  {entry['function']}")
+        
+        if self.memory:
+            lines.append(f"\n   内存分配位置（前{top_n}，{self.memory_snapshots} 次快照中的最大占用）:")
+            for entry in self.top_allocations(top_n):
+                lines.append(f"   {entry['size'] / 1024 / 1024:8.1f} MB  {entry['count']:6d} 次  "
+                             f"{entry['owner']} -> {entry['site']}")
+        
+        return '\n'.join(lines)
+    
+    def export(self, path, top_n: int = PROFILE_TOP_N) -> str:
+        """
+        停止采样，写出折叠调用栈和摘要（摘要另存为 <path>.txt）
+        
+        Args:
+            path: 折叠调用栈输出路径
+            top_n: 摘要中每部分显示的条数
+        
+        Returns:
+            摘要文本
+        """
+        self.stop()
+        count = self.write_collapsed(path)
+        report = self.format_report(top_n)
+        with open(f"{path}.txt", 'w', encoding='utf-8') as f:
+            f.write(report + '\n')
+        logger.info(f"性能分析结果已写入: {path} ({count} 个调用栈)")
+        return report
@@ -0,0 +1,206 @@
+"""
+批量进度显示模块
+统计完成/失败/跳过数量、吞吐量、预计剩余时间、进行中的请求数和各阶段耗时分布，
+按固定间隔刷新（与处理事件的频率无关）；输出不是终端时改为定期打印一行摘要
+"""
+
+import sys
+import threading
+import time
+from typing import Callable, Optional
+
+from .config import PROGRESS_REFRESH_SECONDS, PROGRESS_LOG_SECONDS, PROGRESS_STAGES
+from .latency import LatencyTracker
+from .tracing import tracer
+
+
+def format_duration(seconds: Optional[float]) -> str:
+    """
+    格式化时长
+    
+    Args:
+        seconds: 秒数，None表示未知
+    
+    Returns:
+        如 "42s"、"3m05s"、"1h02m"
+    """
+    if seconds is None:
+        return '--'
+    seconds = int(seconds)
+    if seconds < 60:
+        return f"{seconds}s"
+    if seconds < 3600:
+        return f"{seconds // 60}m{seconds % 60:02d}s"
+    return f"{seconds // 3600}h{seconds % 3600 // 60:02d}m"
+
+
+def _format_ms(seconds: Optional[float]) -> str:
+    return '-' if seconds is None else f"{seconds * 1000:.0f}"
+
+
+class BatchProgress:
+    """
+    批量处理进度（线程安全，计数在处理线程中更新，显示由刷新线程负责）
+    
+    total 为None时（流式处理）不显示预计剩余时间；in_flight 为返回进行中API请求数的函数；
+    各阶段耗时通过span结束回调统计，无需启用追踪
+    """
+    
+    def __init__(self,
+                 total: int = None,
+                 in_flight: Callable[[], int] = None,
+                 stages=PROGRESS_STAGES,
+                 stream=None,
+                 interval: float = None):
+        self.total = total
+        self.in_flight = in_flight
+        self.stream = stream or sys.stdout
+        self.is_tty = hasattr(self.stream, 'isatty') and self.stream.isatty()
+        if interval is None:
+            interval = PROGRESS_REFRESH_SECONDS if self.is_tty else PROGRESS_LOG_SECONDS
+        self.interval = interval
+        
+        self.counts = {'completed': 0, 'failed': 0, 'skipped': 0, 'deferred': 0}
+        self.stages = {name: LatencyTracker(min_samples=1) for name in stages}
+        
+        self._lock = threading.Lock()
+        self._output_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._drawn_lines = 0
+        self._started = None
+    
+    def _on_span(self, name: str, seconds: float):
+        """span结束回调：记录关注阶段的耗时"""
+        tracker = self.stages.get(name)
+        if tracker is not None:
+            tracker.record(seconds)
+    
+    def start(self):
+        """开始统计各阶段耗时并启动刷新线程"""
+        self._started = time.perf_counter()
+        tracer.add_listener(self._on_span)
+        self._thread = threading.Thread(target=self._refresh_loop, name='progress', daemon=True)
+        self._thread.start()
+    
+    def stop(self):
+        """停止刷新并输出最终状态"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        tracer.remove_listener(self._on_span)
+        self.render()
+        if self.is_tty:
+            # 保留最终进度，后续输出从下一行开始
+            with self._output_lock:
+                self.stream.write('\n')
+                self._drawn_lines = 0
+    
+    def __enter__(self):
+        self.start()
+        return self
+    
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+    
+    def add(self, outcome: str, count: int = 1):
+        """
+        记录处理结果
+        
+        Args:
+            outcome: completed / failed / skipped / deferred
+            count: 数量
+        """
+        with self._lock:
+            self.counts[outcome] += count
+    
+    def _refresh_loop(self):
+        while not self._stop.wait(self.interval):
+            self.render()
+    
+    def snapshot(self) -> dict:
+        """
+        获取当前进度
+        
+        Returns:
+            各结果数量、吞吐量（张/秒）、预计剩余秒数、进行中的请求数和各阶段p50/p95
+        """
+        with self._lock:
+            counts = dict(self.counts)
+        
+        elapsed = time.perf_counter() - self._started if self._started else 0.0
+        done = counts['completed'] + counts['failed']
+        rate = done / elapsed if elapsed > 0 else 0.0
+        
+        eta = None
+        if self.total is not None and rate > 0:
+            remaining = self.total - done - counts['skipped'] - counts['deferred']
+            eta = max(0, remaining) / rate
+        
+        return {
+            **counts,
+            'total': self.total,
+            'elapsed': elapsed,
+            'rate': rate,
+            'eta': eta,
+            'in_flight': self.in_flight() if self.in_flight else None,
+            'stages': {
+                name: {'p50': tracker.percentile(50), 'p95': tracker.percentile(95)}
+                for name, tracker in self.stages.items()
+            }
+        }
+    
+    def format_lines(self, state: dict = None) -> list:
+        """
+        生成进度文本
+        
+        Args:
+            state: snapshot() 的结果，None时重新获取
+        
+        Returns:
+            第一行为数量/吞吐量/剩余时间，第二行为各阶段 p50/p95（毫秒）
+        """
+        state = state or self.snapshot()
+        done = state['completed'] + state['failed'] + state['skipped'] + state['deferred']
+        total = f"/{state['total']}" if state['total'] is not None else ''
+        
+        summary = (
+            f"⏳ {done}{total} | ✅ {state['completed']} ❌ {state['failed']} ⏭️ {state['skipped']}"
+            + (f" ⏸️ {state['deferred']}" if state['deferred'] else '')
+            + f" | {state['rate']:.2f} 张/秒 | 已用 {format_duration(state['elapsed'])}"
+            + (f" 剩余 {format_duration(state['eta'])}" if state['total'] is not None else '')
+            + (f" | 请求中 {state['in_flight']}" if state['in_flight'] is not None else '')
+        )
+        stages = '   p50/p95 ms: ' + '  '.join(
+            f"{name} {_format_ms(s['p50'])}/{_format_ms(s['p95'])}"
+            for name, s in state['stages'].items()
+        )
+        return [summary, stages]
+    
+    def render(self):
+        """输出当前进度（终端中原地刷新，否则打印一行摘要）"""
+        lines = self.format_lines()
+        with self._output_lock:
+            if self.is_tty:
+                # 回到上次绘制的起始行并清除后重绘
+                prefix = '\x1b[1A' * max(0, self._drawn_lines - 1)
+                self.stream.write(prefix + '\r' + '\n'.join('\x1b[2K' + line for line in lines))
+                self._drawn_lines = len(lines)
+            else:
+                self.stream.write(lines[0] + ' | ' + lines[1].strip() + '\n')
+            self.stream.flush()
+    
+    def print(self, message: str):
+        """
+        输出一条消息（终端中先清除进度区域，下次刷新时重绘）
+        
+        Args:
+            message: 消息文本
+        """
+        with self._output_lock:
+            if self.is_tty and self._drawn_lines:
+                prefix = '\x1b[1A' * (self._drawn_lines - 1)
+                self.stream.write(prefix + '\r\x1b[J')
+                self._drawn_lines = 0
+            self.stream.write(message + '\n')
+            self.stream.flush()
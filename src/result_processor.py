@@ -6,26 +6,73 @@
 import json
 import logging
 from datetime import datetime
-from pathlib import Path
-from typing import Dict, List, Any
+from pathlib import Path, PurePath
+from typing import Dict, List, Any, Optional, Tuple
 import re
+import threading
+from concurrent.futures import Future
 
-from .config import RESULTS_DIR, TEMPLATES_DIR
+from .config import RESULTS_DIR, TEMPLATES_DIR, FORMULA_INDEX_ENABLED, RESULT_JSON_COMPACT, ensure_dir
+from .result_writer import all_written
+from .tracing import tracer
 
 logger = logging.getLogger(__name__)
 
 
+def result_basename(name: str) -> str:
+    """
+    由输入的相对路径生成结果文件的基础文件名（不含 _result.json）
+    
+    子目录之间用 "__" 连接（如 2024/sub/q0.png -> 2024__sub__q0），不同子目录中的同名输入
+    不会写到同一个结果文件；不含目录的输入与原来一样只用文件名
+    
+    Args:
+        name: 输入相对于输入根目录的路径
+    
+    Returns:
+        基础文件名
+    """
+    relative = PurePath(name)
+    parts = [part for part in relative.parent.parts if part not in ('.', '..', relative.anchor)]
+    return '__'.join(parts + [relative.stem])
+
+
 class ResultProcessor:
     """结果处理器"""
     
-    def __init__(self):
+    def __init__(self,
+                 index_formulas: bool = FORMULA_INDEX_ENABLED,
+                 json_compact: bool = RESULT_JSON_COMPACT,
+                 writer=None):
         self.results_dir = RESULTS_DIR
         self.templates_dir = TEMPLATES_DIR
+        self.index_formulas = index_formulas
+        self.json_compact = json_compact
+        self._formula_index = None
+        self._writer = writer
+        self._template = None
+    
+    @property
+    def writer(self):
+        """结果写入器（默认使用全局后台写入器）"""
+        if self._writer is None:
+            from .result_writer import get_result_writer
+            self._writer = get_result_writer()
+        return self._writer
+    
+    @property
+    def formula_index(self):
+        """公式检索索引（首次使用时打开）"""
+        if self._formula_index is None:
+            from .formula_index import FormulaIndex
+            self._formula_index = FormulaIndex()
+        return self._formula_index
         
     def create_result_data(self, 
                           image_info: dict, 
                           ocr_result: dict, 
-                          process_info: dict = None) -> dict:
+                          process_info: dict = None,
+                          metadata: dict = None) -> dict:
         """
         创建完整的结果数据结构
         
@@ -33,6 +80,7 @@ class ResultProcessor:
             image_info: 图像信息
             ocr_result: OCR结果
             process_info: 处理信息
+            metadata: 附加元数据（如源文件哈希、流水线指纹）
             
         Returns:
             完整的结果数据
@@ -41,7 +89,8 @@ class ResultProcessor:
             'metadata': {
                 'version': '1.0',
                 'created_time': datetime.now().isoformat(),
-                'processor': 'OCR2LATEX'
+                'processor': 'OCR2LATEX',
+                **(metadata if metadata else {})
             },
             'image_info': {
                 'filename': image_info.get('filename', ''),
@@ -59,22 +108,26 @@ class ResultProcessor:
                 'usage_count': ocr_result.get('usage_count', 0),
                 'error': ocr_result.get('error', None)
             },
-            'regions': self._process_regions(ocr_result.get('regions', [])),
+            'regions': self._process_regions(ocr_result.get('regions', []), process_info),
             'analysis': self._analyze_content(ocr_result)
         }
         
         return result_data
     
-    def _process_regions(self, regions: List[dict]) -> List[dict]:
+    def _process_regions(self, regions: List[dict], process_info: dict = None) -> List[dict]:
         """
         处理区域信息
         
         Args:
             regions: 原始区域列表
+            process_info: 预处理信息（图像经过裁剪、缩放或旋转时，附加原图坐标 bbox_original）
             
         Returns:
             处理后的区域列表
         """
+        from .image_processor import map_bbox_to_original
+        
+        transformed = bool(process_info and process_info.get('geometry'))
         processed_regions = []
         
         for i, region in enumerate(regions):
@@ -87,6 +140,10 @@ class ResultProcessor:
                 'bbox': region.get('bbox', {}),
                 'analysis': self._analyze_region(region)
             }
+            if transformed and processed_region['bbox']:
+                bbox_original = map_bbox_to_original(processed_region['bbox'], process_info)
+                if bbox_original is not None:
+                    processed_region['bbox_original'] = bbox_original
             processed_regions.append(processed_region)
         
         return processed_regions
@@ -204,34 +261,44 @@ class ResultProcessor:
         
         return analysis
     
-    def save_json_result(self, result_data: dict, filename: str) -> str:
+    def encode_json(self, result_data: dict) -> str:
         """
-        保存JSON结果文件
+        编码结果数据（json_compact 为True时不缩进、不加空格）
+        
+        Args:
+            result_data: 结果数据
+        
+        Returns:
+            JSON字符串
+        """
+        if self.json_compact:
+            return json.dumps(result_data, ensure_ascii=False, separators=(',', ':'))
+        return json.dumps(result_data, ensure_ascii=False, indent=2)
+    
+    def save_json_result(self, result_data: dict, filename: str) -> Tuple[str, Optional[Future]]:
+        """
+        保存JSON结果文件（交给结果写入器，编码和写入在后台完成，result_data 提交后不应再修改）
         
         Args:
             result_data: 结果数据
             filename: 文件名（不含扩展名）
             
         Returns:
-            保存的文件路径
+            (文件路径, 写入完成的Future)，提交失败时为 ("", None)
         """
         try:
             # 生成文件路径
             json_filename = f"{filename}_result.json"
-            json_path = self.results_dir / json_filename
+            json_path = ensure_dir(self.results_dir) / json_filename
             
-            # 保存JSON文件
-            with open(json_path, 'w', encoding='utf-8') as f:
-                json.dump(result_data, f, ensure_ascii=False, indent=2)
-            
-            logger.info(f"JSON结果已保存: {json_path}")
-            return str(json_path)
+            written = self.writer.submit(json_path, lambda: self.encode_json(result_data), span='write.json')
+            return str(json_path), written
             
         except Exception as e:
             logger.error(f"保存JSON结果失败: {e}")
-            return ""
+            return "", None
     
-    def generate_html_result(self, result_data: dict, filename: str) -> str:
+    def generate_html_result(self, result_data: dict, filename: str) -> Tuple[str, Optional[Future]]:
         """
         生成HTML结果文件
         
@@ -240,37 +307,39 @@ class ResultProcessor:
             filename: 文件名（不含扩展名）
             
         Returns:
-            保存的HTML文件路径
+            (HTML文件路径, 写入完成的Future)，提交失败时为 ("", None)
         """
         try:
-            # 读取HTML模板
-            template_path = self.templates_dir / "result_viewer.html"
+            template = self._load_template()
             
-            if not template_path.exists():
-                # 如果模板不存在，创建一个简单的模板
-                self._create_html_template()
-            
-            with open(template_path, 'r', encoding='utf-8') as f:
-                template = f.read()
-            
-            # 替换模板中的占位符
-            html_content = template.replace('{{RESULT_DATA}}', json.dumps(result_data, ensure_ascii=False, indent=2))
-            html_content = html_content.replace('{{FILENAME}}', result_data['image_info']['filename'])
+            def render() -> str:
+                # 替换模板中的占位符
+                html_content = template.replace('{{RESULT_DATA}}', self.encode_json(result_data))
+                return html_content.replace('{{FILENAME}}', result_data['image_info']['filename'])
             
             # 生成HTML文件路径
             html_filename = f"{filename}_result.html"
-            html_path = self.results_dir / html_filename
+            html_path = ensure_dir(self.results_dir) / html_filename
             
-            # 保存HTML文件
-            with open(html_path, 'w', encoding='utf-8') as f:
-                f.write(html_content)
-            
-            logger.info(f"HTML结果已保存: {html_path}")
-            return str(html_path)
+            written = self.writer.submit(html_path, render, span='write.html')
+            return str(html_path), written
             
         except Exception as e:
             logger.error(f"生成HTML结果失败: {e}")
-            return ""
+            return "", None
+    
+    def _load_template(self) -> str:
+        """读取HTML模板（只读取一次）"""
+        if self._template is None:
+            template_path = self.templates_dir / "result_viewer.html"
+            
+            if not template_path.exists():
+                # 如果模板不存在，创建一个简单的模板
+                self._create_html_template()
+            
+            with open(template_path, 'r', encoding='utf-8') as f:
+                self._template = f.read()
+        return self._template
     
     def _create_html_template(self):
         """创建HTML模板文件"""
@@ -569,17 +638,28 @@ class ResultProcessor:
 </body>
 </html>'''
         
-        template_path = self.templates_dir / "result_viewer.html"
+        template_path = ensure_dir(self.templates_dir) / "result_viewer.html"
         with open(template_path, 'w', encoding='utf-8') as f:
             f.write(template_content)
         
         logger.info(f"HTML模板已创建: {template_path}")
     
+    def _index_result(self, result_data: dict, json_path: str, written):
+        """结果文件写入成功后增量更新公式索引（在写入线程中执行，索引失败不影响结果保存）"""
+        if not written.result():
+            return
+        try:
+            with tracer.span('index.formulas'):
+                self.formula_index.add_result(result_data, json_path)
+        except Exception as e:
+            logger.warning(f"更新公式索引失败: {e}")
+    
     def process_and_save_results(self, 
                                image_info: dict, 
                                ocr_result: dict, 
                                process_info: dict = None,
-                               base_filename: str = None) -> dict:
+                               base_filename: str = None,
+                               metadata: dict = None) -> dict:
         """
         处理并保存所有结果
         
@@ -588,6 +668,7 @@ class ResultProcessor:
             ocr_result: OCR结果
             process_info: 处理信息
             base_filename: 基础文件名
+            metadata: 附加元数据
             
         Returns:
             保存结果信息
@@ -599,19 +680,25 @@ class ResultProcessor:
                 base_filename = Path(filename).stem
             
             # 创建结果数据
-            result_data = self.create_result_data(image_info, ocr_result, process_info)
+            result_data = self.create_result_data(image_info, ocr_result, process_info, metadata)
             
-            # 保存JSON文件
-            json_path = self.save_json_result(result_data, base_filename)
+            # 保存JSON文件和HTML文件（后台写入，write.json / write.html span在写入线程中记录）
+            json_path, json_written = self.save_json_result(result_data, base_filename)
+            html_path, html_written = self.generate_html_result(result_data, base_filename)
+            if json_written is None or html_written is None:
+                raise RuntimeError("提交结果文件写入失败")
             
-            # 生成HTML文件
-            html_path = self.generate_html_result(result_data, base_filename)
+            # written: 两个文件都写入后完成（结果为是否成功），依赖结果文件的操作应在其完成回调中进行
+            written = all_written([json_written, html_written])
+            if self.index_formulas:
+                written.add_done_callback(lambda future: self._index_result(result_data, json_path, future))
             
             return {
                 'success': True,
                 'json_path': json_path,
                 'html_path': html_path,
-                'result_data': result_data
+                'result_data': result_data,
+                'written': written
             }
             
         except Exception as e:
@@ -625,5 +712,28 @@ class ResultProcessor:
             }
 
 
-# 创建全局实例
-result_processor = ResultProcessor()
+# 全局实例（首次访问时创建）
+_result_processor: Optional[ResultProcessor] = None
+_instance_lock = threading.Lock()
+
+
+def get_result_processor() -> ResultProcessor:
+    """
+    获取全局结果处理器实例
+    
+    Returns:
+        结果处理器实例
+    """
+    global _result_processor
+    if _result_processor is None:
+        with _instance_lock:
+            if _result_processor is None:
+                _result_processor = ResultProcessor()
+    return _result_processor
+
+
+def __getattr__(name: str):
+    # 兼容 `from src.result_processor import result_processor` 的写法
+    if name == 'result_processor':
+        return get_result_processor()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,374 @@
+"""
+结果写入模块
+处理线程只负责把待写入的结果放入有界队列，编码和写文件在后台写入线程中完成；
+每个文件先写入同目录下的临时文件再原子重命名，进程中途崩溃时不会留下写了一半的结果文件
+"""
+
+import atexit
+import contextvars
+import logging
+import os
+import queue
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import Future
+from pathlib import Path
+from typing import Callable, Iterable, Optional, Union
+
+from .config import RESULT_WRITER_ASYNC, RESULT_WRITER_QUEUE_SIZE, RESULT_FSYNC_BATCH
+from .metrics import metrics
+from .tracing import tracer
+
+logger = logging.getLogger(__name__)
+
+# 写入线程结束标记
+_CLOSE = object()
+
+# 未开启fsync时每批最多取出的文件数
+_BATCH_LIMIT = 16
+
+# mkstemp创建的临时文件权限为0600，重命名前改为与open()新建文件相同的权限
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+_FILE_MODE = 0o666 & ~_UMASK
+
+
+def _load_syncfs() -> Optional[Callable[[int], int]]:
+    """
+    加载Linux的syncfs(2)：一次调用把所在文件系统的全部脏数据落盘
+    
+    Returns:
+        syncfs函数，其他平台或libc不支持时返回None
+    """
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        import ctypes
+        import ctypes.util
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        return libc.syncfs
+    except (OSError, AttributeError):
+        return None
+
+
+def _sync_dir(directory: Path, syncfs=None) -> bool:
+    """
+    同步目录：有syncfs时同步整个文件系统（包括其中的文件数据），否则只fsync目录本身
+    
+    Args:
+        directory: 目录
+        syncfs: _load_syncfs 的返回值
+    
+    Returns:
+        是否执行了同步（不支持打开目录的平台上返回False）
+    """
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return False
+    try:
+        if syncfs is not None:
+            return syncfs(fd) == 0
+        os.fsync(fd)
+        return True
+    except OSError:
+        return False
+    finally:
+        os.close(fd)
+
+
+def all_written(futures: Iterable[Future]) -> Future:
+    """
+    合并多个文件的写入结果
+    
+    Args:
+        futures: submit 返回的Future
+    
+    Returns:
+        全部文件写入完成后完成的Future，全部成功时结果为True
+    """
+    futures = list(futures)
+    combined = Future()
+    if not futures:
+        combined.set_result(True)
+        return combined
+    
+    lock = threading.Lock()
+    remaining = [len(futures)]
+    
+    def on_done(_):
+        with lock:
+            remaining[0] -= 1
+            if remaining[0]:
+                return
+        combined.set_result(all(future.result() for future in futures))
+    
+    for future in futures:
+        future.add_done_callback(on_done)
+    return combined
+
+
+class _WriteItem:
+    """待写入的文件：内容为字符串或在写入线程中调用的生成函数"""
+    
+    __slots__ = ('path', 'content', 'span', 'context', 'done')
+    
+    def __init__(self, path: Path, content, span: Optional[str]):
+        self.path = path
+        self.content = content
+        self.span = span
+        # 保留提交时的上下文，写入线程中的日志和span仍归属原任务
+        self.context = contextvars.copy_context()
+        # 文件重命名到目标路径（开启fsync时为落盘）后完成，结果为是否写入成功
+        self.done = Future()
+
+
+class ResultWriter:
+    """
+    后台结果写入器（线程安全）
+    
+    队列满时 submit 阻塞等待，处理速度不会超过磁盘写入速度太多；
+    fsync_batch 控制持久性与吞吐量的取舍：0（默认）不调用fsync，重命名保证进程崩溃时不留下残缺文件，
+    但断电时可能丢失最近的结果；N 表示每批最多取出N个文件成组落盘：Linux上整批临时文件写完后
+    对所在文件系统调用一次syncfs，重命名后再调用一次，每批两次同步与批大小无关；
+    其他平台退回为逐个fsync临时文件，重命名后fsync一次目录
+    """
+    
+    def __init__(self,
+                 queue_size: int = RESULT_WRITER_QUEUE_SIZE,
+                 fsync_batch: int = RESULT_FSYNC_BATCH,
+                 background: bool = RESULT_WRITER_ASYNC):
+        self.fsync_batch = fsync_batch
+        self.background = background
+        self._syncfs = _load_syncfs() if fsync_batch else None
+        self._queue = queue.Queue(queue_size)
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._closed = False
+        
+        self.written = 0
+        self.failed = 0
+        self.bytes_written = 0
+        self.batches = 0
+        self.fsyncs = 0
+        self.max_queue_depth = 0
+        self.blocked_seconds = 0.0  # 队列已满、处理线程等待放入的累计时间
+    
+    def submit(self, path, content: Union[str, Callable[[], str]], span: str = None) -> Future:
+        """
+        提交一个待写入的文件（后台模式下立即返回，写入失败记录在日志和统计中）
+        
+        Args:
+            path: 目标文件路径（所在目录需已存在）
+            content: 文件内容，或在写入线程中生成内容的函数（编码开销不占用处理线程）
+            span: 写入时记录的span名称
+        
+        Returns:
+            写入完成后完成的Future，结果为是否写入成功（完成回调在写入线程中执行）
+        """
+        item = _WriteItem(Path(path), content, span)
+        if not self.background or self._closed:
+            self._commit([item])
+            return item.done
+        
+        self._ensure_thread()
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            started = time.perf_counter()
+            self._queue.put(item)
+            waited = time.perf_counter() - started
+            with self._lock:
+                self.blocked_seconds += waited
+        
+        depth = self._queue.qsize()
+        metrics.set_gauge('result_writer.queue', depth)
+        if depth > self.max_queue_depth:
+            self.max_queue_depth = depth
+        return item.done
+    
+    def _ensure_thread(self):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name='result-writer', daemon=True)
+                    self._thread.start()
+    
+    def _run(self):
+        limit = self.fsync_batch or _BATCH_LIMIT
+        closing = False
+        while not closing:
+            item = self._queue.get()
+            if item is _CLOSE:
+                self._queue.task_done()
+                break
+            
+            # 取出队列中已有的文件组成一批（不等待后续文件）
+            batch = [item]
+            while len(batch) < limit:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _CLOSE:
+                    closing = True
+                    self._queue.task_done()
+                    break
+                batch.append(item)
+            
+            try:
+                self._commit(batch)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+                metrics.set_gauge('result_writer.queue', self._queue.qsize())
+    
+    def _stage(self, item: _WriteItem) -> Optional[str]:
+        """
+        生成内容并写入临时文件
+        
+        Returns:
+            临时文件路径，失败时返回None
+        """
+        tmp_path = None
+        try:
+            with tracer.span(item.span or 'write.file', path=str(item.path)):
+                content = item.content() if callable(item.content) else item.content
+                data = content.encode('utf-8')
+                
+                fd, tmp_path = tempfile.mkstemp(dir=item.path.parent, prefix=f".{item.path.name}.", suffix='.tmp')
+                os.chmod(tmp_path, _FILE_MODE)
+                per_file_fsync = self.fsync_batch and self._syncfs is None
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(data)
+                    if per_file_fsync:
+                        f.flush()
+                        os.fsync(f.fileno())
+            
+            with self._lock:
+                self.bytes_written += len(data)
+                if per_file_fsync:
+                    self.fsyncs += 1
+            return tmp_path
+        
+        except Exception as e:
+            logger.error(f"写入结果文件失败: {item.path}: {e}")
+            if tmp_path is not None:
+                try:
+                    os.unlink(tmp_path)
+                except OSError:
+                    pass
+            with self._lock:
+                self.failed += 1
+            return None
+    
+    def _commit(self, batch: list):
+        """写入一批文件：全部写入临时文件并落盘后依次重命名，再同步涉及的目录"""
+        staged = []
+        for item in batch:
+            tmp_path = item.context.run(self._stage, item)
+            if tmp_path is not None:
+                staged.append((tmp_path, item))
+        
+        if self.fsync_batch and self._syncfs is not None:
+            # 整批临时文件的数据一次落盘，之后的重命名不会指向未落盘的内容
+            for directory in {item.path.parent for _, item in staged}:
+                self._sync(directory)
+        
+        directories = set()
+        renamed = set()
+        for tmp_path, item in staged:
+            try:
+                os.replace(tmp_path, item.path)
+                directories.add(item.path.parent)
+                renamed.add(id(item))
+                with self._lock:
+                    self.written += 1
+                item.context.run(logger.info, f"结果已保存: {item.path}")
+            except OSError as e:
+                logger.error(f"重命名结果文件失败: {item.path}: {e}")
+                try:
+                    os.unlink(tmp_path)
+                except OSError:
+                    pass
+                with self._lock:
+                    self.failed += 1
+        
+        if self.fsync_batch:
+            for directory in directories:
+                self._sync(directory)
+        with self._lock:
+            self.batches += 1
+        
+        for item in batch:
+            item.done.set_result(id(item) in renamed)
+    
+    def _sync(self, directory: Path):
+        if _sync_dir(directory, self._syncfs):
+            with self._lock:
+                self.fsyncs += 1
+    
+    def flush(self):
+        """等待已提交的文件全部写入"""
+        if self._thread is not None:
+            self._queue.join()
+    
+    def close(self):
+        """写入剩余文件并停止写入线程（之后提交的文件在调用线程中同步写入）"""
+        self._closed = True
+        if self._thread is not None:
+            self._queue.put(_CLOSE)
+            self._thread.join()
+            self._thread = None
+        
+        # 关闭期间其他线程放入的文件
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not _CLOSE:
+                self._commit([item])
+            self._queue.task_done()
+    
+    def get_stats(self) -> dict:
+        """
+        获取写入统计
+        
+        Returns:
+            已写入/失败文件数、字节数、批次数、fsync次数、最大队列深度和处理线程等待时间
+        """
+        with self._lock:
+            return {
+                'written': self.written,
+                'failed': self.failed,
+                'bytes': self.bytes_written,
+                'batches': self.batches,
+                'fsyncs': self.fsyncs,
+                'queue_depth': self._queue.qsize(),
+                'max_queue_depth': self.max_queue_depth,
+                'blocked_seconds': round(self.blocked_seconds, 3)
+            }
+
+
+# 全局实例（首次访问时创建）
+_result_writer: Optional[ResultWriter] = None
+_instance_lock = threading.Lock()
+
+
+def get_result_writer() -> ResultWriter:
+    """
+    获取全局结果写入器实例（进程退出前写入队列中剩余的结果）
+    
+    Returns:
+        结果写入器实例
+    """
+    global _result_writer
+    if _result_writer is None:
+        with _instance_lock:
+            if _result_writer is None:
+                _result_writer = ResultWriter()
+                atexit.register(_result_writer.close)
+    return _result_writer
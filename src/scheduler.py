@@ -0,0 +1,247 @@
+"""
+任务调度模块
+按优先级类别调度图像处理任务：每个类别有独立的并发上限，
+剩余API额度低于类别保留值时推迟该类任务，保证批量回填不会挤占交互请求
+"""
+
+import contextvars
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from typing import Callable, Dict, Optional
+
+from .config import SCHEDULER_CLASSES, SCHEDULER_RECHECK_SECONDS
+from .latency import LatencyTracker
+from .metrics import metrics
+from .usage_ledger import UsageLedger, get_usage_ledger
+
+logger = logging.getLogger(__name__)
+
+
+class _Job:
+    """等待调度的任务"""
+    
+    __slots__ = ('priority', 'cost', 'fn', 'args', 'kwargs', 'context', 'future', 'submitted')
+    
+    def __init__(self, priority: str, cost: int, fn: Callable, args: tuple, kwargs: dict):
+        self.priority = priority
+        self.cost = cost
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.context = contextvars.copy_context()
+        self.future = Future()
+        self.submitted = time.perf_counter()
+
+
+class JobScheduler:
+    """优先级 + 额度感知的任务调度器（线程安全）"""
+    
+    def __init__(self,
+                 classes: Dict[str, dict] = None,
+                 ledger: UsageLedger = None,
+                 recheck_seconds: float = SCHEDULER_RECHECK_SECONDS,
+                 concurrency: Dict[str, int] = None):
+        # concurrency 覆盖指定类别的并发上限（如命令行 --workers）
+        self.classes = {name: dict(spec) for name, spec in (classes or SCHEDULER_CLASSES).items()}
+        for name, limit in (concurrency or {}).items():
+            if name not in self.classes:
+                raise ValueError(f"未知的优先级类别: {name}")
+            self.classes[name]['concurrency'] = max(1, limit)
+        self.ledger = ledger or get_usage_ledger()
+        self.recheck_seconds = recheck_seconds
+        
+        self._cond = threading.Condition()
+        # 每个类别一个先进先出队列，调度时按rank从小到大依次检查
+        self._order = sorted(self.classes, key=lambda name: self.classes[name]['rank'])
+        self._pending = {name: deque() for name in self.classes}
+        self._running = {name: 0 for name in self.classes}
+        self._reserved = 0  # 已派发但尚未完成的任务预计消耗的额度
+        self._closing = False
+        self._deferred = {name: 0 for name in self.classes}
+        
+        # 各类别的排队等待时间分布
+        self.queue_wait = {name: LatencyTracker(min_samples=1) for name in self.classes}
+        
+        # worker总数等于各类别并发上限之和，低优先级任务占满自己的份额后，
+        # 仍有空闲worker留给高优先级任务
+        workers = sum(spec['concurrency'] for spec in self.classes.values())
+        self._threads = [
+            threading.Thread(target=self._worker, name=f'scheduler-{i}', daemon=True)
+            for i in range(workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+    
+    def submit(self, fn: Callable, *args, priority: str = 'normal', cost: int = 1, **kwargs) -> Future:
+        """
+        提交任务
+        
+        Args:
+            fn: 任务函数（返回结果字典）
+            *args: 位置参数
+            priority: 优先级类别（见SCHEDULER_CLASSES）
+            cost: 预计消耗的API调用次数
+            **kwargs: 关键字参数
+        
+        Returns:
+            Future对象；因额度不足最终未执行的任务返回 deferred 结果
+        """
+        if priority not in self.classes:
+            raise ValueError(f"未知的优先级类别: {priority}")
+        
+        with self._cond:
+            if self._closing:
+                raise RuntimeError("调度器已关闭")
+            job = _Job(priority, cost, fn, args, kwargs)
+            self._pending[priority].append(job)
+            self._update_gauges()
+            self._cond.notify()
+        return job.future
+    
+    def _budget_allows(self, job: _Job, remaining: Optional[int]) -> bool:
+        """剩余额度扣除进行中的任务后，是否仍高于该类别的保留值"""
+        if remaining is None:
+            return True
+        reserve = self.classes[job.priority]['reserve']
+        return remaining - self._reserved - job.cost >= reserve
+    
+    def _next_job(self) -> Optional[_Job]:
+        """
+        取出下一个可运行的任务（按优先级，跳过并发已满或额度不足的类别）
+        
+        Returns:
+            任务，调度器关闭且没有可运行任务时返回None
+        """
+        with self._cond:
+            while True:
+                has_pending = any(self._pending.values())
+                remaining = self.ledger.remaining() if has_pending else None
+                for name in self._order:
+                    queue = self._pending[name]
+                    if not queue or self._running[name] >= self.classes[name]['concurrency']:
+                        continue
+                    if not self._budget_allows(queue[0], remaining):
+                        continue
+                    
+                    job = queue.popleft()
+                    self._running[name] += 1
+                    self._reserved += job.cost
+                    self._update_gauges()
+                    return job
+                
+                if self._closing and not any(self._running.values()):
+                    # 没有进行中的任务，剩余任务不会再因额度释放而变得可运行
+                    self._defer_pending(remaining)
+                    return None
+                
+                self._cond.wait(timeout=self.recheck_seconds if has_pending else None)
+    
+    def _defer_pending(self, remaining: Optional[int]):
+        """将因额度不足无法运行的任务标记为推迟（调用方持有锁）"""
+        deferred = 0
+        for name, queue in self._pending.items():
+            reserve = self.classes[name]['reserve']
+            while queue:
+                job = queue.popleft()
+                if not job.future.set_running_or_notify_cancel():
+                    continue
+                job.future.set_result({
+                    'success': False,
+                    'deferred': True,
+                    'error': f"API剩余额度 ({remaining}) 低于 {name} 类任务的保留值 ({reserve})，任务已推迟",
+                    'error_info': {'id': 'budget_deferred', 'remaining': remaining, 'reserve': reserve}
+                })
+                self._deferred[name] += 1
+                deferred += 1
+        
+        if deferred:
+            logger.warning(f"{deferred} 个任务因额度不足被推迟")
+            metrics.increment('scheduler.deferred', deferred)
+        self._update_gauges()
+        self._cond.notify_all()
+    
+    def _worker(self):
+        """worker线程：循环取任务执行"""
+        while True:
+            job = self._next_job()
+            if job is None:
+                return
+            
+            self.queue_wait[job.priority].record(time.perf_counter() - job.submitted)
+            try:
+                if job.future.set_running_or_notify_cancel():
+                    job.future.set_result(job.context.run(job.fn, *job.args, **job.kwargs))
+            except BaseException as e:
+                job.future.set_exception(e)
+            finally:
+                with self._cond:
+                    self._running[job.priority] -= 1
+                    self._reserved -= job.cost
+                    self._update_gauges()
+                    self._cond.notify_all()
+    
+    def _update_gauges(self):
+        """上报各类别排队和运行中的任务数（调用方持有锁）"""
+        for name in self.classes:
+            metrics.set_gauge(f'scheduler.pending.{name}', len(self._pending[name]))
+            metrics.set_gauge(f'scheduler.running.{name}', self._running[name])
+    
+    def cancel_pending(self) -> int:
+        """
+        取消所有尚未开始的任务（如账号全部失效后停止提交），进行中的任务照常完成
+        
+        Returns:
+            取消的任务数
+        """
+        cancelled = 0
+        with self._cond:
+            for queue in self._pending.values():
+                while queue:
+                    future = queue.popleft().future
+                    if future.cancel():
+                        # 与执行器取消任务的方式相同，通知 as_completed/wait 的等待者
+                        future.set_running_or_notify_cancel()
+                        cancelled += 1
+            self._update_gauges()
+            self._cond.notify_all()
+        if cancelled:
+            metrics.increment('scheduler.cancelled', cancelled)
+        return cancelled
+    
+    def close(self, wait: bool = True):
+        """
+        停止接收新任务；已提交的任务照常执行，额度不足的任务标记为推迟
+        
+        Args:
+            wait: 是否等待所有worker退出
+        """
+        with self._cond:
+            self._closing = True
+            self._cond.notify_all()
+        if wait:
+            for thread in self._threads:
+                thread.join()
+    
+    def stats(self) -> dict:
+        """
+        获取调度器状态
+        
+        Returns:
+            各类别排队/运行/推迟数量和剩余额度
+        """
+        with self._cond:
+            classes = {
+                name: {
+                    'pending': len(self._pending[name]),
+                    'running': self._running[name],
+                    'deferred': self._deferred[name],
+                    'queue_wait': self.queue_wait[name].snapshot(),
+                    **spec
+                }
+                for name, spec in self.classes.items()
+            }
+            reserved = self._reserved
+        return {'classes': classes, 'reserved': reserved, 'remaining': self.ledger.remaining()}
@@ -0,0 +1,521 @@
+"""
+流式处理模块
+从任意图像来源（目录、本地对象存储镜像、tar包、标准输入的路径列表）按需读取输入，
+经 解码/预处理 → OCR识别 → 写入结果 三个阶段处理。阶段之间为有界队列，
+下游变慢时上游阻塞等待，内存中的在途图像数量不超过各队列容量之和
+"""
+
+import logging
+import os
+import queue
+import tarfile
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Iterable, Iterator, Optional
+
+from .config import (
+    SUPPORTED_FORMATS,
+    STREAM_DECODE_WORKERS,
+    STREAM_OCR_WORKERS,
+    STREAM_WRITE_WORKERS,
+    STREAM_QUEUE_SIZE
+)
+from .log_context import job_context, new_job_id
+from .metrics import metrics
+from .result_processor import result_basename
+from .tracing import tracer
+
+logger = logging.getLogger(__name__)
+
+# 阶段结束标记
+_DONE = object()
+
+# 等待队列时检查停止信号的间隔（秒）
+_POLL_INTERVAL = 0.1
+
+
+class StreamItem:
+    """流式输入项：磁盘文件（path）或已读入内存的内容（data，如tar包成员），多页文件的一帧（frame）"""
+    
+    __slots__ = ('name', 'path', 'data', 'frame')
+    
+    def __init__(self, name: str, path: str = None, data: bytes = None, frame: int = None):
+        self.name = name
+        self.path = path
+        self.data = data
+        self.frame = frame
+    
+    def __repr__(self):
+        if self.frame is not None:
+            return f"StreamItem({self.name!r}, frame={self.frame})"
+        return f"StreamItem({self.name!r})"
+
+
+def _is_image(name: str) -> bool:
+    return Path(name).suffix.lower() in SUPPORTED_FORMATS
+
+
+def iter_paths(paths: Iterable[str]) -> Iterator[StreamItem]:
+    """
+    将文件路径转换为输入项（跳过不支持的格式）
+    
+    Args:
+        paths: 文件路径
+    
+    Yields:
+        输入项
+    """
+    for path in paths:
+        path = str(path).strip()
+        if path and _is_image(path):
+            yield StreamItem(path, path=path)
+
+
+def iter_directory(root: str, prefix: str = '') -> Iterator[StreamItem]:
+    """
+    递归遍历目录（边遍历边产出，不预先列出全部文件）
+    
+    也用于本地对象存储镜像：root 为桶目录，prefix 为对象键前缀（如 "2024/exam-"）
+    
+    Args:
+        root: 目录路径
+        prefix: 对象键前缀（相对root、以 / 分隔），只产出键以此开头的文件
+    
+    Yields:
+        输入项，按名称排序
+    """
+    root = Path(root)
+    
+    def walk(directory: Path, key_prefix: str) -> Iterator[StreamItem]:
+        try:
+            with os.scandir(directory) as it:
+                entries = sorted(it, key=lambda e: e.name)
+        except OSError as e:
+            logger.warning(f"无法读取目录 {directory}: {e}")
+            return
+        
+        for entry in entries:
+            key = key_prefix + entry.name
+            if entry.is_dir(follow_symlinks=False):
+                # 只进入可能包含匹配键的子目录
+                if prefix.startswith(key + '/') or (key + '/').startswith(prefix):
+                    yield from walk(Path(entry.path), key + '/')
+            elif entry.is_file() and key.startswith(prefix) and _is_image(entry.name):
+                yield StreamItem(key, path=entry.path)
+    
+    yield from walk(root, '')
+
+
+def iter_tar(archive) -> Iterator[StreamItem]:
+    """
+    顺序读取tar包中的图像（流模式，支持gzip/bz2/xz压缩和不可回退的输入流）
+    
+    Args:
+        archive: tar包路径或二进制文件对象
+    
+    Yields:
+        输入项（内容在内存中）
+    """
+    if isinstance(archive, (str, Path)):
+        tar = tarfile.open(archive, mode='r|*')
+    else:
+        tar = tarfile.open(fileobj=archive, mode='r|*')
+    
+    with tar:
+        for member in tar:
+            if not member.isfile() or not _is_image(member.name):
+                continue
+            f = tar.extractfile(member)
+            if f is None:
+                continue
+            yield StreamItem(member.name, data=f.read())
+
+
+def iter_frames(items: Iterable[StreamItem]) -> Iterator[StreamItem]:
+    """
+    将多页文件（多页TIFF）展开为每帧一个输入项（同一文件的各帧共享内存中的内容）
+    
+    Args:
+        items: 输入项
+    
+    Yields:
+        输入项，多页文件按帧序号依次产出
+    """
+    from .image_processor import get_image_processor
+    
+    image_processor = get_image_processor()
+    for item in items:
+        n_frames = image_processor.count_frames(item.path or item.name, data=item.data)
+        if n_frames == 1:
+            yield item
+            continue
+        for frame in range(n_frames):
+            yield StreamItem(item.name, path=item.path, data=item.data, frame=frame)
+
+
+def iter_sources(sources: Iterable[str], stdin=None) -> Iterator[StreamItem]:
+    """
+    按来源类型展开输入（多页TIFF的每一帧作为单独的输入项）
+    
+    支持的来源：
+    - "-"：从标准输入逐行读取文件路径
+    - tar包（.tar/.tar.gz/.tgz 等）
+    - 目录；"目录::前缀" 形式表示只处理键以该前缀开头的对象
+    - 单个图像文件
+    
+    Args:
+        sources: 来源列表
+        stdin: 标准输入（默认sys.stdin）
+    
+    Yields:
+        输入项
+    """
+    yield from iter_frames(_iter_files(sources, stdin))
+
+
+def _iter_files(sources: Iterable[str], stdin=None) -> Iterator[StreamItem]:
+    """逐个来源展开为文件级输入项"""
+    for source in sources:
+        if source == '-':
+            import sys
+            yield from iter_paths(line for line in (stdin or sys.stdin))
+            continue
+        
+        root, _, prefix = source.partition('::')
+        path = Path(root)
+        if path.is_dir():
+            yield from iter_directory(path, prefix)
+        elif path.is_file() and tarfile.is_tarfile(path):
+            yield from iter_tar(path)
+        elif path.is_file() and _is_image(root):
+            yield StreamItem(root, path=root)
+        else:
+            logger.warning(f"跳过无法识别的输入来源: {source}")
+
+
+class _Stage:
+    """处理阶段：从inbox取任务，处理后放入下一阶段的队列"""
+    
+    def __init__(self, name: str, fn: Callable, workers: int, inbox: queue.Queue):
+        self.name = name
+        self.fn = fn
+        self.workers = workers
+        self.inbox = inbox
+        self.busy = 0
+        self.processed = 0
+        self.failed = 0
+        self.max_depth = 0
+        self.blocked_seconds = 0.0  # 下游队列已满、等待放入的累计时间
+        self.alive = workers
+        self.lock = threading.Lock()
+    
+    def snapshot(self) -> dict:
+        with self.lock:
+            return {
+                'workers': self.workers,
+                'busy': self.busy,
+                'queue_depth': self.inbox.qsize(),
+                'queue_capacity': self.inbox.maxsize,
+                'max_queue_depth': self.max_depth,
+                'processed': self.processed,
+                'failed': self.failed,
+                'blocked_seconds': round(self.blocked_seconds, 3)
+            }
+
+
+class StreamingEngine:
+    """
+    有背压的流式处理引擎
+    
+    每个阶段有独立的worker数量，阶段之间的队列有容量上限：
+    OCR变慢时解码阶段在放入OCR队列处阻塞，输入来源也随之暂停读取。
+    结果按完成顺序产出；提前停止迭代时各阶段尽快退出
+    """
+    
+    def __init__(self,
+                 pipeline=None,
+                 decode_workers: int = STREAM_DECODE_WORKERS,
+                 ocr_workers: int = STREAM_OCR_WORKERS,
+                 write_workers: int = STREAM_WRITE_WORKERS,
+                 queue_size: int = STREAM_QUEUE_SIZE):
+        if pipeline is None:
+            from .pipeline import get_pipeline
+            pipeline = get_pipeline()
+        
+        self.pipeline = pipeline
+        self.queue_size = queue_size
+        
+        self.stages = [
+            _Stage('decode', self._decode, decode_workers, queue.Queue(queue_size)),
+            _Stage('ocr', self._ocr, ocr_workers, queue.Queue(queue_size)),
+            _Stage('write', self._write, write_workers, queue.Queue(queue_size)),
+        ]
+        self._output = queue.Queue(queue_size)
+        self._stop = threading.Event()
+        self._threads = []
+        self._started = False
+    
+    def _put(self, target: queue.Queue, item, stage: Optional[_Stage] = None) -> bool:
+        """
+        放入队列，队列已满时阻塞等待（期间响应停止信号）
+        
+        Args:
+            target: 目标队列
+            item: 任务
+            stage: 放入方所在阶段（用于统计阻塞时间）
+        
+        Returns:
+            是否放入成功（引擎停止时返回False）
+        """
+        start = time.perf_counter()
+        while not self._stop.is_set():
+            try:
+                target.put(item, timeout=_POLL_INTERVAL)
+                break
+            except queue.Full:
+                continue
+        else:
+            return False
+        
+        waited = time.perf_counter() - start
+        if stage is not None and waited > 0.001:
+            with stage.lock:
+                stage.blocked_seconds += waited
+        return True
+    
+    def _get(self, source: queue.Queue):
+        """从队列取任务（引擎停止时返回结束标记）"""
+        while not self._stop.is_set():
+            try:
+                return source.get(timeout=_POLL_INTERVAL)
+            except queue.Empty:
+                continue
+        return _DONE
+    
+    def _failure(self, work: dict, stage: str, error: str, error_info: dict = None) -> dict:
+        """构造失败结果"""
+        return {
+            'success': False,
+            'stage': stage,
+            'error': error,
+            'error_info': error_info,
+            'image_path': work['name'],
+            'job_id': work['job_id'],
+            'frame': work['frame']
+        }
+    
+    def _decode(self, work: dict):
+        """
+        解码与预处理阶段
+        
+        Returns:
+            交给OCR阶段的任务，失败时返回失败结果
+        """
+        item = work.pop('item')
+        name = item.path or item.name
+        image_processor = self.pipeline.image_processor
+        
+        image_info = image_processor.get_image_info(name, data=item.data, frame=item.frame)
+        if not image_info:
+            return self._failure(work, 'decode', '无法获取图像信息')
+        
+        # 目录遍历和tar包中的输入以对象键（相对路径）命名结果，避免不同子目录中的同名文件互相覆盖
+        work['output_name'] = item.name if item.name != item.path else None
+        
+        if item.path is not None:
+            from .incremental import file_sha256
+            with tracer.span('hash'):
+                source_sha256 = file_sha256(item.path)
+        else:
+            import hashlib
+            source_sha256 = hashlib.sha256(item.data).hexdigest()
+        
+        upload = image_processor.prepare_upload(name, source_sha256=source_sha256,
+                                                data=item.data, frame=item.frame)
+        if upload is None:
+            return self._failure(work, 'decode', '图像预处理失败')
+        
+        encoded_image, process_info = upload
+        process_info.pop('cache_hit', None)
+        work.update(image_info=image_info, encoded_image=encoded_image,
+                    process_info=process_info, source_sha256=source_sha256)
+        return work
+    
+    def _ocr(self, work: dict):
+        """
+        OCR识别阶段
+        
+        Returns:
+            交给写入阶段的任务，失败时返回失败结果
+        """
+        client = self.pipeline.mathpix_client
+        if not client.check_credentials():
+            return self._failure(work, 'ocr', 'Mathpix API凭证未配置或无效')
+        
+        ocr_result = client.process_image(work.pop('encoded_image'))
+        if not ocr_result['success']:
+            error_msg = ocr_result.get('error', '未知错误')
+            return self._failure(work, 'ocr', f'OCR识别失败: {error_msg}', ocr_result.get('error_info'))
+        
+        work['ocr_result'] = ocr_result
+        return work
+    
+    def _write(self, work: dict) -> dict:
+        """
+        写入结果阶段
+        
+        Returns:
+            最终结果
+        """
+        metadata = {
+            'source_sha256': work['source_sha256'],
+            'pipeline_fingerprint': self.pipeline.fingerprint,
+            'job_id': work['job_id']
+        }
+        base_filename = result_basename(work['output_name']) if work['output_name'] else None
+        if work['frame'] is not None:
+            metadata['frame'] = work['frame']
+            metadata['n_frames'] = work['image_info'].get('n_frames')
+            base_filename = f"{base_filename or Path(work['image_info']['filename']).stem}_frame{work['frame'] + 1:03d}"
+        
+        save_result = self.pipeline.result_processor.process_and_save_results(
+            work['image_info'], work['ocr_result'], work['process_info'],
+            base_filename=base_filename, metadata=metadata
+        )
+        if not save_result['success']:
+            return self._failure(work, 'write', f"保存结果失败: {save_result.get('error', '未知错误')}")
+        
+        return {
+            'success': True,
+            'image_info': work['image_info'],
+            'ocr_result': work['ocr_result'],
+            'save_result': save_result,
+            'metadata': metadata,
+            'written': save_result['written'],
+            'image_path': work['name'],
+            'job_id': work['job_id'],
+            'frame': work['frame']
+        }
+    
+    def _feed(self, items: Iterable[StreamItem]):
+        """读取输入来源并放入解码队列（解码队列满时暂停读取）"""
+        first = self.stages[0]
+        try:
+            for item in items:
+                work = {'name': item.name, 'job_id': new_job_id(), 'item': item, 'frame': item.frame}
+                if not self._put(first.inbox, work):
+                    return
+                self._note_depth(first)
+        except Exception as e:
+            logger.error(f"读取输入来源失败: {e}", exc_info=True)
+        finally:
+            for _ in range(first.workers):
+                self._put(first.inbox, _DONE)
+    
+    def _note_depth(self, stage: _Stage):
+        """记录队列深度"""
+        depth = stage.inbox.qsize()
+        with stage.lock:
+            stage.max_depth = max(stage.max_depth, depth)
+        metrics.set_gauge(f'stream.queue.{stage.name}', depth)
+    
+    def _work(self, index: int):
+        """阶段worker：处理任务，成功时交给下一阶段，失败或最后阶段的结果直接输出"""
+        stage = self.stages[index]
+        next_stage = self.stages[index + 1] if index + 1 < len(self.stages) else None
+        
+        while True:
+            work = self._get(stage.inbox)
+            if work is _DONE:
+                break
+            metrics.set_gauge(f'stream.queue.{stage.name}', stage.inbox.qsize())
+            
+            with stage.lock:
+                stage.busy += 1
+            
+            with job_context(work['job_id']), tracer.span(f'stream.{stage.name}', image=work['name']):
+                try:
+                    result = stage.fn(work)
+                except Exception as e:
+                    logger.error(f"{stage.name} 阶段处理异常: {e}", exc_info=True)
+                    result = self._failure(work, stage.name, f'处理异常: {str(e)}')
+            
+            failed = 'success' in result and not result['success']
+            with stage.lock:
+                stage.busy -= 1
+                stage.processed += 1
+                stage.failed += failed
+            
+            if next_stage is not None and not failed:
+                ok = self._put(next_stage.inbox, result, stage)
+                self._note_depth(next_stage)
+            else:
+                ok = self._put(self._output, result, stage)
+            if not ok:
+                break
+        
+        # 本阶段最后一个worker退出时通知下一阶段
+        with stage.lock:
+            stage.alive -= 1
+            last = stage.alive == 0
+        if last:
+            if next_stage is not None:
+                for _ in range(next_stage.workers):
+                    self._put(next_stage.inbox, _DONE)
+            else:
+                self._put(self._output, _DONE)
+    
+    def run(self, items: Iterable[StreamItem]) -> Iterator[dict]:
+        """
+        处理输入流
+        
+        Args:
+            items: 输入项（可以是惰性的迭代器，按需读取）
+        
+        Yields:
+            处理结果（按完成顺序，通过 image_path 字段对应输入；失败结果带 stage 字段）
+        """
+        if self._started:
+            raise RuntimeError("流式引擎只能运行一次")
+        self._started = True
+        
+        self._threads.append(threading.Thread(target=self._feed, args=(items,),
+                                              name='stream-feed', daemon=True))
+        for index, stage in enumerate(self.stages):
+            for i in range(stage.workers):
+                self._threads.append(threading.Thread(target=self._work, args=(index,),
+                                                      name=f'stream-{stage.name}-{i}', daemon=True))
+        for thread in self._threads:
+            thread.start()
+        
+        try:
+            while True:
+                result = self._get(self._output)
+                if result is _DONE:
+                    break
+                yield result
+        finally:
+            self._stop.set()
+            for thread in self._threads:
+                thread.join()
+            for stage in self.stages:
+                metrics.set_gauge(f'stream.queue.{stage.name}', 0)
+    
+    def queue_depths(self) -> dict:
+        """
+        获取各阶段输入队列的当前深度
+        
+        Returns:
+            阶段名称 -> 队列中等待的任务数
+        """
+        return {stage.name: stage.inbox.qsize() for stage in self.stages}
+    
+    def stats(self) -> dict:
+        """
+        获取各阶段状态
+        
+        Returns:
+            阶段名称 -> worker数/忙碌数/队列深度/处理数/阻塞时间
+        """
+        return {stage.name: stage.snapshot() for stage in self.stages}
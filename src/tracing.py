@@ -0,0 +1,246 @@
+"""
+链路追踪模块
+为每个处理任务记录带父子关系的span（解码、预处理各阶段、编码、HTTP请求、解析、写文件），
+导出为Chrome trace-event JSON，用于分析并发时的阻塞和排队延迟
+"""
+
+import contextvars
+import itertools
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Optional
+
+from .config import TRACE_MAX_SPANS
+from .log_context import current_job_id
+
+logger = logging.getLogger(__name__)
+
+# 当前span（随上下文传递，线程池任务通过 submit_with_context 继承）
+_current_span = contextvars.ContextVar('current_span', default=None)
+
+_span_ids = itertools.count(1)
+
+
+class Span:
+    """一个计时区间"""
+    
+    __slots__ = ('name', 'span_id', 'parent_id', 'job_id', 'start', 'end', 'thread_id', 'attributes')
+    
+    def __init__(self, name: str, parent: Optional['Span'], job_id: str, attributes: dict):
+        self.name = name
+        self.span_id = next(_span_ids)
+        self.parent_id = parent.span_id if parent else None
+        self.job_id = job_id
+        self.start = time.perf_counter()
+        self.end = None
+        self.thread_id = threading.get_native_id()
+        self.attributes = attributes
+    
+    def set_attribute(self, key: str, value):
+        """
+        设置span属性
+        
+        Args:
+            key: 属性名
+            value: 属性值（需可JSON序列化）
+        """
+        self.attributes[key] = value
+
+
+class _NoopSpan:
+    """未启用追踪时使用的空span"""
+    
+    def set_attribute(self, key: str, value):
+        pass
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+class Tracer:
+    """span收集器（线程安全）"""
+    
+    def __init__(self, max_spans: int = TRACE_MAX_SPANS):
+        self.enabled = False
+        self.max_spans = max_spans
+        self._spans = []
+        self._dropped = 0
+        self._thread_names = {}
+        self._listeners = ()
+        # 各线程当前打开的span名称（采样分析器按此归属阶段）
+        self._thread_spans = None
+        self._lock = threading.Lock()
+        self._origin = time.perf_counter()
+    
+    def enable(self):
+        """开始收集span"""
+        self.enabled = True
+    
+    def add_listener(self, listener):
+        """
+        注册span结束回调（未启用收集时也会计时并回调，如批量进度统计）
+        
+        Args:
+            listener: 回调函数，参数为 (span名称, 耗时秒数)
+        """
+        with self._lock:
+            self._listeners = self._listeners + (listener,)
+    
+    def track_threads(self, enabled: bool = True):
+        """
+        开启/关闭按线程记录当前打开的span（未启用收集时也会记录）
+        
+        Args:
+            enabled: 是否开启
+        """
+        self._thread_spans = {} if enabled else None
+    
+    def thread_spans(self) -> dict:
+        """
+        获取各线程当前打开的span名称
+        
+        Returns:
+            线程ID -> span名称元组（由外到内），未开启记录时为空字典
+        """
+        thread_spans = self._thread_spans
+        if thread_spans is None:
+            return {}
+        return {ident: tuple(names) for ident, names in list(thread_spans.items()) if names}
+    
+    def remove_listener(self, listener):
+        """
+        移除span结束回调
+        
+        Args:
+            listener: 已注册的回调函数
+        """
+        with self._lock:
+            self._listeners = tuple(l for l in self._listeners if l is not listener)
+    
+    @contextmanager
+    def span(self, name: str, **attributes):
+        """
+        记录一个span，嵌套调用自动建立父子关系
+        
+        Args:
+            name: span名称
+            **attributes: 附加属性
+        
+        Yields:
+            Span对象（未启用时为空对象）
+        """
+        thread_spans = self._thread_spans
+        if not self.enabled and not self._listeners and thread_spans is None:
+            yield _NOOP_SPAN
+            return
+        
+        parent = _current_span.get()
+        span = Span(name, parent, current_job_id(), attributes)
+        token = _current_span.set(span)
+        if thread_spans is not None:
+            names = thread_spans.setdefault(threading.get_ident(), [])
+            names.append(name)
+        try:
+            yield span
+        except BaseException as e:
+            span.set_attribute('error', f"{type(e).__name__}: {e}")
+            raise
+        finally:
+            span.end = time.perf_counter()
+            _current_span.reset(token)
+            if thread_spans is not None:
+                names.pop()
+            if self.enabled:
+                self._finish(span)
+            for listener in self._listeners:
+                listener(span.name, span.end - span.start)
+    
+    def set_attribute(self, key: str, value):
+        """
+        为当前span设置属性
+        
+        Args:
+            key: 属性名
+            value: 属性值
+        """
+        span = _current_span.get()
+        if span is not None:
+            span.set_attribute(key, value)
+    
+    def _finish(self, span: Span):
+        """保存已结束的span"""
+        with self._lock:
+            if len(self._spans) >= self.max_spans:
+                self._dropped += 1
+                return
+            self._spans.append(span)
+            if span.thread_id not in self._thread_names:
+                self._thread_names[span.thread_id] = threading.current_thread().name
+    
+    def to_chrome_trace(self) -> dict:
+        """
+        转换为Chrome trace-event格式
+        
+        Returns:
+            trace JSON对象
+        """
+        with self._lock:
+            spans = list(self._spans)
+            thread_names = dict(self._thread_names)
+            dropped = self._dropped
+        
+        pid = os.getpid()
+        events = [
+            {'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid, 'args': {'name': name}}
+            for tid, name in thread_names.items()
+        ]
+        for span in spans:
+            args = dict(span.attributes)
+            args.update(job_id=span.job_id, span_id=span.span_id, parent_id=span.parent_id)
+            events.append({
+                'name': span.name,
+                'cat': span.name.split('.', 1)[0],
+                'ph': 'X',
+                'ts': round((span.start - self._origin) * 1e6, 1),
+                'dur': round((span.end - span.start) * 1e6, 1),
+                'pid': pid,
+                'tid': span.thread_id,
+                'args': args
+            })
+        
+        return {
+            'traceEvents': events,
+            'displayTimeUnit': 'ms',
+            'otherData': {'spans': len(spans), 'dropped': dropped}
+        }
+    
+    def export(self, path: str) -> int:
+        """
+        写出trace文件
+        
+        Args:
+            path: 输出路径
+        
+        Returns:
+            写出的span数量
+        """
+        trace = self.to_chrome_trace()
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(path.name + '.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(trace, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+        
+        count = trace['otherData']['spans']
+        logger.info(f"追踪数据已写入: {path} ({count} 个span)")
+        return count
+
+
+# 全局追踪器
+tracer = Tracer()
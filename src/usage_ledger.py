@@ -0,0 +1,137 @@
+"""
+API用量账本
+按自然日和自然月累计Mathpix调用次数并持久化到磁盘，多次运行之间共享同一份额度
+"""
+
+import json
+import logging
+import os
+import threading
+from datetime import datetime
+from pathlib import Path
+from typing import Optional
+
+from .config import USAGE_LEDGER_PATH, DAILY_BUDGET, MONTHLY_BUDGET, ensure_dir
+
+logger = logging.getLogger(__name__)
+
+try:
+    import fcntl
+except ImportError:  # Windows: 只做进程内加锁
+    fcntl = None
+
+
+class UsageLedger:
+    """持久化的调用计数（线程安全，POSIX下跨进程加锁）"""
+    
+    def __init__(self, 
+                 path: Path = USAGE_LEDGER_PATH,
+                 daily_budget: Optional[int] = DAILY_BUDGET,
+                 monthly_budget: Optional[int] = MONTHLY_BUDGET):
+        self.path = Path(path)
+        self.daily_budget = daily_budget
+        self.monthly_budget = monthly_budget
+        self._lock = threading.Lock()
+    
+    @staticmethod
+    def _periods(now: datetime = None) -> tuple:
+        """当前的(日期, 月份)标识"""
+        now = now or datetime.now()
+        return now.strftime('%Y-%m-%d'), now.strftime('%Y-%m')
+    
+    def _read(self) -> dict:
+        """读取账本并按当前日期清零过期的计数"""
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            data = {}
+        
+        day, month = self._periods()
+        if data.get('day') != day:
+            data['day'], data['day_count'] = day, 0
+        if data.get('month') != month:
+            data['month'], data['month_count'] = month, 0
+        return data
+    
+    def charge(self, count: int = 1) -> dict:
+        """
+        记录API调用
+        
+        Args:
+            count: 调用次数
+        
+        Returns:
+            更新后的账本数据
+        """
+        with self._lock:
+            ensure_dir(self.path.parent)
+            with open(self.path.with_name(self.path.name + '.lock'), 'a') as lock_file:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX)
+                
+                data = self._read()
+                data['day_count'] += count
+                data['month_count'] += count
+                
+                tmp_path = self.path.with_name(self.path.name + '.tmp')
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    json.dump(data, f)
+                os.replace(tmp_path, self.path)
+        return data
+    
+    def remaining(self) -> Optional[int]:
+        """
+        获取剩余额度（日额度和月额度中较小的一个）
+        
+        Returns:
+            剩余调用次数，两者都不限制时返回None
+        """
+        with self._lock:
+            data = self._read()
+        
+        limits = []
+        if self.daily_budget is not None:
+            limits.append(self.daily_budget - data['day_count'])
+        if self.monthly_budget is not None:
+            limits.append(self.monthly_budget - data['month_count'])
+        return max(0, min(limits)) if limits else None
+    
+    def snapshot(self) -> dict:
+        """
+        获取账本摘要
+        
+        Returns:
+            包含今日/本月用量、上限和剩余额度的字典
+        """
+        with self._lock:
+            data = self._read()
+        return {
+            'day': data['day'],
+            'day_count': data['day_count'],
+            'daily_budget': self.daily_budget,
+            'month': data['month'],
+            'month_count': data['month_count'],
+            'monthly_budget': self.monthly_budget,
+            'remaining': self.remaining()
+        }
+
+
+# 全局实例（首次访问时创建）
+_usage_ledger: Optional[UsageLedger] = None
+_instance_lock = threading.Lock()
+
+
+def get_usage_ledger() -> UsageLedger:
+    """
+    获取全局用量账本
+    
+    Returns:
+        UsageLedger实例
+    """
+    global _usage_ledger
+    if _usage_ledger is None:
+        with _instance_lock:
+            if _usage_ledger is None:
+                _usage_ledger = UsageLedger()
+    return _usage_ledger
@@ -0,0 +1,190 @@
+"""
+多变体重试模块
+识别置信度低于阈值时，并发提交多个预处理变体，保留置信度最高的结果
+"""
+
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Tuple
+
+from .config import (
+    OCR_CONFIDENCE_THRESHOLD,
+    VARIANT_NAMES,
+    VARIANT_MAX_PER_IMAGE,
+    VARIANT_BATCH_BUDGET
+)
+from .log_context import submit_with_context
+from .tracing import tracer
+
+logger = logging.getLogger(__name__)
+
+
+class VariantRetrier:
+    """
+    低置信度多变体重试器（批次预算在多张图像间共享，线程安全）
+    
+    每个变体只发送一次OCR请求（不重试），预算按实际API调用次数扣减
+    """
+    
+    def __init__(self,
+                 image_processor=None,
+                 mathpix_client=None,
+                 variants: List[str] = None,
+                 max_per_image: int = VARIANT_MAX_PER_IMAGE,
+                 batch_budget: int = VARIANT_BATCH_BUDGET,
+                 threshold: float = OCR_CONFIDENCE_THRESHOLD):
+        # 组件通常由流水线在 improve 时传入；都未传入时使用全局实例
+        self.image_processor = image_processor
+        self.mathpix_client = mathpix_client
+        self.variants = list(variants or VARIANT_NAMES)
+        self.max_per_image = max_per_image
+        self.batch_budget = batch_budget
+        self.threshold = threshold
+        
+        self._lock = threading.Lock()
+        self.spent = 0
+    
+    def _reserve(self, wanted: int) -> int:
+        """
+        从批次预算中预留额外调用次数
+        
+        Args:
+            wanted: 希望使用的次数
+        
+        Returns:
+            实际获得的次数
+        """
+        with self._lock:
+            granted = max(0, min(wanted, self.batch_budget - self.spent))
+            self.spent += granted
+            return granted
+    
+    def _refund(self, unused: int):
+        """退回预留但未实际调用API的次数（预处理失败的变体）"""
+        if unused:
+            with self._lock:
+                self.spent -= unused
+    
+    def _components(self, image_processor, mathpix_client) -> tuple:
+        """确定本次使用的图像处理器和Mathpix客户端（参数 > 构造时传入 > 全局实例）"""
+        if image_processor is None:
+            image_processor = self.image_processor
+        if mathpix_client is None:
+            mathpix_client = self.mathpix_client
+        if image_processor is None:
+            from .image_processor import get_image_processor
+            image_processor = get_image_processor()
+        if mathpix_client is None:
+            from .mathpix_client import get_mathpix_client
+            mathpix_client = get_mathpix_client()
+        return image_processor, mathpix_client
+    
+    @staticmethod
+    def _run_variant(image_processor,
+                     mathpix_client,
+                     image_path: str, 
+                     variant: str, 
+                     frame: int = None) -> Tuple[str, Optional[dict], Optional[dict]]:
+        """
+        使用一个预处理变体完成预处理和OCR（只请求一次，与预算中扣减的次数一致）
+        
+        Returns:
+            (变体名称, OCR结果, 处理信息)
+        """
+        upload = image_processor.prepare_upload(image_path, variant=variant, frame=frame)
+        if upload is None:
+            return variant, None, None
+        
+        encoded, process_info = upload
+        process_info.pop('cache_hit', None)
+        
+        return variant, mathpix_client.process_image(encoded, retries=1), process_info
+    
+    def improve(self, 
+                image_path: str, 
+                ocr_result: dict, 
+                process_info: dict, 
+                frame: int = None,
+                image_processor=None,
+                mathpix_client=None) -> Tuple[dict, dict]:
+        """
+        对低置信度结果尝试预处理变体
+        
+        Args:
+            image_path: 图像文件路径
+            ocr_result: 默认流程的OCR结果
+            process_info: 默认流程的处理信息
+            frame: 多页TIFF的帧序号，None表示第一帧
+            image_processor: 生成变体的图像处理器（流水线传入自己的实例），None时使用构造时传入的
+            mathpix_client: 识别变体的Mathpix客户端，None时使用构造时传入的
+        
+        Returns:
+            (最佳OCR结果, 对应的处理信息)；处理信息中的variant_retry记录各变体的结果
+        """
+        confidence = ocr_result.get('confidence', 0.0)
+        if not ocr_result.get('success') or confidence >= self.threshold:
+            return ocr_result, process_info
+        
+        granted = self._reserve(min(self.max_per_image, len(self.variants)))
+        if granted == 0:
+            logger.info("多变体重试预算已用完，保留原结果")
+            return ocr_result, process_info
+        
+        variants = self.variants[:granted]
+        logger.info(f"置信度 {confidence:.2f} 低于阈值，尝试预处理变体: {', '.join(variants)}")
+        
+        image_processor, mathpix_client = self._components(image_processor, mathpix_client)
+        with tracer.span('variants', variants=variants):
+            with ThreadPoolExecutor(max_workers=len(variants), thread_name_prefix='variant') as executor:
+                futures = [submit_with_context(executor, self._run_variant, image_processor, mathpix_client,
+                                               image_path, v, frame)
+                           for v in variants]
+                outcomes = []
+                for future in futures:
+                    try:
+                        outcomes.append(future.result())
+                    except Exception as e:
+                        logger.error(f"预处理变体执行失败: {e}")
+        
+        self._refund(sum(1 for _, result, _ in outcomes if result is None))
+        
+        best_name, best_result, best_info = None, ocr_result, process_info
+        attempts = [{'variant': 'default', 'success': True, 'confidence': confidence, 'error': None}]
+        
+        for variant, result, info in outcomes:
+            success = bool(result and result.get('success'))
+            attempts.append({
+                'variant': variant,
+                'success': success,
+                'confidence': result.get('confidence', 0.0) if success else 0.0,
+                'error': None if success else (result or {}).get('error', '预处理失败')
+            })
+            if success and result['confidence'] > best_result.get('confidence', 0.0):
+                best_name, best_result, best_info = variant, result, info
+        
+        winner = best_name or 'default'
+        logger.info(f"多变体重试完成，选用: {winner}，置信度: {best_result.get('confidence', 0.0):.2f}")
+        
+        best_info = dict(best_info)
+        best_info['variant'] = winner
+        best_info['variant_retry'] = {
+            'original_confidence': confidence,
+            'winner': winner,
+            'attempts': attempts
+        }
+        return best_result, best_info
+    
+    def get_budget_info(self) -> dict:
+        """
+        获取预算使用情况
+        
+        Returns:
+            已使用和剩余的额外调用次数
+        """
+        with self._lock:
+            return {
+                'spent': self.spent,
+                'batch_budget': self.batch_budget,
+                'remaining': max(0, self.batch_budget - self.spent)
+            }
@@ -0,0 +1,335 @@
+"""
+目录监视模块
+以守护进程方式监视上传目录，将新图像增量送入常驻worker池处理
+"""
+
+import ctypes
+import ctypes.util
+import logging
+import os
+import select
+import struct
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+from .config import (
+    UPLOAD_DIR,
+    PROCESSED_DIR,
+    FAILED_DIR,
+    SUPPORTED_FORMATS,
+    WATCH_WORKERS,
+    WATCH_POLL_INTERVAL,
+    WATCH_DEBOUNCE_SECONDS,
+    WATCH_RESCAN_INTERVAL,
+    ensure_dir
+)
+
+logger = logging.getLogger(__name__)
+
+# 熔断器打开时，被暂缓的文件至少等待这么久再重新提交（秒）
+PARK_MIN_SECONDS = 5.0
+
+
+class InotifySource:
+    """基于Linux inotify的目录事件源（通过ctypes调用libc，无额外依赖）"""
+    
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_TO = 0x00000080
+    _EVENT_HEADER = struct.Struct('iIII')
+    
+    def __init__(self, directory: Path):
+        libc_name = ctypes.util.find_library('c') or 'libc.so.6'
+        libc = ctypes.CDLL(libc_name, use_errno=True)
+        
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 失败')
+        
+        mask = self.IN_CLOSE_WRITE | self.IN_MOVED_TO
+        if libc.inotify_add_watch(self.fd, os.fsencode(str(directory)), mask) < 0:
+            errno = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(errno, f'inotify_add_watch 失败: {directory}')
+    
+    def read(self, timeout: float) -> List[str]:
+        """
+        等待并读取事件
+        
+        Args:
+            timeout: 最长等待时间（秒）
+        
+        Returns:
+            发生变化的文件名列表
+        """
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return []
+        
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        
+        names = []
+        offset = 0
+        header_size = self._EVENT_HEADER.size
+        while offset + header_size <= len(data):
+            _, _, _, length = self._EVENT_HEADER.unpack_from(data, offset)
+            name = data[offset + header_size: offset + header_size + length].rstrip(b'\0')
+            offset += header_size + length
+            if name:
+                names.append(os.fsdecode(name))
+        return names
+    
+    def close(self):
+        """关闭inotify文件描述符"""
+        os.close(self.fd)
+
+
+class FolderWatcher:
+    """
+    上传目录监视器
+    
+    新文件在大小和修改时间稳定 debounce 秒后才提交处理，避免读到写了一半的文件；
+    处理成功的输入移动到 PROCESSED_DIR，失败的移动到 FAILED_DIR。
+    """
+    
+    def __init__(self,
+                 handler: Callable[[str], dict],
+                 watch_dir: Path = UPLOAD_DIR,
+                 processed_dir: Path = PROCESSED_DIR,
+                 failed_dir: Path = FAILED_DIR,
+                 workers: int = WATCH_WORKERS,
+                 poll_interval: float = WATCH_POLL_INTERVAL,
+                 debounce: float = WATCH_DEBOUNCE_SECONDS,
+                 use_inotify: bool = True):
+        self.handler = handler
+        self.watch_dir = Path(watch_dir)
+        self.processed_dir = Path(processed_dir)
+        self.failed_dir = Path(failed_dir)
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.debounce = debounce
+        self.use_inotify = use_inotify
+        
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._candidates: Dict[Path, Tuple[int, int, float]] = {}  # 路径 -> (大小, 修改时间, 稳定起始时间)
+        self._in_flight = set()
+        self._parked: Dict[Path, float] = {}  # 路径 -> 可重新提交的时间
+        self._executor: Optional[ThreadPoolExecutor] = None
+        
+        self.stats = {'processed': 0, 'failed': 0, 'parked': 0}
+    
+    def stop(self):
+        """请求停止监视（正在处理的任务会继续完成，尚未开始的任务取消，输入留在监视目录）"""
+        self._stop.set()
+    
+    def _is_candidate(self, path: Path) -> bool:
+        """判断文件是否需要处理"""
+        name = path.name
+        if name.startswith('.') or name.endswith(('.part', '.tmp', '.crdownload')):
+            return False
+        return path.suffix.lower() in SUPPORTED_FORMATS
+    
+    def _open_event_source(self) -> Optional[InotifySource]:
+        """尝试创建inotify事件源，不可用时返回None（退回轮询）"""
+        if not self.use_inotify or not sys.platform.startswith('linux'):
+            return None
+        try:
+            source = InotifySource(self.watch_dir)
+            logger.info(f"使用inotify监视目录: {self.watch_dir}")
+            return source
+        except (OSError, AttributeError) as e:
+            logger.warning(f"inotify不可用，改用轮询: {e}")
+            return None
+    
+    def _note(self, path: Path):
+        """记录一个候选文件（已在处理或已暂缓的文件不重复记录）"""
+        with self._lock:
+            if path in self._in_flight or path in self._parked:
+                return
+        if path not in self._candidates and self._is_candidate(path):
+            self._candidates[path] = (-1, -1, time.monotonic())
+    
+    def _scan(self):
+        """全量扫描监视目录"""
+        try:
+            with os.scandir(self.watch_dir) as entries:
+                for entry in entries:
+                    if entry.is_file(follow_symlinks=False):
+                        self._note(Path(entry.path))
+        except FileNotFoundError:
+            logger.warning(f"监视目录不存在: {self.watch_dir}")
+    
+    def _collect_ready(self) -> List[Path]:
+        """
+        检查候选文件是否写入完成
+        
+        Returns:
+            可以提交处理的文件列表
+        """
+        now = time.monotonic()
+        ready = []
+        
+        for path, (size, mtime, since) in list(self._candidates.items()):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                del self._candidates[path]
+                continue
+            
+            if (stat.st_size, stat.st_mtime_ns) != (size, mtime):
+                # 文件仍在变化，重新开始计时
+                self._candidates[path] = (stat.st_size, stat.st_mtime_ns, now)
+            elif stat.st_size > 0 and now - since >= self.debounce:
+                del self._candidates[path]
+                ready.append(path)
+        
+        with self._lock:
+            for path, resume_at in list(self._parked.items()):
+                if now >= resume_at:
+                    del self._parked[path]
+                    ready.append(path)
+        
+        return ready
+    
+    def _submit(self, path: Path):
+        """提交文件到worker池（停止后不再提交）"""
+        with self._lock:
+            if path in self._in_flight or self._stop.is_set():
+                return
+            self._in_flight.add(path)
+        future = self._executor.submit(self._run_job, path)
+        # 停止时被取消的任务不会执行 _run_job
+        future.add_done_callback(lambda f: self._discard_cancelled(path, f))
+    
+    def _discard_cancelled(self, path: Path, future):
+        """任务被取消时释放文件（文件留在监视目录，下次启动时处理）"""
+        if future.cancelled():
+            with self._lock:
+                self._in_flight.discard(path)
+    
+    def _run_job(self, path: Path):
+        """在worker线程中处理单个文件"""
+        finish_later = False
+        try:
+            if self._stop.is_set():
+                # 停止后才开始的任务：文件留在监视目录
+                return
+            try:
+                result = self.handler(str(path))
+            except Exception as e:
+                if self._stop.is_set():
+                    # 停止过程中调度器已关闭，不算处理失败
+                    logger.info(f"监视已停止，{path.name} 留在监视目录: {e}")
+                    return
+                logger.error(f"处理文件时发生异常: {path.name}: {e}", exc_info=True)
+                result = {'success': False, 'error': str(e)}
+            
+            error_info = result.get('error_info') or {}
+            if not result.get('success') and error_info.get('id') in ('circuit_open', 'budget_deferred'):
+                # 熔断器打开或API额度不足：文件留在原处，稍后重新提交
+                delay = max(PARK_MIN_SECONDS, error_info.get('retry_in') or 0)
+                with self._lock:
+                    self._parked[path] = time.monotonic() + delay
+                    self.stats['parked'] += 1
+                logger.warning(f"{result.get('error')}，暂缓处理 {path.name}，{delay:.0f}秒后重试")
+                return
+            
+            written = result.get('written') if result.get('success') else None
+            if written is not None:
+                # 结果文件写入完成后再移出输入（在写入线程中执行），写入失败的输入移到失败目录
+                finish_later = True
+                written.add_done_callback(
+                    lambda future: self._finish(path, future.result(), result.get('error') or '结果文件写入失败')
+                )
+            else:
+                self._finish(path, result.get('success'), result.get('error'))
+        finally:
+            if not finish_later:
+                with self._lock:
+                    self._in_flight.discard(path)
+    
+    def _finish(self, path: Path, success: bool, error: Optional[str]):
+        """
+        将处理完的输入移出监视目录并更新统计
+        
+        Args:
+            path: 输入文件
+            success: 是否处理成功（含结果文件写入）
+            error: 失败原因
+        """
+        try:
+            if success:
+                destination = self._move_aside(path, self.processed_dir)
+                with self._lock:
+                    self.stats['processed'] += 1
+                logger.info(f"处理完成: {path.name} -> {destination}")
+            else:
+                destination = self._move_aside(path, self.failed_dir)
+                with self._lock:
+                    self.stats['failed'] += 1
+                logger.error(f"处理失败: {path.name}: {error} -> {destination}")
+        finally:
+            with self._lock:
+                self._in_flight.discard(path)
+    
+    def _move_aside(self, path: Path, directory: Path) -> Optional[Path]:
+        """
+        将已处理的输入移出监视目录（重名时追加时间戳）
+        
+        Args:
+            path: 输入文件
+            directory: 目标目录
+        
+        Returns:
+            移动后的路径，失败时返回None
+        """
+        destination = ensure_dir(directory) / path.name
+        if destination.exists():
+            stamp = datetime.now().strftime('%Y%m%d%H%M%S%f')
+            destination = directory / f"{path.stem}_{stamp}{path.suffix}"
+        try:
+            os.replace(path, destination)
+            return destination
+        except OSError as e:
+            logger.error(f"移动文件失败: {path} -> {destination}: {e}")
+            return None
+    
+    def run(self):
+        """运行监视循环，直到调用stop()"""
+        ensure_dir(self.watch_dir)
+        source = self._open_event_source()
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='watch-worker')
+        logger.info(f"开始监视目录: {self.watch_dir}，worker数量: {self.workers}")
+        
+        # 启动时先处理已存在的文件
+        self._scan()
+        last_scan = time.monotonic()
+        
+        try:
+            while not self._stop.is_set():
+                if source is not None:
+                    for name in source.read(self.poll_interval):
+                        self._note(self.watch_dir / name)
+                    if time.monotonic() - last_scan >= WATCH_RESCAN_INTERVAL:
+                        self._scan()
+                        last_scan = time.monotonic()
+                else:
+                    self._stop.wait(self.poll_interval)
+                    self._scan()
+                
+                for path in self._collect_ready():
+                    self._submit(path)
+        finally:
+            if source is not None:
+                source.close()
+            logger.info("停止监视，等待进行中的任务完成...")
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            logger.info(f"监视结束: {self.stats}")
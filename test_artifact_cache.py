@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+"""
+预处理结果缓存测试
+"""
+
+import os
+
+from src.artifact_cache import ArtifactCache, make_cache_key
+
+
+def entry_size(cache, key):
+    """缓存条目文件的大小"""
+    return cache._path(key).stat().st_size
+
+
+def test_roundtrip_and_hit_counts(tmp_path):
+    """写入的条目原样读出，命中和未命中分别计数"""
+    cache = ArtifactCache(tmp_path, max_bytes=1 << 20)
+    key = make_cache_key('0' * 64, {'steps': ['crop', 'resize']})
+    
+    assert cache.get(key) is None
+    cache.put(key, b'\x89PNG encoded', {'processed_size': [10, 20]})
+    assert cache.get(key) == {'encoded': b'\x89PNG encoded', 'process_info': {'processed_size': [10, 20]}}
+    assert cache.stats()['hits'] == 1 and cache.stats()['misses'] == 1
+
+
+def test_overwrite_does_not_inflate_total_bytes(tmp_path):
+    """重复写入同一个键时，总大小只按最新条目计算"""
+    cache = ArtifactCache(tmp_path, max_bytes=1 << 20)
+    for _ in range(5):
+        cache.put('ab' * 32, b'x' * 1000, {})
+    
+    assert cache.stats()['total_bytes'] == entry_size(cache, 'ab' * 32)
+
+
+def test_evicts_least_recently_used(tmp_path):
+    """超过上限时先淘汰最久未使用的条目，读取过的条目保留"""
+    cache = ArtifactCache(tmp_path, max_bytes=3500)
+    keys = ['aa' * 32, 'bb' * 32, 'cc' * 32, 'dd' * 32]
+    for index, key in enumerate(keys[:3]):
+        cache.put(key, b'x' * 1000, {})
+        # 固定修改时间，使写入顺序不依赖文件系统的时间精度
+        os.utime(cache._path(key), ns=(index * 10**9, index * 10**9))
+    
+    assert cache.get(keys[0]) is not None  # a 成为最近使用
+    cache.put(keys[3], b'x' * 1000, {})
+    
+    assert cache.get(keys[1]) is None
+    assert all(cache.get(key) is not None for key in (keys[0], keys[2], keys[3]))
+    assert cache.stats()['total_bytes'] == sum(entry_size(cache, key) for key in (keys[0], keys[2], keys[3]))
+    assert cache.stats()['total_bytes'] <= cache.max_bytes
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+熔断器状态切换测试
+"""
+
+import time
+
+from src.circuit_breaker import CircuitBreaker, CLOSED, OPEN, HALF_OPEN
+
+
+def make_breaker(**kwargs):
+    """创建冷却时间很短的熔断器（最近4次中一半失败即打开）"""
+    options = dict(name='test', error_rate=0.5, min_requests=4, window=4,
+                   open_seconds=0.05, fatal_open_seconds=60, fatal_codes={401, 402})
+    options.update(kwargs)
+    return CircuitBreaker(**options)
+
+
+def test_opens_when_error_rate_reached():
+    """请求数达到下限且错误率达到阈值时打开，打开后拒绝请求"""
+    breaker = make_breaker()
+    breaker.record_success()
+    breaker.record_failure(500)
+    breaker.record_success()
+    assert breaker.state == CLOSED  # 请求数不足
+    
+    breaker.record_failure(503)
+    assert breaker.state == OPEN
+    assert not breaker.allow_request()
+    assert 0 < breaker.retry_in() <= 0.05
+
+
+def test_half_open_allows_single_probe_and_closes_on_success():
+    """冷却结束后进入half_open，只放行一个探测请求；探测成功后关闭并清空统计"""
+    breaker = make_breaker(min_requests=1, window=1)
+    breaker.record_failure(500)
+    assert breaker.state == OPEN
+    
+    time.sleep(0.06)
+    assert breaker.allow_request()
+    assert breaker.state == HALF_OPEN
+    assert not breaker.allow_request()
+    
+    breaker.record_success()
+    assert breaker.state == CLOSED
+    assert breaker.snapshot()['recent_failures'] == 0
+    assert breaker.allow_request()
+
+
+def test_probe_failure_reopens():
+    """探测请求失败时重新打开"""
+    breaker = make_breaker(min_requests=1, window=1)
+    breaker.record_failure(500)
+    time.sleep(0.06)
+    assert breaker.allow_request()
+    
+    breaker.record_failure(None, '连接超时')
+    assert breaker.state == OPEN
+    assert breaker.snapshot()['last_error'] == '探测请求失败: 连接超时'
+
+
+def test_neutral_result_releases_probe():
+    """探测请求得到中性结果（如429）时释放探测名额，下一个请求可以继续探测"""
+    breaker = make_breaker(min_requests=1, window=1)
+    breaker.record_failure(500)
+    time.sleep(0.06)
+    assert breaker.allow_request()
+    assert not breaker.allow_request()
+    
+    breaker.record_neutral()
+    assert breaker.state == HALF_OPEN
+    assert breaker.allow_request()
+
+
+def test_fatal_code_opens_immediately_with_long_cooldown():
+    """致命状态码不经错误率统计立即打开，冷却时间为 fatal_open_seconds"""
+    breaker = make_breaker()
+    breaker.record_failure(401)
+    assert breaker.state == OPEN
+    assert breaker.snapshot()['fatal']
+    assert breaker.retry_in() > 1
+
+
+def test_fatal_codes_can_be_disabled():
+    """不设置致命状态码时（服务级熔断器），401按普通失败统计"""
+    breaker = make_breaker(fatal_codes=())
+    breaker.record_failure(401)
+    assert breaker.state == CLOSED
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+凭证池测试
+"""
+
+import time
+
+from src.circuit_breaker import CircuitBreaker, CLOSED, HALF_OPEN
+from src.credentials import Credential, CredentialPool, parse_credentials
+
+
+def make_pool(*names, acquire_timeout=1.0, fatal_open_seconds=60):
+    """不受限速影响的凭证池，摘除后的冷却时间可调"""
+    credentials = []
+    for name in names:
+        credential = Credential(name, 'key', rate_per_minute=60000)
+        credential.breaker = CircuitBreaker(name=f'mathpix.{name}', fatal_open_seconds=fatal_open_seconds,
+                                            fatal_codes={401, 402})
+        credentials.append(credential)
+    return CredentialPool(credentials, acquire_timeout=acquire_timeout)
+
+
+def test_parse_credentials():
+    """逗号分隔的 app_id:app_key，忽略空项"""
+    assert parse_credentials(' a:1, b:2 ,') == [('a', '1'), ('b', '2')]
+    try:
+        parse_credentials('missing-key')
+    except ValueError:
+        pass
+    else:
+        raise AssertionError('应当拒绝没有app_key的凭证')
+
+
+def test_picks_least_loaded_credential():
+    """按（进行中请求数，使用次数）选择负载最低的账号"""
+    pool = make_pool('a', 'b', 'c')
+    held = [pool.acquire() for _ in range(3)]
+    assert sorted(c.name for c in held) == ['a', 'b', 'c']
+    assert pool.in_flight() == 3
+    
+    a, b, c = sorted(held, key=lambda credential: credential.name)
+    pool.release(b, 200)
+    pool.release(c, 200)
+    pool.release(pool.acquire(), 200)  # 使用次数相同时取第一个：b
+    assert b.usage_count == 2 and c.usage_count == 1
+    
+    # a 仍有进行中的请求，c 使用次数最少
+    assert pool.acquire() is c
+
+
+def test_drains_credential_on_401_and_402():
+    """401/402的账号被摘除，不再分派请求；全部摘除时立即返回None"""
+    pool = make_pool('a', 'b')
+    first = pool.acquire()
+    second = pool.acquire()
+    pool.release(first, 401)
+    
+    assert not first.is_healthy()
+    assert first.snapshot()['drained']
+    for _ in range(3):
+        credential = pool.acquire()
+        assert credential is second
+        pool.release(credential, 200)
+    
+    pool.release(pool.acquire(), 402)
+    start = time.monotonic()
+    assert pool.acquire() is None
+    assert time.monotonic() - start < 0.5
+    assert not pool.has_usable()
+    assert pool.retry_in() > 0
+
+
+def test_rate_limited_credential_cools_down_for_retry_after():
+    """429后账号按Retry-After冷却：期间请求交给其他账号，只有一个账号时等待冷却结束"""
+    pool = make_pool('a', 'b')
+    limited = pool.acquire()
+    pool.release(limited, 429, retry_after=0.3)
+    assert limited.is_healthy()
+    
+    other = pool.acquire()
+    assert other is not limited
+    # other 有进行中的请求，但 limited 仍在冷却
+    assert pool.acquire() is other
+    assert limited.snapshot()['cooldown'] > 0
+    
+    single = make_pool('a')
+    credential = single.acquire()
+    single.release(credential, 429, retry_after=0.2)
+    start = time.monotonic()
+    assert single.acquire() is credential
+    assert time.monotonic() - start >= 0.15
+    
+    single.release(credential, 429, retry_after=5)
+    single.acquire_timeout = 0.1
+    assert single.acquire() is None
+
+
+def test_half_open_probe_restores_credential():
+    """摘除的账号冷却结束后只放行一个探测请求，探测成功后恢复分派"""
+    pool = make_pool('a', acquire_timeout=0.1, fatal_open_seconds=0.05)
+    credential = pool.acquire()
+    pool.release(credential, 401)
+    assert pool.acquire() is None
+    
+    time.sleep(0.06)
+    probe = pool.acquire()
+    assert probe is credential
+    assert credential.breaker.state == HALF_OPEN
+    assert pool.acquire() is None  # 探测进行中，不放行其他请求
+    
+    pool.release(probe, 200)
+    assert credential.breaker.state == CLOSED
+    assert credential.is_healthy()
+    assert pool.acquire() is credential
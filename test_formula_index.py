@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+公式检索模块测试
+"""
+
+from concurrent.futures import Future
+
+from src.formula_index import FormulaIndex, make_ngrams, tokenize_latex
+from src.result_processor import ResultProcessor
+
+
+def result_with(latex, filename='page.png'):
+    """只含 latex_content 的结果数据"""
+    return {'image_info': {'filename': filename}, 'ocr_result': {'latex_content': latex}}
+
+
+def dice(query, latex):
+    """两个公式n-gram集合的Dice系数"""
+    a = make_ngrams(tokenize_latex(query))
+    b = make_ngrams(tokenize_latex(latex))
+    return round(2 * len(a & b) / (len(a) + len(b)), 4)
+
+
+def test_tokenize_normalizes_spacing_aliases_and_braces():
+    """空白、排版命令和同义命令不影响结果；只去掉包住单个字符或命令的花括号"""
+    assert tokenize_latex(r'\left( x^{2} \right) \le \dfrac{a}{b}') == \
+        ['(', 'x', '^', '2', ')', '\\leq', '\\frac', 'a', 'b']
+    assert tokenize_latex('{{a}} + {}b') == ['a', '+', 'b']
+    assert tokenize_latex(r'e^{\alpha}') == tokenize_latex(r'e^\alpha')
+    
+    # 多位数字和多个token的花括号保留
+    assert tokenize_latex('x^{23}') == ['x', '^', '{', '23', '}']
+    assert tokenize_latex('x^{23}') != tokenize_latex('x^23')
+    assert tokenize_latex('x^{a+b}') == ['x', '^', '{', 'a', '+', 'b', '}']
+
+
+def test_exact_match_ignores_formatting(tmp_path):
+    """排版不同但归一化后相同的公式精确匹配，score为1.0"""
+    index = FormulaIndex(tmp_path / 'index' / 'formulas.sqlite')
+    assert index.add_result(result_with(r'\frac{a}{b} \le c'), 'one.json') == 1
+    index.add_result(result_with('a + b = c'), 'two.json')
+    
+    matches = index.search(r'\dfrac{a}{b}\,\leq c')
+    assert matches[0]['result_path'] == 'one.json'
+    assert matches[0]['exact'] and matches[0]['score'] == 1.0
+    assert index.stats() == {'formulas': 2, 'results': 2}
+    index.close()
+
+
+def test_approximate_matches_ranked_by_dice(tmp_path):
+    """近似匹配按n-gram的Dice系数降序排列，低于 min_score 的不返回"""
+    index = FormulaIndex(tmp_path / 'formulas.sqlite')
+    formulas = {
+        'close.json': 'x^2 + y^2 = r^2',
+        'further.json': 'x^2 + y^3 = r^3',
+        'unrelated.json': r'\int_0^1 f(t) dt',
+    }
+    for path, latex in formulas.items():
+        index.add_result(result_with(latex), path)
+    
+    query = 'x^2 + y^2 = z^2'
+    matches = index.search(query, min_score=0.2)
+    assert [match['result_path'] for match in matches] == ['close.json', 'further.json']
+    assert [match['score'] for match in matches] == [dice(query, formulas['close.json']),
+                                                   dice(query, formulas['further.json'])]
+    assert not any(match['exact'] for match in matches)
+    
+    assert [match['result_path'] for match in index.search(query, min_score=0.6)] == ['close.json']
+    index.close()
+
+
+def test_reindexing_result_replaces_previous_formulas(tmp_path):
+    """同一个结果文件重新索引时替换旧记录"""
+    index = FormulaIndex(tmp_path / 'formulas.sqlite')
+    index.add_result(result_with('a + b = c'), 'page.json')
+    index.add_result(result_with('p + q = r'), 'page.json')
+    
+    assert index.search('a + b = c') == []
+    assert index.search('p + q = r')[0]['exact']
+    assert index.stats() == {'formulas': 1, 'results': 1}
+    index.close()
+
+
+class ManualWriter:
+    """不实际写文件的写入器，由测试决定每个文件是否写入成功"""
+    
+    def __init__(self):
+        self.futures = []
+    
+    def submit(self, path, content, span=None):
+        future = Future()
+        self.futures.append(future)
+        return future
+
+
+def test_result_indexed_only_after_successful_write(tmp_path):
+    """公式在结果文件写入成功后才进入索引，写入失败的结果不被索引"""
+    writer = ManualWriter()
+    processor = ResultProcessor(index_formulas=True, writer=writer)
+    processor.results_dir = tmp_path
+    processor._formula_index = FormulaIndex(tmp_path / 'formulas.sqlite')
+    
+    saved = processor.process_and_save_results({'filename': 'ok.png'}, {'latex_content': 'a + b = c'},
+                                               base_filename='ok')
+    assert saved['success']
+    assert processor.formula_index.stats()['formulas'] == 0
+    for future in writer.futures:
+        future.set_result(True)
+    assert processor.formula_index.search('a + b = c')[0]['result_path'] == saved['json_path']
+    
+    writer.futures.clear()
+    processor.process_and_save_results({'filename': 'bad.png'}, {'latex_content': 'p + q = r'},
+                                       base_filename='bad')
+    writer.futures[0].set_result(True)
+    writer.futures[1].set_result(False)
+    assert processor.formula_index.search('p + q = r') == []
+    processor.formula_index.close()
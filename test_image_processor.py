@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+图像处理模块测试
+"""
+
+from pathlib import Path
+
+import numpy as np
+
+from src.image_processor import ImageProcessor, map_bbox_to_original
+from src.profiler import count_frame_buffers
+
+
+def make_processor(text_height):
+    """创建按字符高度缩放、字符高度估计固定为 text_height 的处理器"""
+    processor = ImageProcessor()
+    processor.resize_mode = 'text_height'
+    processor.max_size = (2048, 2048)
+    processor.target_text_height = 20
+    processor.text_height_scale_range = (0.25, 2.0)
+    processor.estimate_text_height = lambda image: text_height
+    return processor
+
+
+def test_resize_snap_does_not_cancel_required_downscale():
+    """字符高度已接近目标时不重采样，但超出最大尺寸的图像仍缩小到最大尺寸以内"""
+    processor = make_processor(20)
+    image = np.zeros((1000, 2100, 3), dtype=np.uint8)
+    
+    resized = processor.resize_image(image)
+    
+    h, w = resized.shape[:2]
+    assert w <= 2048 and h <= 2048
+    assert w == int(2100 * 2048 / 2100)
+
+
+def test_resize_snap_keeps_size_within_tolerance():
+    """未超出最大尺寸且缩放比例接近1时返回原图"""
+    processor = make_processor(21)
+    image = np.zeros((1000, 1500, 3), dtype=np.uint8)
+    
+    assert processor.resize_image(image) is image
+
+
+def test_resize_upscale_is_capped_by_max_size():
+    """字符过小需要放大时，放大后仍不超过最大尺寸"""
+    processor = make_processor(5)
+    image = np.zeros((500, 1500, 3), dtype=np.uint8)
+    
+    resized = processor.resize_image(image)
+    
+    h, w = resized.shape[:2]
+    assert w <= 2048 and h <= 2048
+    assert h > 500
+
+
+def ink_box(image):
+    """图像中深色像素的外接矩形 (x, y, width, height)"""
+    ys, xs = np.nonzero(image.min(axis=2) < 128)
+    return int(xs.min()), int(ys.min()), int(xs.max() + 1 - xs.min()), int(ys.max() + 1 - ys.min())
+
+
+def test_map_bbox_inverts_crop_resize_and_upscale(tmp_path):
+    """upscaled 变体经过裁剪、缩放和放大后，区域坐标仍能映射回原图位置"""
+    from PIL import Image
+    
+    image = np.full((600, 1200, 3), 255, dtype=np.uint8)
+    image[250:290, 500:620] = 0
+    path = tmp_path / 'page.png'
+    Image.fromarray(image).save(path)
+    
+    processor = ImageProcessor(use_cache=False)
+    processed, process_info = processor.preprocess_image(str(path), variant='upscaled')
+    
+    steps = [transform['step'] for transform in process_info['geometry']]
+    assert 'crop' in steps and 'upscale' in steps
+    x, y, width, height = ink_box(processed)
+    mapped = map_bbox_to_original({'x': x, 'y': y, 'width': width, 'height': height}, process_info)
+    assert abs(mapped['x'] - 500) <= 2 and abs(mapped['y'] - 250) <= 2
+    assert abs(mapped['width'] - 120) <= 3 and abs(mapped['height'] - 40) <= 3
+
+
+def test_map_bbox_inverts_rotation():
+    """倾斜校正的旋转被撤销：旋转后的点映射回旋转前的位置"""
+    import cv2
+    
+    rotation = cv2.getRotationMatrix2D((400, 300), 3.0, 1.0)
+    process_info = {'geometry': [
+        {'step': 'crop', 'matrix': [[1, 0, -40], [0, 1, -30]]},
+        {'step': 'skew_correction', 'matrix': rotation.tolist()},
+    ]}
+    # 原图中的点 (240, 130) 裁剪后为 (200, 100)，再经旋转
+    rx, ry = (float(v) for v in rotation @ np.array([200, 100, 1.0]))
+    
+    mapped = map_bbox_to_original({'top_left_x': rx, 'top_left_y': ry, 'width': 0, 'height': 0}, process_info)
+    assert mapped == {'top_left_x': 240.0, 'top_left_y': 130.0, 'width': 0.0, 'height': 0.0}
+
+
+def test_map_bbox_without_geometry_is_omitted():
+    """没有记录几何变换的处理信息（旧版本的结果或缓存）不给出原图坐标"""
+    bbox = {'x': 10, 'y': 20, 'width': 30, 'height': 40}
+    assert map_bbox_to_original(bbox, {'crop': {'offset': [5, 5]}}) is None
+    assert map_bbox_to_original(bbox, {'geometry': []}) == bbox
+
+
+def load_demo_image():
+    """仓库中的示例题目图像（RGB）"""
+    from PIL import Image
+    
+    with Image.open(Path(__file__).parent / 'demo.png') as image:
+        return np.array(image.convert('RGB'))
+
+
+def test_opencv_enhancement_matches_pil():
+    """OpenCV实现与PIL ImageEnhance的结果逐像素误差不超过1，原地处理的结果相同"""
+    processor = ImageProcessor()
+    image = load_demo_image()
+    
+    expected = processor._enhance_pil(image).astype(np.int16)
+    enhanced = processor._enhance_opencv(image)
+    assert enhanced.shape == image.shape
+    assert np.abs(enhanced.astype(np.int16) - expected).max() <= 1
+    
+    inplace = image.copy()
+    assert processor._enhance_opencv(inplace, inplace) is inplace
+    assert np.array_equal(inplace, enhanced)
+
+
+def test_opencv_enhancement_makes_fewer_frame_copies():
+    """tracemalloc统计：OpenCV实现占用的整帧缓冲区比PIL实现少，原地处理时不再分配整帧"""
+    processor = ImageProcessor()
+    image = load_demo_image()
+    processor._enhance_pil(image)
+    processor._enhance_opencv(image)  # 导入依赖并分配线程内复用的临时缓冲区
+    
+    _, pil_frames = count_frame_buffers(lambda: processor._enhance_pil(image), image.nbytes)
+    _, opencv_frames = count_frame_buffers(lambda: processor._enhance_opencv(image), image.nbytes)
+    target = image.copy()
+    _, inplace_frames = count_frame_buffers(lambda: processor._enhance_opencv(target, target), image.nbytes)
+    
+    assert pil_frames >= 1
+    assert opencv_frames < pil_frames
+    assert inplace_frames == 0
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+增量处理清单测试
+"""
+
+import json
+import os
+
+from src.incremental import ResultManifest, file_sha256
+from src.result_processor import result_basename
+
+FINGERPRINT = 'f' * 16
+
+
+def write_result(results_dir, name, sha256, fingerprint=FINGERPRINT, html=True):
+    """按 result_basename 的命名写入结果JSON（和HTML）"""
+    json_path = results_dir / f"{result_basename(name)}_result.json"
+    json_path.write_text(json.dumps({'metadata': {'source_sha256': sha256,
+                                                  'pipeline_fingerprint': fingerprint}}))
+    if html:
+        json_path.with_suffix('.html').write_text('<html></html>')
+    return json_path
+
+
+def make_source(directory, name, content=b'image'):
+    """创建源文件"""
+    path = directory / name
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(content)
+    return path
+
+
+def test_result_basename_keeps_subdirectories():
+    """不同子目录中的同名输入得到不同的结果文件名，不含目录时只用文件名"""
+    assert result_basename('q0.png') == 'q0'
+    assert result_basename('2024/sub/q0.png') == '2024__sub__q0'
+    assert result_basename('2024/q0.png') != result_basename('2025/q0.png')
+
+
+def test_skips_recorded_input_until_source_or_config_changes(tmp_path):
+    """记录后的输入被跳过；源文件内容或流水线指纹变化时重新处理"""
+    results_dir = tmp_path / 'results'
+    results_dir.mkdir()
+    source = make_source(tmp_path, 'page.png')
+    sha256 = file_sha256(source)
+    json_path = write_result(results_dir, 'page.png', sha256)
+    
+    manifest = ResultManifest(results_dir)
+    manifest.record(source, sha256, FINGERPRINT, str(json_path))
+    assert manifest.check(source, FINGERPRINT) == (True, sha256)
+    assert manifest.check(source, 'other') == (False, sha256)
+    
+    source.write_bytes(b'changed image')
+    up_to_date, new_sha256 = ResultManifest(results_dir).check(source, FINGERPRINT)
+    assert not up_to_date and new_sha256 != sha256
+
+
+def test_invalidates_missing_or_overwritten_result(tmp_path):
+    """结果文件被删除或被其他输入的结果覆盖时重新处理；内容未变只是修改时间变化时仍跳过"""
+    results_dir = tmp_path / 'results'
+    results_dir.mkdir()
+    source = make_source(tmp_path, 'page.png')
+    sha256 = file_sha256(source)
+    json_path = write_result(results_dir, 'page.png', sha256)
+    manifest = ResultManifest(results_dir)
+    manifest.record(source, sha256, FINGERPRINT, str(json_path))
+    
+    os.utime(json_path, ns=(1, 1))
+    assert manifest.check(source, FINGERPRINT)[0]
+    
+    write_result(results_dir, 'page.png', 'another input')
+    assert not manifest.check(source, FINGERPRINT)[0]
+    
+    json_path.unlink()
+    assert not manifest.check(source, FINGERPRINT)[0]
+
+
+def test_fallback_reads_result_named_by_relative_path(tmp_path):
+    """清单缺失时读取按相对路径命名的结果文件；同名的其他输入的结果和未写完的结果不会被采用"""
+    results_dir = tmp_path / 'results'
+    results_dir.mkdir()
+    first = make_source(tmp_path, '2024/q0.png', b'first')
+    second = make_source(tmp_path, '2025/q0.png', b'second')
+    write_result(results_dir, '2024/q0.png', file_sha256(first))
+    write_result(results_dir, 'q0.png', file_sha256(first))
+    
+    manifest = ResultManifest(results_dir)
+    assert manifest.check(first, FINGERPRINT, '2024/q0.png')[0]
+    assert not manifest.check(second, FINGERPRINT, '2025/q0.png')[0]
+    assert not manifest.check(second, FINGERPRINT)[0]
+    
+    # HTML缺失说明上次写入未完成
+    third = make_source(tmp_path, '2026/q0.png', b'third')
+    write_result(results_dir, '2026/q0.png', file_sha256(third), html=False)
+    assert not manifest.check(third, FINGERPRINT, '2026/q0.png')[0]
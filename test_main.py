@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+"""
+主处理脚本测试
+"""
+
+import threading
+
+import main
+
+FATAL = {
+    'success': False,
+    'error': 'OCR识别失败: 没有可用的Mathpix账号: 所有账号均已摘除（401/402）',
+    'error_info': {'id': 'circuit_open', 'fatal': True, 'retry_in': 60.0}
+}
+
+
+def test_batch_stops_after_fatal_error(tmp_path, monkeypatch, capsys):
+    """账号全部失效后不再派发剩余输入，这些输入按推迟统计而不是失败"""
+    from PIL import Image
+    
+    paths = []
+    for i in range(8):
+        path = tmp_path / f"page{i}.png"
+        Image.new('L', (8, 8), 255).save(path)
+        paths.append((path, path.name))
+    
+    calls = []
+    lock = threading.Lock()
+    
+    def process_image(image_path, **kwargs):
+        with lock:
+            calls.append(image_path)
+        return dict(FATAL)
+    
+    monkeypatch.setattr(main, 'process_image', process_image)
+    assert main.run_batch(paths, force=True, workers=1) == 1
+    
+    output = capsys.readouterr().out
+    assert '失败 1' in output
+    assert f"{len(paths) - 1} 个输入因账号不可用未处理" in output
+    assert '剩余额度' not in output
+    # 停止前最多还有一个已派发的任务
+    assert len(calls) <= 2
@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+"""
+Mathpix客户端测试
+"""
+
+import email
+import email.policy
+import json
+import os
+import random
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+from src.config import TIMEOUT, TIMEOUT_MIN, TIMEOUT_P99_MULTIPLIER
+from src.latency import LatencyTracker
+from src.mathpix_client import MathpixClient, RequestPayload, RetryPolicy, _BodyReader, parse_retry_after
+
+
+@contextmanager
+def capture_server():
+    """启动本地HTTP服务器，记录收到的每个POST请求的请求头和原始请求体"""
+    received = []
+    
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            length = int(self.headers.get('Content-Length', 0))
+            received.append({'headers': self.headers, 'body': self.rfile.read(length)})
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.end_headers()
+            self.wfile.write(b'{}')
+        
+        def log_message(self, format, *args):
+            pass
+    
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield f"http://127.0.0.1:{server.server_address[1]}/v3/text", received
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def post(url: str, payload: RequestPayload) -> requests.Response:
+    """与 MathpixClient._post 相同的发送方式：以 _BodyReader 流作为请求体"""
+    with requests.Session() as session:
+        # 不经过环境变量中的代理
+        session.trust_env = False
+        return session.post(url, data=payload.body(),
+                            headers={'Content-Type': payload.content_type}, timeout=10)
+
+
+def test_multipart_body_parses_on_server():
+    """multipart请求体能被服务器按 Content-Type 中的boundary解析，Content-Length 与发送的字节数一致"""
+    # 跨越多个读取块的PNG，验证 _BodyReader 分块读取时的部分边界
+    image = b'\x89PNG\r\n\x1a\n' + os.urandom(200_000)
+    options = {'formats': ['text', 'latex_styled'], 'math_inline_delimiters': ['$', '$']}
+    payload = RequestPayload(image, options, transport='multipart')
+    
+    with capture_server() as (url, received):
+        assert post(url, payload).status_code == 200
+    
+    request = received[0]
+    body = request['body']
+    assert 'chunked' not in request['headers'].get('Transfer-Encoding', '')
+    assert int(request['headers']['Content-Length']) == len(body) == payload.size
+    
+    message = email.message_from_bytes(
+        f"Content-Type: {request['headers']['Content-Type']}\r\n\r\n".encode('ascii') + body,
+        policy=email.policy.HTTP
+    )
+    assert message.is_multipart()
+    parts = {part.get_param('name', header='content-disposition'): part for part in message.iter_parts()}
+    assert set(parts) == {'options_json', 'file'}
+    assert json.loads(parts['options_json'].get_content()) == options
+    assert parts['file'].get_filename() == 'image.png'
+    assert parts['file'].get_content_type() == 'image/png'
+    assert parts['file'].get_payload(decode=True) == image
+
+
+def test_json_body_matches_content_length():
+    """json方式发送的请求体是完整的JSON，Content-Length 与发送的字节数一致"""
+    image = b'\xff\xd8\xff' + os.urandom(1000)
+    payload = RequestPayload(image, {'formats': ['text']}, transport='json')
+    
+    with capture_server() as (url, received):
+        assert post(url, payload).status_code == 200
+    
+    body = received[0]['body']
+    assert int(received[0]['headers']['Content-Length']) == len(body) == payload.size
+    data = json.loads(body)
+    assert data['formats'] == ['text']
+    assert data['src'].startswith('data:image/jpeg;base64,')
+
+
+def test_body_reader_reassembles_parts():
+    """任意大小的分块读取都能按顺序还原全部缓冲区"""
+    parts = (b'head', os.urandom(10_000), b'tail')
+    for size in (1, 7, 4096, 65536):
+        reader = _BodyReader(parts)
+        chunks = []
+        while True:
+            chunk = reader.read(size)
+            if not chunk:
+                break
+            assert len(chunk) <= size
+            chunks.append(chunk)
+        assert b''.join(chunks) == b''.join(parts)
+        assert len(reader) == sum(len(part) for part in parts)
+
+
+def test_retry_delay_stays_within_jitter_bounds():
+    """等待时间在 [base, max(base, 上次等待 × 3)] 之间，且不超过 max_delay"""
+    policy = RetryPolicy(base_delay=1.0, max_delay=30.0, rng=random.Random(42))
+    for previous in (0.0, 1.0, 4.0, 25.0):
+        upper = min(30.0, max(1.0, previous * 3))
+        delays = [policy.next_delay(previous) for _ in range(500)]
+        assert all(1.0 <= delay <= upper for delay in delays)
+        if upper > 1.0:
+            # 抖动：不同worker不会得到相同的等待时间
+            assert len(set(delays)) > 1
+
+
+def test_retry_after_takes_precedence_over_max_delay():
+    """服务端的 Retry-After 至少等待该时长（可超过 max_delay），额外抖动不超过 base"""
+    policy = RetryPolicy(base_delay=0.5, max_delay=10.0, rng=random.Random(7))
+    for _ in range(200):
+        delay = policy.next_delay(1.0, retry_after=60.0)
+        assert 60.0 <= delay <= 60.5
+        assert policy.next_delay(1.0, retry_after=0.0) >= 0.5
+
+
+def test_parse_retry_after_formats():
+    """Retry-After 支持秒数和HTTP日期，负数和过去的日期视为0，无法解析时为None"""
+    assert parse_retry_after('5') == 5.0
+    assert parse_retry_after(' 1.5 ') == 1.5
+    assert parse_retry_after('-3') == 0.0
+    assert parse_retry_after(None) is None
+    assert parse_retry_after('') is None
+    assert parse_retry_after('soon') is None
+    
+    future = format_datetime(datetime.now(timezone.utc) + timedelta(seconds=30), usegmt=True)
+    assert 25 <= parse_retry_after(future) <= 30
+    past = format_datetime(datetime.now(timezone.utc) - timedelta(hours=1), usegmt=True)
+    assert parse_retry_after(past) == 0.0
+
+
+def make_client(samples, adaptive_timeout=True):
+    """创建记录了给定成功请求延迟的客户端（不发送请求）"""
+    client = MathpixClient(app_id='test', app_key='test', adaptive_timeout=adaptive_timeout)
+    client.latency = LatencyTracker(min_samples=20)
+    for seconds in samples:
+        client.latency.record(seconds)
+    return client
+
+
+def test_adaptive_timeout_waits_for_enough_samples():
+    """样本不足或关闭自适应超时时使用固定超时"""
+    assert make_client([1.0] * 19).current_timeout() == TIMEOUT
+    assert make_client([1.0] * 50, adaptive_timeout=False).current_timeout() == TIMEOUT
+
+
+def test_adaptive_timeout_follows_p99_with_floor_and_cap():
+    """超时为 p99 × 倍数（不低于下限），每次重试加倍，不超过固定超时"""
+    fast = make_client([0.2] * 50)
+    assert fast.current_timeout() == TIMEOUT_MIN
+    assert fast.current_timeout(attempt=1) == TIMEOUT_MIN * 2
+    
+    slow = make_client([1.0] * 49 + [4.0] * 1)
+    expected = max(TIMEOUT_MIN, slow.latency.percentile(99) * TIMEOUT_P99_MULTIPLIER)
+    assert slow.current_timeout() == min(TIMEOUT, expected)
+    assert slow.current_timeout(attempt=10) == TIMEOUT
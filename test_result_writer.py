@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+结果写入模块测试
+"""
+
+import os
+import stat
+
+from src import result_writer
+from src.result_writer import ResultWriter, all_written
+
+
+def leftover_temp_files(directory):
+    """写入过程中留下的临时文件"""
+    return [path.name for path in directory.iterdir() if path.name.endswith('.tmp')]
+
+
+def test_written_file_has_umask_permissions(tmp_path):
+    """结果文件的权限与 open() 新建的文件相同（0666 去掉 umask），而不是临时文件的0600"""
+    writer = ResultWriter(background=False, fsync_batch=0)
+    target = tmp_path / 'page_result.json'
+    assert writer.submit(target, '{}').result() is True
+    
+    umask = os.umask(0)
+    os.umask(umask)
+    assert stat.S_IMODE(target.stat().st_mode) == 0o666 & ~umask
+    assert target.read_text() == '{}'
+
+
+def test_failed_write_keeps_previous_result(tmp_path):
+    """生成内容失败时保留原有结果文件，不留下临时文件，Future结果为False"""
+    writer = ResultWriter(background=False, fsync_batch=0)
+    target = tmp_path / 'page_result.json'
+    target.write_text('old')
+    
+    def broken():
+        raise ValueError('编码失败')
+    
+    assert writer.submit(target, broken).result() is False
+    assert target.read_text() == 'old'
+    assert leftover_temp_files(tmp_path) == []
+    assert writer.get_stats()['failed'] == 1
+
+
+def test_failed_rename_leaves_no_partial_file(tmp_path, monkeypatch):
+    """重命名失败时不出现目标文件，临时文件被删除"""
+    writer = ResultWriter(background=False, fsync_batch=0)
+    target = tmp_path / 'page_result.html'
+    
+    def fail_replace(src, dst):
+        raise OSError('磁盘已满')
+    
+    monkeypatch.setattr(result_writer.os, 'replace', fail_replace)
+    assert writer.submit(target, '<html></html>').result() is False
+    assert not target.exists()
+    assert leftover_temp_files(tmp_path) == []
+
+
+def test_background_writes_complete_before_flush_returns(tmp_path):
+    """后台写入：flush 返回时全部文件已写入，合并的Future在全部成功后为True"""
+    writer = ResultWriter(background=True, fsync_batch=4)
+    futures = [writer.submit(tmp_path / f"{i}_result.json", lambda i=i: str(i)) for i in range(20)]
+    combined = all_written(futures)
+    writer.flush()
+    
+    assert combined.result(timeout=5) is True
+    assert [(tmp_path / f"{i}_result.json").read_text() for i in range(20)] == [str(i) for i in range(20)]
+    assert leftover_temp_files(tmp_path) == []
+    stats = writer.get_stats()
+    assert stats['written'] == 20 and stats['failed'] == 0
+    writer.close()
+
+
+def test_all_written_reports_any_failure(tmp_path):
+    """任意一个文件写入失败时合并结果为False"""
+    writer = ResultWriter(background=False, fsync_batch=0)
+    ok = writer.submit(tmp_path / 'a.json', 'a')
+    failed = writer.submit(tmp_path / 'missing' / 'b.json', 'b')
+    
+    assert all_written([ok, failed]).result() is False
+    assert all_written([]).result() is True
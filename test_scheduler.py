@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+任务调度模块测试
+"""
+
+import threading
+import time
+
+from src.scheduler import JobScheduler
+
+
+class FakeLedger:
+    """可手动设置剩余额度的账本，任务执行时调用 spend 扣减"""
+    
+    def __init__(self, remaining=None):
+        self._remaining = remaining
+        self._lock = threading.Lock()
+    
+    def remaining(self):
+        with self._lock:
+            return self._remaining
+    
+    def set_remaining(self, remaining):
+        with self._lock:
+            self._remaining = remaining
+    
+    def spend(self, count=1):
+        with self._lock:
+            if self._remaining is not None:
+                self._remaining -= count
+
+
+def make_classes(**overrides):
+    """interactive/normal/bulk 三个类别，可覆盖各类别的配置"""
+    classes = {
+        'interactive': {'rank': 0, 'concurrency': 2, 'reserve': 0},
+        'normal': {'rank': 1, 'concurrency': 2, 'reserve': 0},
+        'bulk': {'rank': 2, 'concurrency': 2, 'reserve': 0},
+    }
+    for name, spec in overrides.items():
+        classes[name].update(spec)
+    return classes
+
+
+def test_higher_priority_class_runs_first():
+    """同时排队时先调度rank小的类别，同一类别内先进先出"""
+    ledger = FakeLedger(remaining=0)
+    scheduler = JobScheduler(make_classes(), ledger=ledger, recheck_seconds=0.01)
+    order = []
+    
+    def job(label):
+        order.append(label)
+        return {'success': True}
+    
+    # 额度为0时全部排队；之后额度只够一个进行中的任务，任务按调度顺序逐个执行
+    futures = [scheduler.submit(job, f'bulk{i}', priority='bulk') for i in range(2)]
+    futures += [scheduler.submit(job, f'normal{i}', priority='normal') for i in range(2)]
+    futures += [scheduler.submit(job, f'interactive{i}', priority='interactive') for i in range(2)]
+    ledger.set_remaining(1)
+    for future in futures:
+        future.result(timeout=5)
+    scheduler.close()
+    
+    assert order == ['interactive0', 'interactive1', 'normal0', 'normal1', 'bulk0', 'bulk1']
+
+
+def test_class_concurrency_limit_leaves_workers_for_other_classes():
+    """类别的并发数不超过上限；低优先级类别占满份额时，高优先级任务仍能立即运行"""
+    scheduler = JobScheduler(make_classes(bulk={'concurrency': 2}), ledger=FakeLedger())
+    release = threading.Event()
+    started = threading.Semaphore(0)
+    lock = threading.Lock()
+    running = {'now': 0, 'peak': 0}
+    
+    def bulk_job():
+        with lock:
+            running['now'] += 1
+            running['peak'] = max(running['peak'], running['now'])
+        started.release()
+        release.wait(timeout=5)
+        with lock:
+            running['now'] -= 1
+        return {'success': True}
+    
+    bulk = [scheduler.submit(bulk_job, priority='bulk') for _ in range(6)]
+    assert started.acquire(timeout=5) and started.acquire(timeout=5)
+    interactive = scheduler.submit(lambda: {'success': True}, priority='interactive')
+    
+    assert interactive.result(timeout=5)['success']
+    assert scheduler.stats()['classes']['bulk']['running'] == 2
+    assert scheduler.stats()['classes']['bulk']['pending'] == 4
+    release.set()
+    for future in bulk:
+        future.result(timeout=5)
+    scheduler.close()
+    
+    assert running['peak'] == 2
+
+
+def test_defers_jobs_below_class_reserve():
+    """剩余额度扣除进行中的任务后低于类别保留值时推迟该类任务，关闭时标记为 deferred"""
+    ledger = FakeLedger(remaining=52)
+    scheduler = JobScheduler(make_classes(normal={'reserve': 50}, bulk={'reserve': 200}),
+                             ledger=ledger, recheck_seconds=0.01)
+    release = threading.Event()
+    
+    def job():
+        release.wait(timeout=5)
+        ledger.spend()
+        return {'success': True}
+    
+    bulk = scheduler.submit(job, priority='bulk')
+    normal = [scheduler.submit(job, priority='normal') for _ in range(3)]
+    time.sleep(0.1)
+    
+    # 52 - 2（进行中）- 1 < 50：第三个normal任务等待，bulk任务一直不满足保留值
+    stats = scheduler.stats()
+    assert stats['classes']['normal']['running'] == 2
+    assert stats['reserved'] == 2
+    interactive = scheduler.submit(job, priority='interactive')
+    
+    release.set()
+    scheduler.close()
+    
+    assert interactive.result()['success']
+    assert [future.result()['success'] for future in normal[:2]] == [True, True]
+    for future in (normal[2], bulk):
+        result = future.result()
+        assert result['deferred'] and not result['success']
+        assert result['error_info']['id'] == 'budget_deferred'
+    assert normal[2].result()['error_info']['reserve'] == 50
+    stats = scheduler.stats()
+    assert stats['classes']['normal']['deferred'] == 1
+    assert stats['classes']['bulk']['deferred'] == 1
+    assert ledger.remaining() == 49
+
+
+def test_cancel_pending_keeps_running_jobs():
+    """取消排队中的任务，进行中的任务照常完成；关闭时不再把已取消的任务标记为推迟"""
+    scheduler = JobScheduler(make_classes(normal={'concurrency': 1}), ledger=FakeLedger())
+    release = threading.Event()
+    started = threading.Event()
+    
+    def job():
+        started.set()
+        release.wait(timeout=5)
+        return {'success': True}
+    
+    futures = [scheduler.submit(job) for _ in range(4)]
+    assert started.wait(timeout=5)
+    assert scheduler.cancel_pending() == 3
+    release.set()
+    scheduler.close()
+    
+    assert futures[0].result()['success']
+    assert all(future.cancelled() for future in futures[1:])
+    assert scheduler.stats()['classes']['normal']['pending'] == 0
+    assert scheduler.stats()['classes']['normal']['deferred'] == 0
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+多变体重试模块测试
+"""
+
+import threading
+
+from src.variants import VariantRetrier
+
+
+class FakeImageProcessor:
+    """按变体名称返回“编码结果”的图像处理器，failing 中的变体预处理失败"""
+    
+    def __init__(self, failing=()):
+        self.failing = set(failing)
+    
+    def prepare_upload(self, image_path, variant=None, frame=None):
+        if variant in self.failing:
+            return None
+        return variant.encode(), {'variant': variant, 'cache_hit': False}
+
+
+class FakeClient:
+    """按变体返回预设置信度的客户端，记录每次调用的尝试次数"""
+    
+    def __init__(self, confidences):
+        self.confidences = confidences
+        self.calls = []
+        self._lock = threading.Lock()
+    
+    def process_image(self, image, options=None, retries=3):
+        with self._lock:
+            self.calls.append((image.decode(), retries))
+        confidence = self.confidences.get(image.decode())
+        if confidence is None:
+            return {'success': False, 'error': 'OCR请求失败'}
+        return {'success': True, 'confidence': confidence}
+
+
+def make_retrier(**kwargs):
+    """三个变体、每张图最多两个、阈值0.8的重试器"""
+    options = dict(variants=['binarized', 'upscaled', 'no_denoise'], max_per_image=2,
+                   batch_budget=10, threshold=0.8)
+    options.update(kwargs)
+    return VariantRetrier(**options)
+
+
+LOW = {'success': True, 'confidence': 0.5}
+
+
+def test_keeps_result_above_threshold_without_calls():
+    """置信度不低于阈值时不尝试变体，不消耗预算"""
+    client = FakeClient({})
+    retrier = make_retrier(image_processor=FakeImageProcessor(), mathpix_client=client)
+    result, info = retrier.improve('page.png', {'success': True, 'confidence': 0.9}, {'steps': []})
+    
+    assert result['confidence'] == 0.9 and 'variant_retry' not in info
+    assert client.calls == [] and retrier.spent == 0
+
+
+def test_picks_most_confident_variant_with_single_attempt_each():
+    """选用置信度最高的变体；每个变体只请求一次，预算按实际调用次数扣减"""
+    client = FakeClient({'binarized': 0.7, 'upscaled': 0.95})
+    retrier = make_retrier(image_processor=FakeImageProcessor(), mathpix_client=client)
+    result, info = retrier.improve('page.png', LOW, {'steps': []})
+    
+    assert result['confidence'] == 0.95
+    assert info['variant'] == 'upscaled' and 'cache_hit' not in info
+    assert info['variant_retry']['winner'] == 'upscaled'
+    assert [attempt['variant'] for attempt in info['variant_retry']['attempts']] == \
+        ['default', 'binarized', 'upscaled']
+    assert sorted(client.calls) == [('binarized', 1), ('upscaled', 1)]
+    assert retrier.spent == len(client.calls) == 2
+
+
+def test_keeps_default_when_variants_fail():
+    """变体都失败或不如原结果时保留原结果，并记录各变体的错误"""
+    client = FakeClient({'binarized': 0.3})
+    retrier = make_retrier(image_processor=FakeImageProcessor(), mathpix_client=client)
+    result, info = retrier.improve('page.png', LOW, {'steps': []})
+    
+    assert result is LOW
+    assert info['variant'] == 'default'
+    attempts = {attempt['variant']: attempt for attempt in info['variant_retry']['attempts']}
+    assert attempts['upscaled']['error'] == 'OCR请求失败'
+
+
+def test_preprocessing_failure_does_not_consume_budget():
+    """预处理失败的变体没有调用API，预留的次数退回预算"""
+    client = FakeClient({'upscaled': 0.9})
+    retrier = make_retrier(image_processor=FakeImageProcessor(failing={'binarized'}), mathpix_client=client)
+    result, info = retrier.improve('page.png', LOW, {'steps': []})
+    
+    assert result['confidence'] == 0.9
+    assert client.calls == [('upscaled', 1)]
+    assert retrier.spent == 1
+    attempts = {attempt['variant']: attempt for attempt in info['variant_retry']['attempts']}
+    assert attempts['binarized']['error'] == '预处理失败'
+
+
+def test_batch_budget_shared_across_images():
+    """批次预算在多张图像间共享，用完后不再尝试变体"""
+    client = FakeClient({})
+    retrier = make_retrier(image_processor=FakeImageProcessor(), mathpix_client=client, batch_budget=3)
+    for _ in range(3):
+        retrier.improve('page.png', LOW, {'steps': []})
+    
+    assert len(client.calls) == 3
+    assert retrier.get_budget_info() == {'spent': 3, 'batch_budget': 3, 'remaining': 0}
+
+
+def test_uses_components_passed_by_pipeline():
+    """improve 传入的组件优先于构造时传入的组件"""
+    default_client = FakeClient({'binarized': 0.99})
+    pipeline_client = FakeClient({'binarized': 0.9})
+    retrier = make_retrier(image_processor=FakeImageProcessor(), mathpix_client=default_client,
+                           max_per_image=1)
+    result, _ = retrier.improve('page.png', LOW, {'steps': []},
+                                image_processor=FakeImageProcessor(), mathpix_client=pipeline_client)
+    
+    assert result['confidence'] == 0.9
+    assert default_client.calls == [] and pipeline_client.calls == [('binarized', 1)]
@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+"""
+目录监视模块测试
+"""
+
+import threading
+import time
+
+from src.watcher import FolderWatcher
+
+
+def test_stop_leaves_queued_inputs_in_watch_dir(tmp_path):
+    """停止时正在处理的输入照常完成，排队中的输入留在监视目录，不会被移到失败目录"""
+    watch_dir = tmp_path / 'uploads'
+    watch_dir.mkdir()
+    for i in range(6):
+        (watch_dir / f"page{i}.png").write_bytes(b'image')
+    
+    closed = threading.Event()
+    started = threading.Semaphore(0)
+    
+    def handler(path):
+        # 与守护进程模式相同：调度器关闭后提交任务抛出 RuntimeError
+        if closed.is_set():
+            raise RuntimeError("调度器已关闭")
+        started.release()
+        time.sleep(0.3)
+        return {'success': True, 'written': None}
+    
+    watcher = FolderWatcher(handler, watch_dir=watch_dir,
+                            processed_dir=tmp_path / 'processed', failed_dir=tmp_path / 'failed',
+                            workers=2, poll_interval=0.01, debounce=0, use_inotify=False)
+    thread = threading.Thread(target=watcher.run)
+    thread.start()
+    
+    # 两个worker都开始处理后停止（同 run_watch_mode 的信号处理：先停止监视，再关闭调度器）
+    assert started.acquire(timeout=5) and started.acquire(timeout=5)
+    watcher.stop()
+    closed.set()
+    thread.join(timeout=10)
+    
+    assert not thread.is_alive()
+    assert watcher.stats['processed'] == 2
+    assert watcher.stats['failed'] == 0
+    assert not (tmp_path / 'failed').exists()
+    assert len(list(watch_dir.iterdir())) == 4